@@ -51,6 +51,25 @@ CREATE TABLE `backup_objects` (
 ) ENGINE=InnoDB AUTO_INCREMENT=6352 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `backup_phases`
+--
+
+DROP TABLE IF EXISTS `backup_phases`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `backup_phases` (
+  `backup_id` int(10) unsigned NOT NULL,
+  `phase` varchar(100) CHARACTER SET latin1 NOT NULL,
+  `start_date` timestamp NULL DEFAULT NULL,
+  `wall_time` double DEFAULT NULL,
+  `cpu_time` double DEFAULT NULL,
+  `bytes_before` bigint(20) unsigned DEFAULT NULL,
+  `bytes_after` bigint(20) unsigned DEFAULT NULL,
+  PRIMARY KEY (`backup_id`,`phase`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `backups`
 --
@@ -69,6 +88,10 @@ CREATE TABLE `backups` (
   `start_date` timestamp NOT NULL DEFAULT '1970-01-01 00:00:01',
   `end_date` timestamp NULL DEFAULT NULL,
   `total_size` bigint(20) unsigned DEFAULT NULL,
+  `heartbeat_date` timestamp NULL DEFAULT NULL,
+  `current_size` bigint(20) unsigned DEFAULT NULL,
+  `throughput` double DEFAULT NULL,
+  `eta_date` timestamp NULL DEFAULT NULL,
   PRIMARY KEY (`id`),
   KEY `last_backup` (`type`,`section`,`status`,`start_date`)
 ) ENGINE=InnoDB AUTO_INCREMENT=10646 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
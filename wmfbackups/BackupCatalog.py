@@ -0,0 +1,123 @@
+"""
+Catalog of the backups stored on the backup dirs (ongoing, latest, archive, ...)
+
+All backup discovery (finding the backup to postprocess, rotation, purging,
+recovery) shares the same name format, parsed in a single place, and an index
+by type, section and date built from a single scan of each directory.
+"""
+
+from collections import defaultdict, namedtuple
+import datetime
+import os
+import re
+
+from wmfbackups.FileWalker import list_dir
+
+DATE_FORMAT = '%Y-%m-%d--%H-%M-%S'
+SECTION_REGEX = r'[^/\.]+'
+# FIXME: backups will stop working on Jan 1st 2100
+DATE_REGEX = r'20\d\d-[01]\d-[0123]\d\--\d\d-\d\d-\d\d'
+EXTENSION_REGEX = r'\.[a-z0-9\.]+'
+# type.section.date[.extension], e.g. dump.s1.2022-01-01--00-00-00.tar.gz
+BACKUP_NAME_REGEX = re.compile(r'([a-z]+)\.(' + SECTION_REGEX + r')\.(' + DATE_REGEX + r')('
+                               + EXTENSION_REGEX + r')?$')
+
+
+class BackupRecord(namedtuple('BackupRecord', ['directory', 'name', 'type', 'section', 'date',
+                                               'extension', 'is_dir'])):
+    """
+    A backup file or dir found on directory, e.g. name='dump.s1.2022-01-01--00-00-00.tar.gz',
+    type='dump', section='s1', date=datetime(2022, 1, 1), extension='.tar.gz' ('' if none)
+    """
+    __slots__ = ()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, self.name)
+
+    @property
+    def dir_name(self):
+        """Name without extension, e.g. dump.s1.2022-01-01--00-00-00"""
+        return self.name[:len(self.name) - len(self.extension)]
+
+
+def parse_backup_name(name):
+    """
+    Returns a (type, section, date, extension) tuple from the given backup file or
+    dir name, or None if it does not have the backup name format.
+    """
+    match = BACKUP_NAME_REGEX.match(name)
+    if match is None:
+        return None
+    try:
+        date = datetime.datetime.strptime(match.group(3), DATE_FORMAT)
+    except ValueError:  # e.g. month 19
+        return None
+    return (match.group(1), match.group(2), date, match.group(4) or '')
+
+
+class BackupCatalog:
+    """
+    Index of the backups found on the given directories, by type and section,
+    sorted by date. Missing directories are considered empty.
+    Backups moved or deleted through it keep the index up to date, so each
+    directory only needs to be scanned once.
+    """
+
+    def __init__(self, directories):
+        self.directories = [os.path.normpath(directory) for directory in directories]
+        # (directory or None for all of them, type, section): records, oldest first
+        self.index = defaultdict(list)
+
+    def scan(self):
+        """(Re)reads the contents of all directories. Raises OSError if one cannot be read."""
+        self.index.clear()
+        for directory in self.directories:
+            try:
+                entries = list_dir(directory)
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                parsed = parse_backup_name(entry.name)
+                if parsed is not None:
+                    self.add(BackupRecord(directory, entry.name, *parsed,
+                                          is_dir=entry.is_dir(follow_symlinks=False)))
+        return self
+
+    def add(self, record):
+        for key in [(record.directory, record.type, record.section),
+                    (None, record.type, record.section)]:
+            records = self.index[key]
+            records.append(record)
+            records.sort(key=lambda r: (r.date, r.name))
+
+    def remove(self, record):
+        for key in [(record.directory, record.type, record.section),
+                    (None, record.type, record.section)]:
+            self.index[key].remove(record)
+
+    def move(self, record, directory):
+        """Updates the index after record was moved to directory, returns the new record"""
+        self.remove(record)
+        moved = record._replace(directory=os.path.normpath(directory))
+        self.add(moved)
+        return moved
+
+    def backups(self, type, section, directory=None):
+        """
+        Returns the list of backups of the given type and section, oldest first,
+        found on directory (or any of the directories, if None)
+        """
+        if directory is not None:
+            directory = os.path.normpath(directory)
+        return list(self.index.get((directory, type, section), []))
+
+    def latest(self, type, section, directory=None):
+        """
+        Returns the most recent backup of the given type and section found on directory
+        (or any of the directories, if None), or None if there is none
+        """
+        if directory is not None:
+            directory = os.path.normpath(directory)
+        records = self.index.get((directory, type, section))
+        return records[-1] if records else None
@@ -1,10 +1,181 @@
+import fcntl
+import json
 import logging
 import os
 import pymysql
+import queue
+import re
 import socket
+import threading
+import time
+
+from wmfbackups.FileWalker import walk
+from wmfbackups.PhaseTimer import PhaseTiming
 
 
 DEFAULT_STATS_FILE = '/etc/wmfbackups/statistics.ini'
+DEFAULT_BATCH_SIZE = 1000  # number of rows per multi-row insert of file metadata
+DEFAULT_SPOOL_DIR = '/var/spool/wmfbackups'
+DEFAULT_SPOOL_FLUSH_TIMEOUT = 0  # max seconds to wait for pending events to be shipped
+SPOOL_EXTENSION = '.spool'
+# mydumper files: db-schema-create.sql.gz, db-schema-post.sql.gz (database level) and
+# db.table-schema.sql.gz, db.table-schema-triggers.sql.gz, db.table.00000.sql.gz (table level)
+DUMP_DATABASE_FILE_REGEX = r'^(.+)-schema-(create|post)\.sql(\.[a-z]+)?$'
+DUMP_TABLE_FILE_REGEX = r'^([^.]+)\.([^.]+?)(-schema[a-z\-]*)?(\.\d+)?\.sql(\.[a-z]+)?$'
+DUMP_ARCHIVE_EXTENSION = '.gz.tar'  # per-database archives, see MyDumperBackup.archive_databases
+SNAPSHOT_ARCHIVE_EXTENSION = '.tar'  # per-database archives, see MariaBackup.archive_databases
+
+
+def get_backup_object(backup_type, file_path, file_name):
+    """
+    Returns the (database, table) tuple the given backup file belongs to, with table
+    being None for database-level files (e.g. the database creation or per-database
+    archives), or None if it does not belong to any database (e.g. metadata or logs).
+    Dumps have their files, named after the objects, on the top dir; snapshots have one
+    subdirectory per database (or a tar file per database, once archived).
+    """
+    if backup_type == 'dump':
+        if file_path != '':
+            return None
+        if file_name.endswith(DUMP_ARCHIVE_EXTENSION):
+            return (file_name[:-len(DUMP_ARCHIVE_EXTENSION)], None)
+        match = re.match(DUMP_DATABASE_FILE_REGEX, file_name)
+        if match is not None:
+            return (match.group(1), None)
+        match = re.match(DUMP_TABLE_FILE_REGEX, file_name)
+        if match is not None:
+            return (match.group(1), match.group(2))
+        return None
+    if backup_type == 'snapshot':
+        if file_path == '':
+            if file_name.endswith(SNAPSHOT_ARCHIVE_EXTENSION):
+                return (file_name[:-len(SNAPSHOT_ARCHIVE_EXTENSION)], None)
+            return None
+        path = file_path.split(os.sep)
+        if len(path) > 1 or file_name == 'db.opt':
+            return (path[0], None)
+        # e.g. table.ibd, table.frm, table#P#p1.ibd (partitions)
+        table = file_name.rsplit('.', 1)[0]
+        table = re.split('#[Pp]#', table)[0]
+        return (path[0], table)
+    return None
+
+
+# the transfer of a remote snapshot is recorded as a phase, as it happens before its entry exists
+TRANSFER_EXPRESSION = ("COALESCE((SELECT SUM(wall_time) FROM backup_phases "
+                       "WHERE backup_id = backups.id AND phase = 'transfer'), 0)")
+DURATION_EXPRESSION = "TIMESTAMPDIFF(SECOND, start_date, end_date) + " + TRANSFER_EXPRESSION
+
+
+def query_previous_value(db, expression, type, section):
+    """
+    Returns the integer value of the given SQL expression (aliased as value) for the last
+    finished backup of the given type and section, or None if there is none, the value
+    is NULL or it could not be queried
+    """
+    logger = logging.getLogger('backup')
+    query = ("SELECT {} AS value FROM backups WHERE type = %s and section = %s and "
+             "status = 'finished' and {} IS NOT NULL ORDER BY start_date DESC LIMIT 1"
+             .format(expression, expression))
+    with db.cursor(pymysql.cursors.DictCursor) as cursor:
+        try:
+            cursor.execute(query, (type, section))
+        except (pymysql.err.ProgrammingError, pymysql.err.InternalError):
+            logger.error('A MySQL error occurred while querying the previous backup of %s',
+                         section)
+            return None
+        data = cursor.fetchall()
+    if len(data) != 1:
+        return None
+    return int(data[0]['value'])
+
+
+def query_previous_size(db, type, section):
+    """
+    Returns the total size of the last finished backup of the given type and section,
+    or None if there is none or it could not be queried
+    """
+    return query_previous_value(db, 'total_size', type, section)
+
+
+def query_previous_duration(db, type, section):
+    """
+    Returns the duration, in seconds, of the last finished backup of the given type and
+    section, or None if there is none or it could not be queried. For remote snapshots,
+    it includes the transfer done before their entry was created (its transfer phase).
+    """
+    return query_previous_value(db, DURATION_EXPRESSION, type, section)
+
+
+def query_previous_transfer_time(db, type, section):
+    """
+    Returns the duration, in seconds, of the transfer phase of the last finished backup of
+    the given type and section (0 if it had none, e.g. dumps), or None if there is no backup
+    or it could not be queried
+    """
+    return query_previous_value(db, TRANSFER_EXPRESSION, type, section)
+
+
+HEARTBEAT_QUERY = ("UPDATE backups SET heartbeat_date = FROM_UNIXTIME(%s), current_size = %s, "
+                   "throughput = %s, eta_date = FROM_UNIXTIME(%s) WHERE id = %s")
+
+
+def lock_spool(spool, blocking=True):
+    """
+    Locks the given open spool file exclusively, so only one backup or replay uses it at
+    a time. If blocking is False, it returns False instead of waiting if it is in use.
+    """
+    try:
+        fcntl.flock(spool, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def is_same_file(spool, path):
+    """Returns True if the open spool file is still the one at path (e.g. it was not deleted)"""
+    try:
+        return os.fstat(spool.fileno()).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
+
+
+class StatsSession:
+    """
+    Keeps a single connection to the statistics database open during the whole
+    backup run, reconnecting if it was lost (e.g. after a long idle period).
+    """
+
+    def __init__(self, stats_file):
+        self.stats_file = stats_file
+        self.db = None
+
+    def connect(self):
+        """
+        Returns an open connection to the statistics database, creating it on first use
+        or reconnecting it if it was closed. Returns None if it could not connect.
+        """
+        logger = logging.getLogger('backup')
+        try:
+            if self.db is None:
+                self.db = pymysql.connect(read_default_file=self.stats_file)
+            else:
+                self.db.ping(reconnect=True)
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            logger.exception('We could not connect to the stats db with config %s',
+                             self.stats_file)
+            self.db = None
+            return None
+        return self.db
+
+    def close(self):
+        """Closes the connection, if open. A later connect() will open a new one."""
+        if self.db is not None:
+            try:
+                self.db.close()
+            except pymysql.err.Error:
+                pass
+            self.db = None
 
 
 class BackupStatistics:
@@ -13,6 +184,8 @@ class BackupStatistics:
     and store the backup statistics.
     """
 
+    inventory = None  # (files, total_size) of the backup, once read
+
     def __init__(self, dir_name, section, type, source, backup_dir, config):
         self.dump_name = dir_name
         self.section = section
@@ -23,6 +196,9 @@ class BackupStatistics:
     def start(self):
         pass
 
+    def resume(self):
+        pass
+
     def gather_metrics(self):
         pass
 
@@ -35,6 +211,67 @@ class BackupStatistics:
     def delete(self):
         pass
 
+    def close(self):
+        pass
+
+    def record_phase(self, timing):
+        pass
+
+    def heartbeat(self, progress):
+        pass
+
+    def get_previous_size(self):
+        pass
+
+    def take_inventory(self):
+        """
+        Reads the file list and total size of the backup, to be used by gather_metrics(),
+        so the metrics can be gathered later (e.g. while the backup is being archived and
+        compressed, which modifies its files). Returns True if it was successful.
+        """
+        logger = logging.getLogger('backup')
+        files = list()
+        try:
+            total_size = self.file_traversal(top_dir=self.backup_dir, files=files)
+        except OSError:
+            logger.exception('An error occurred while traversing the individual backup files')
+            return False
+        self.inventory = (files, total_size)
+        return True
+
+    def file_traversal(self, top_dir, files):
+        """
+        Traverses top_dir and its subdirs (without following symbolic links), appends a
+        (file_path, file_name, size, file_date) tuple for each entry found to the
+        'files' list, and returns the total size of the directory.
+        Raises OSError if a file or directory could not be read.
+        """
+        total_size = 0
+        for entry in walk(top_dir):
+            total_size += entry.size
+            files.append((entry.path, entry.name, entry.size, entry.mtime))
+        return total_size
+
+    def get_object_sizes(self, files):
+        """
+        Given a list of (file_path, file_name, size, file_date) tuples, returns a
+        dictionary with the aggregated size of each (database, table) and each
+        (database, None) object, and a list with the object each file belongs to
+        (None for the files not belonging to any).
+        """
+        objects = dict()
+        file_objects = list()
+        for file_path, file_name, size, _ in files:
+            backup_object = get_backup_object(self.type, file_path, file_name)
+            file_objects.append(backup_object)
+            if backup_object is None:
+                continue
+            objects[backup_object] = objects.get(backup_object, 0) + size
+            database = (backup_object[0], None)
+            if backup_object != database:
+                objects[database] = objects.get(database, 0) + size
+        return objects, file_objects
+
 
 class DisabledBackupStatistics(BackupStatistics):
     """
@@ -44,6 +281,12 @@ class DisabledBackupStatistics(BackupStatistics):
     def __init__(self):
         pass
 
+    def take_inventory(self):
+        pass
+
+    def gather_metrics(self):
+        return True  # nothing to store
+
 
 class DatabaseBackupStatistics(BackupStatistics):
     """
@@ -60,14 +303,25 @@ class DatabaseBackupStatistics(BackupStatistics):
             self.source = source
         self.backup_dir = backup_dir
         self.config = config
+        self.batch_size = int(config.get('batch_size', DEFAULT_BATCH_SIZE))
+        self.session = StatsSession(config.get('stats_file', DEFAULT_STATS_FILE))
+        # gather_metrics() has its own connection, so other events can be stored meanwhile
+        self.metrics_session = StatsSession(config.get('stats_file', DEFAULT_STATS_FILE))
+        # other events can be recorded from several threads (e.g. the phases running on
+        # a TaskGraph), but a connection cannot be used by more than one at a time
+        self.lock = threading.Lock()
+        self.backup_id = None  # backups.id of the entry inserted on start()
 
     def find_backup_id(self, db):
         """
-        Queries the metadata database to find an ongoing backup in the last
-        week with the self properties (name, type, source & destination).
-        Returns its metadata backups.id value.
+        Returns the metadata backups.id value of the current backup. If it was not
+        inserted by this same object, it queries the metadata database to find an
+        ongoing backup in the last week with the self properties (name, type, source
+        & destination).
         """
         logger = logging.getLogger('backup')
+        if self.backup_id is not None:
+            return self.backup_id
         host = socket.getfqdn()
         query = ("SELECT id FROM backups WHERE name = %s and "
                  "status = 'ongoing' and type = %s and source = %s and "
@@ -85,7 +339,8 @@ class DatabaseBackupStatistics(BackupStatistics):
             logger.error('We could not find one stat entry for an ongoing backup')
             return None
         else:
-            return str(data[0]['id'])
+            self.backup_id = str(data[0]['id'])
+            return self.backup_id
 
     def set_status(self, status):
         """
@@ -98,12 +353,8 @@ class DatabaseBackupStatistics(BackupStatistics):
         Returns True if it was successful, False otherwise.
         """
         logger = logging.getLogger('backup')
-        stats_file = self.config.get('stats_file', DEFAULT_STATS_FILE)
-        try:
-            db = pymysql.connect(read_default_file=stats_file)
-        except (pymysql.err.OperationalError):
-            logger.exception('We could not connect to the stats db with config %s',
-                             stats_file)
+        db = self.session.connect()
+        if db is None:
             return False
         if status == 'ongoing':
             if self.section is None or self.source is None:
@@ -125,6 +376,7 @@ class DatabaseBackupStatistics(BackupStatistics):
                 logger.error('We could not store the information on the database')
                 return False
             db.commit()
+            self.backup_id = str(cursor.lastrowid)
             return True
         elif status in ('finished', 'failed', 'deleted'):
             backup_id = self.find_backup_id(db)
@@ -148,73 +400,127 @@ class DatabaseBackupStatistics(BackupStatistics):
             logger.error('Invalid status: {}'.format(status))
             return False
 
-    def recursive_file_traversal(self, db, backup_id, top_dir, directory):
+    def get_object_ids(self, db, backup_id):
         """
-        Traverses 'directory' and its subdirs (assuming top_dir is the absolute starting path),
-        inserts metadata on database 'db',
-        and returns the total size of the directory, or None if there was an error.
+        Returns a dictionary with the backup_objects id of each (database, table) object
+        registered for the given backup, or None if there was an error.
         """
         logger = logging.getLogger('backup')
-        total_size = 0
-        # TODO: capture file errors
-        for name in sorted(os.listdir(os.path.join(top_dir, directory))):
-            path = os.path.join(top_dir, directory, name)
-            statinfo = os.stat(path)
-            size = statinfo.st_size
-            total_size += size
-            time = statinfo.st_mtime
-            # TODO: Identify which object this files corresponds to and record it on
-            #       backup_objects
+        query = "SELECT id, db, name FROM backup_objects WHERE backup_id = %s"
+        with db.cursor(pymysql.cursors.DictCursor) as cursor:
+            try:
+                cursor.execute(query, (backup_id, ))
+            except (pymysql.err.ProgrammingError, pymysql.err.InternalError):
+                logger.error('A MySQL error occurred while reading the backup objects')
+                return None
+            data = cursor.fetchall()
+        return {(row['db'], row['name']): row['id'] for row in data}
+
+    def insert_object_list(self, db, backup_id, objects):
+        """
+        Inserts the given dictionary of (database, table): size objects on the
+        backup_objects table, in batches of up to self.batch_size rows, skipping the
+        ones already registered for the backup. It does not commit.
+        Returns a dictionary with the id of each object, or None if there was an error.
+        """
+        logger = logging.getLogger('backup')
+        object_ids = self.get_object_ids(db, backup_id)
+        if object_ids is None:
+            return None
+        new_objects = [(key, size) for key, size in sorted(objects.items(), key=str)
+                       if key not in object_ids]
+        for offset in range(0, len(new_objects), self.batch_size):
+            batch = new_objects[offset:offset + self.batch_size]
+            query = ("INSERT INTO backup_objects (backup_id, db, name, size) VALUES " +
+                     ', '.join(["(%s, %s, %s, %s)"] * len(batch)))
+            parameters = list()
+            for (database, table), size in batch:
+                parameters.extend([backup_id, database, table, size])
             with db.cursor(pymysql.cursors.DictCursor) as cursor:
-                query = ("INSERT INTO backup_files "
-                         "(backup_id, file_path, file_name, size, file_date, backup_object_id) "
-                         "VALUES (%s, %s, %s, %s, FROM_UNIXTIME(%s), NULL)")
                 try:
-                    result = cursor.execute(query, (backup_id, directory, name, size, time))
+                    result = cursor.execute(query, parameters)
                 except (pymysql.err.ProgrammingError, pymysql.err.InternalError):
-                    logger.error('A MySQL error occurred while inserting the backup '
-                                 'file details')
+                    logger.error('A MySQL error occurred while inserting the backup objects')
                     return None
-            if result != 1:
-                logger.error('We could not insert details about file {}'.format(name))
+            if result != len(batch):
+                logger.error('We could not insert details about %s objects', len(batch) - result)
                 return None
-            # traverse subdir
-            # TODO: Check for links to avoid infinite recursivity
-            if os.path.isdir(path):
-                dir_size = self.recursive_file_traversal(db,
-                                                         backup_id,
-                                                         top_dir,
-                                                         os.path.join(directory, name))
-                if dir_size is None:
-                    return None
-                else:
-                    total_size += dir_size
-        return total_size
+        if len(new_objects) == 0:
+            return object_ids
+        return self.get_object_ids(db, backup_id)
+
+    def insert_file_list(self, db, backup_id, files, ignore_duplicates=False):
+        """
+        Inserts the given list of (file_path, file_name, size, file_date,
+        backup_object_id) tuples on the backup_files table, using multi-row inserts of up to self.batch_size rows each.
+        It does not commit, so the whole list can be written in a single transaction.
+        If ignore_duplicates is True, files already registered for the backup are skipped
+        (so the same list can be safely inserted more than once).
+        Returns True if all rows were inserted, False otherwise.
+        """
+        logger = logging.getLogger('backup')
+        row_format = "(%s, %s, %s, %s, FROM_UNIXTIME(%s), %s)"
+        for offset in range(0, len(files), self.batch_size):
+            batch = files[offset:offset + self.batch_size]
+            query = ("INSERT " + ("IGNORE " if ignore_duplicates else "") + "INTO backup_files "
+                     "(backup_id, file_path, file_name, size, file_date, backup_object_id) "
+                     "VALUES " + ', '.join([row_format] * len(batch)))
+            parameters = list()
+            for file_path, file_name, size, file_date, backup_object_id in batch:
+                parameters.extend([backup_id, file_path, file_name, size, file_date,
+                                   backup_object_id])
+            with db.cursor(pymysql.cursors.DictCursor) as cursor:
+                try:
+                    result = cursor.execute(query, parameters)
+                except (pymysql.err.ProgrammingError, pymysql.err.InternalError):
+                    logger.error('A MySQL error occurred while inserting the backup '
+                                 'file details')
+                    return False
+            if result != len(batch) and not ignore_duplicates:
+                logger.error('We could not insert details about %s files', len(batch) - result)
+                return False
+        return True
 
     def gather_metrics(self):
         """
         Gathers the file name list, last modification and sizes for the generated files
-        and stores it on the given statistics mysql database.
+        (as read by take_inventory(), if it was called before) and stores it on the given
+        statistics mysql database, in a single transaction.
         """
+        try:
+            return self.store_metrics()
+        finally:
+            self.metrics_session.close()
+
+    def store_metrics(self):
         logger = logging.getLogger('backup')
-        stats_file = self.config.get('stats_file', DEFAULT_STATS_FILE)
         # Find the completed backup db entry
-        try:
-            db = pymysql.connect(read_default_file=stats_file)
-        except (pymysql.err.OperationalError):
-            logger.exception('We could not connect to the stats db with the config %s',
-                             stats_file)
+        db = self.metrics_session.connect()
+        if db is None:
             return False
         backup_id = self.find_backup_id(db)
         if backup_id is None:
             return False
 
         # Insert the backup file list
-        total_size = self.recursive_file_traversal(db=db, backup_id=backup_id,
-                                                   top_dir=self.backup_dir, directory='')
-        if total_size is None:
-            logger.error('An error occurred while traversing the individual backup files')
+        if self.inventory is None and not self.take_inventory():
+            return False
+        files, total_size = self.inventory
+        objects, file_objects = self.get_object_sizes(files)
+        start_time = time.monotonic()
+        object_ids = self.insert_object_list(db, backup_id, objects)
+        if object_ids is None:
+            db.rollback()
+            return False
+        rows = [file + (object_ids.get(backup_object), )
+                for file, backup_object in zip(files, file_objects)]
+        if not self.insert_file_list(db, backup_id, rows):
+            db.rollback()
             return False
+        elapsed = time.monotonic() - start_time
+        logger.info('Inserted %s file and %s object entries in %.3f seconds (%.0f rows/s, '
+                    'batches of %s rows)', len(files), len(objects), elapsed,
+                    (len(files) + len(objects)) / elapsed if elapsed > 0 else 0, self.batch_size)
 
         # Update the total backup size
         with db.cursor(pymysql.cursors.DictCursor) as cursor:
@@ -223,18 +529,538 @@ class DatabaseBackupStatistics(BackupStatistics):
                 result = cursor.execute(query, (total_size, backup_id))
             except (pymysql.err.ProgrammingError, pymysql.err.InternalError):
                 logger.error('A MySQL error occurred while updating the total backup size')
+                db.rollback()
                 return False
         db.commit()
         return result == 1
 
+    def insert_phase(self, db, backup_id, timing):
+        """
+        Inserts the given PhaseTiming on the backup_phases table. It does not commit.
+        An already registered phase (e.g. one redone by a resumed run) is overwritten.
+        Returns True if it was successful, False otherwise.
+        """
+        logger = logging.getLogger('backup')
+        query = ("INSERT INTO backup_phases "
+                 "(backup_id, phase, start_date, wall_time, cpu_time, bytes_before, bytes_after) "
+                 "VALUES (%s, %s, FROM_UNIXTIME(%s), %s, %s, %s, %s) "
+                 "ON DUPLICATE KEY UPDATE start_date = VALUES(start_date), "
+                 "wall_time = VALUES(wall_time), cpu_time = VALUES(cpu_time), "
+                 "bytes_before = VALUES(bytes_before), bytes_after = VALUES(bytes_after)")
+        with db.cursor(pymysql.cursors.DictCursor) as cursor:
+            try:
+                cursor.execute(query, (backup_id, timing.phase, timing.start, timing.wall_time,
+                                       timing.cpu_time, timing.bytes_before, timing.bytes_after))
+            except pymysql.err.MySQLError:
+                # a statistic that cannot be stored must never make the backup fail
+                logger.error('A MySQL error occurred while inserting the timing of the %s phase',
+                             timing.phase)
+                return False
+        return True
+
+    def record_phase(self, timing):
+        """
+        Stores the given PhaseTiming of the current backup.
+        Returns True if it was successful, False otherwise.
+        """
+        with self.lock:
+            db = self.session.connect()
+            if db is None:
+                return False
+            backup_id = self.find_backup_id(db)
+            if backup_id is None:
+                return False
+            if not self.insert_phase(db, backup_id, timing):
+                db.rollback()
+                return False
+            db.commit()
+        return True
+
+    def heartbeat(self, progress):
+        """
+        Updates the entry of the ongoing backup with the progress dictionary generated by
+        ProgressMonitor. Returns True if it was successful, False otherwise.
+        """
+        logger = logging.getLogger('backup')
+        with self.lock:
+            db = self.session.connect()
+            if db is None:
+                return False
+            # any error (e.g. a lost connection) is only logged, so the monitor keeps sampling
+            try:
+                backup_id = self.find_backup_id(db)
+                if backup_id is None:
+                    return False
+                with db.cursor(pymysql.cursors.DictCursor) as cursor:
+                    cursor.execute(HEARTBEAT_QUERY, (progress['time'], progress['bytes'],
+                                                     progress['throughput'], progress['eta'],
+                                                     backup_id))
+                db.commit()
+            except pymysql.err.MySQLError:
+                logger.error('A MySQL error occurred while updating the backup progress')
+                try:
+                    db.rollback()
+                except pymysql.err.MySQLError:
+                    pass
+                return False
+        return True
+
+    def get_previous_size(self):
+        with self.lock:
+            db = self.session.connect()
+            if db is None:
+                return None
+            return query_previous_size(db, self.type, self.section)
+
+    def start(self):
+        with self.lock:
+            self.set_status('ongoing')
+
+    def resume(self):
+        """
+        Reuses the entry of a previous run of the same backup (same name, type, source
+        and host), setting it back to ongoing, so statistics already stored by it are
+        kept. If there is none, a new entry is inserted.
+        Returns True if it was successful, False otherwise.
+        """
+        logger = logging.getLogger('backup')
+        with self.lock:
+            db = self.session.connect()
+            if db is None:
+                return False
+            query = ("SELECT id FROM backups WHERE name = %s and type = %s and source = %s and "
+                     "host = %s ORDER BY id DESC LIMIT 1")
+            with db.cursor(pymysql.cursors.DictCursor) as cursor:
+                try:
+                    cursor.execute(query, (self.dump_name, self.type, self.source,
+                                           socket.getfqdn()))
+                    data = cursor.fetchall()
+                    if len(data) != 1:
+                        return self.set_status('ongoing')
+                    self.backup_id = str(data[0]['id'])
+                    cursor.execute("UPDATE backups SET status = 'ongoing', end_date = NULL "
+                                   "WHERE id = %s", (self.backup_id, ))
+                except (pymysql.err.ProgrammingError, pymysql.err.InternalError):
+                    logger.error('A MySQL error occurred while trying to resume the entry '
+                                 'of the backup')
+                    return False
+            db.commit()
+        return True
+
+    def fail(self):
+        with self.lock:
+            self.set_status('failed')
+            self.session.close()
+
+    def finish(self):
+        with self.lock:
+            self.set_status('finished')
+            self.session.close()
+
+    def delete(self):
+        with self.lock:
+            self.set_status('deleted')
+            self.session.close()
+
+    def close(self):
+        """Closes the connection reopened by events recorded after the final status"""
+        with self.lock:
+            self.session.close()
+
+
+class SpoolBackupStatistics(BackupStatistics):
+    """
+    Appends the statistics events of a backup (start, file list, total size, phase
+    timings and status changes) to a local append-only spool file, one compact json object per
+    line, and ships them to the statistics database on a background thread, so the
+    backup never waits on it. If the database is slow or down, the spool file is
+    kept, and can be sent later with replay_spool().
+    The spool file is locked while the backup can still write to it, so it is not
+    replayed (and deleted) meanwhile.
+    """
+
+    def __init__(self, dir_name, section, type, source, backup_dir, config):
+        self.dump_name = dir_name
+        self.section = section
+        self.type = type
+        if source.endswith(':3306'):
+            self.source = source[:-5]
+        else:
+            self.source = source
+        self.backup_dir = backup_dir
+        self.config = config
+        self.batch_size = int(config.get('batch_size', DEFAULT_BATCH_SIZE))
+        self.spool_dir = config.get('spool_dir', DEFAULT_SPOOL_DIR)
+        self.spool_file = os.path.join(self.spool_dir, dir_name + SPOOL_EXTENSION)
+        self.flush_timeout = int(config.get('flush_timeout', DEFAULT_SPOOL_FLUSH_TIMEOUT))
+        self.events = queue.Queue()
+        self.shipper = None
+        self.late_shipper = None  # sending the events recorded after the final status
+        self.closed = False  # True once the final status has been recorded
+        self.spool = None  # the open and locked spool file, while it can be written
+        self.lock = threading.Lock()  # events can be recorded from several threads
+
+    def open_spool(self):
+        """
+        Opens the spool file for appending, and locks it until release_spool(). If a
+        replay of a previous run with the same name is sending it, it waits for it to
+        finish, and creates it again if the replay deleted it.
+        """
+        while True:
+            spool = open(self.spool_file, 'a')
+            lock_spool(spool)
+            if is_same_file(spool, self.spool_file):
+                return spool
+            spool.close()
+
+    def release_spool(self):
+        """Closes and unlocks the spool file, once nothing else will be written to it"""
+        with self.lock:
+            if self.spool is not None:
+                self.spool.close()
+                self.spool = None
+
+    def append_event(self, event):
+        """
+        Writes the given event dictionary at the end of the spool file and queues it
+        to be shipped. Returns True if it was written, False otherwise.
+        """
+        logger = logging.getLogger('backup')
+        with self.lock:
+            try:
+                if self.spool is None:
+                    self.spool = self.open_spool()
+                self.spool.write(json.dumps(event, separators=(',', ':')) + '\n')
+                self.spool.flush()
+            except OSError:
+                logger.exception('We could not write on the stats spool file %s', self.spool_file)
+                return False
+            self.events.put(event)
+        return True
+
+    def ship_events(self):
+        """
+        Sends the queued events to the database until a final status is sent or
+        an error happens. On success, the spool file is deleted.
+        """
+        logger = logging.getLogger('backup')
+        replayer = SpoolReplayer(self.config.get('stats_file', DEFAULT_STATS_FILE),
+                                 self.batch_size)
+        while True:
+            event = self.events.get()
+            if not replayer.ship(event):
+                logger.error('Shipping statistics failed, they are kept at %s to be replayed '
+                             'later', self.spool_file)
+                break
+            if event['event'] == 'status':
+                try:
+                    os.remove(self.spool_file)  # still locked, so it is the one written
+                except OSError:
+                    logger.warning('We could not delete the spool file %s', self.spool_file)
+                break
+        replayer.close()
+        if self.closed:
+            self.release_spool()
+
+    def get_start_event(self):
+        return {'event': 'start', 'time': time.time(), 'name': self.dump_name,
+                'section': self.section, 'source': self.source, 'host': socket.getfqdn(),
+                'type': self.type}
+
+    def set_status(self, status):
+        """Records a status change (ongoing, finished, failed or deleted) on the spool"""
+        if status == 'ongoing':
+            return self.append_event(self.get_start_event())
+        self.closed = True
+        return self.append_event({'event': 'status', 'time': time.time(), 'status': status})
+
+    def ship_late_event(self, event, suffix):
+        """
+        Sends an event generated after the final status (e.g. the timing of the background
+        purge, which the shipper thread no longer waits for) on its own spool file,
+        dir_name.suffix.spool, on a background thread, so it is kept to be replayed later
+        if it cannot be sent. Returns True if it was spooled, False otherwise.
+        """
+        logger = logging.getLogger('backup')
+        spool_file = os.path.join(self.spool_dir, '{}.{}{}'.format(self.dump_name, suffix,
+                                                                   SPOOL_EXTENSION))
+        try:
+            with open(spool_file, 'a') as spool:
+                for line in [self.get_start_event(), event]:
+                    spool.write(json.dumps(line, separators=(',', ':')) + '\n')
+        except OSError:
+            logger.exception('We could not write on the stats spool file %s', spool_file)
+            return False
+
+        def ship():
+            replayer = SpoolReplayer(self.config.get('stats_file', DEFAULT_STATS_FILE),
+                                     self.batch_size)
+            replayer.replay(spool_file)
+            replayer.close()
+
+        self.late_shipper = threading.Thread(target=ship, daemon=True)
+        self.late_shipper.start()
+        return True
+
+    def gather_metrics(self):
+        """
+        Gathers the file name list, last modification and sizes for the generated files
+        (as read by take_inventory(), if it was called before) and records them on the spool.
+        """
+        if self.inventory is None and not self.take_inventory():
+            return False
+        files, total_size = self.inventory
+        objects, file_objects = self.get_object_sizes(files)
+        if not self.append_event({'event': 'objects',
+                                  'objects': [[database, table, size]
+                                              for (database, table), size in objects.items()]}):
+            return False
+        # each file is recorded as [path, name, size, date, database, table]
+        rows = [list(file) + list(backup_object or (None, None))
+                for file, backup_object in zip(files, file_objects)]
+        for offset in range(0, len(rows), self.batch_size):
+            if not self.append_event({'event': 'files',
+                                      'files': rows[offset:offset + self.batch_size]}):
+                return False
+        return self.append_event({'event': 'size', 'total_size': total_size})
+
+    def record_phase(self, timing):
+        """Records the given PhaseTiming on the spool"""
+        event = dict(timing._asdict(), event='phase')
+        if self.closed:
+            return self.ship_late_event(event, timing.phase)
+        return self.append_event(event)
+
+    def heartbeat(self, progress):
+        """Records the progress dictionary generated by ProgressMonitor on the spool"""
+        return self.append_event({'event': 'heartbeat', 'time': progress['time'],
+                                  'bytes': progress['bytes'], 'throughput': progress['throughput'],
+                                  'eta': progress['eta']})
+
+    def get_previous_size(self):
+        """
+        Tries to read the size of the previous backup from the database. As it is only used
+        as an estimation, if it is not available, None is returned without retrying later.
+        """
+        session = StatsSession(self.config.get('stats_file', DEFAULT_STATS_FILE))
+        db = session.connect()
+        if db is None:
+            return None
+        try:
+            return query_previous_size(db, self.type, self.section)
+        finally:
+            session.close()
+
+    def wait(self):
+        """
+        Waits, up to flush_timeout seconds (by default, it does not wait), for the pending
+        events to be shipped. Whatever was not sent by then stays on the spool file, to be
+        sent by the shipper on the background or, if the process ends before, replayed later.
+        """
+        logger = logging.getLogger('backup')
+        if self.shipper is not None:
+            self.shipper.join(self.flush_timeout)
+            if self.shipper.is_alive():
+                # it is released by the shipper once it finishes
+                logger.info('Statistics are being shipped on the background, pending events '
+                            'are kept at %s', self.spool_file)
+                return
+        self.release_spool()
+
+    def close(self):
+        """Waits, up to flush_timeout seconds, for the events recorded after the final status"""
+        if self.late_shipper is not None:
+            self.late_shipper.join(self.flush_timeout)
+
     def start(self):
-        self.set_status('ongoing')
+        if self.set_status('ongoing'):
+            self.shipper = threading.Thread(target=self.ship_events, daemon=True)
+            self.shipper.start()
+
+    def resume(self):
+        # the start event of an already registered backup reuses its entry when shipped
+        self.start()
 
     def fail(self):
         self.set_status('failed')
+        self.wait()
 
     def finish(self):
         self.set_status('finished')
+        self.wait()
 
     def delete(self):
         self.set_status('deleted')
+        self.wait()
+
+
+class SpoolReplayer:
+    """
+    Sends statistics events, as written by SpoolBackupStatistics, to the statistics
+    database. Sending is idempotent: the backup entry is reused if it already exists
+    and files already registered are ignored, so a spool file can be replayed
+    completely even if it was partially sent before.
+    """
+
+    def __init__(self, stats_file, batch_size=DEFAULT_BATCH_SIZE):
+        self.stats_file = stats_file
+        self.batch_size = batch_size
+        self.stats = None  # DatabaseBackupStatistics of the backup being sent
+        self.object_ids = None  # backup_objects ids of the backup being sent
+
+    def ship_start(self, db, event):
+        """Finds or inserts the backups entry of the given start event"""
+        logger = logging.getLogger('backup')
+        query = ("SELECT id FROM backups WHERE name = %s and type = %s and source = %s and "
+                 "host = %s ORDER BY id DESC LIMIT 1")
+        parameters = (event['name'], event['type'], event['source'], event['host'])
+        with db.cursor(pymysql.cursors.DictCursor) as cursor:
+            try:
+                cursor.execute(query, parameters)
+                data = cursor.fetchall()
+                if len(data) == 1:
+                    self.stats.backup_id = str(data[0]['id'])
+                    return True
+                query = ("INSERT INTO backups (name, status, section, source, host, type, "
+                         "start_date, end_date) "
+                         "VALUES (%s, 'ongoing', %s, %s, %s, %s, FROM_UNIXTIME(%s), NULL)")
+                cursor.execute(query, (event['name'], event['section'], event['source'],
+                                       event['host'], event['type'], event['time']))
+            except (pymysql.err.ProgrammingError, pymysql.err.InternalError):
+                logger.error('A MySQL error occurred while trying to insert the entry '
+                             'for the new backup')
+                return False
+        self.stats.backup_id = str(cursor.lastrowid)
+        return True
+
+    def ship_update(self, db, query, parameters):
+        """Runs the given update of the current backup entry"""
+        logger = logging.getLogger('backup')
+        with db.cursor(pymysql.cursors.DictCursor) as cursor:
+            try:
+                cursor.execute(query, parameters + (self.stats.backup_id, ))
+            except (pymysql.err.ProgrammingError, pymysql.err.InternalError):
+                logger.error('A MySQL error occurred while updating the backup entry')
+                return False
+        return True
+
+    def ship_files(self, db, files):
+        """Inserts the given file list, linked to its objects, if not already registered"""
+        if self.object_ids is None:
+            self.object_ids = self.stats.get_object_ids(db, self.stats.backup_id)
+            if self.object_ids is None:
+                return False
+        rows = [(file_path, file_name, size, file_date, self.object_ids.get((database, table)))
+                for file_path, file_name, size, file_date, database, table in files]
+        return self.stats.insert_file_list(db, self.stats.backup_id, rows, ignore_duplicates=True)
+
+    def ship(self, event):
+        """
+        Sends the given event to the database and commits it.
+        Returns True if it was successful, False otherwise.
+        """
+        logger = logging.getLogger('backup')
+        if event['event'] == 'start':
+            self.object_ids = None
+            self.stats = DatabaseBackupStatistics(dir_name=event['name'], section=event['section'],
+                                                  type=event['type'], source=event['source'],
+                                                  backup_dir=None,
+                                                  config={'stats_file': self.stats_file,
+                                                          'batch_size': self.batch_size})
+        elif self.stats is None or self.stats.backup_id is None:
+            logger.error('Statistics event found before the backup start, ignoring it')
+            return False
+        db = self.stats.session.connect()
+        if db is None:
+            return False
+        try:
+            if event['event'] == 'start':
+                result = self.ship_start(db, event)
+            elif event['event'] == 'objects':
+                objects = {(database, table): size for database, table, size in event['objects']}
+                self.object_ids = self.stats.insert_object_list(db, self.stats.backup_id, objects)
+                result = self.object_ids is not None
+            elif event['event'] == 'files':
+                result = self.ship_files(db, event['files'])
+            elif event['event'] == 'phase':
+                timing = PhaseTiming(**{field: event[field] for field in PhaseTiming._fields})
+                result = self.stats.insert_phase(db, self.stats.backup_id, timing)
+            elif event['event'] == 'heartbeat':
+                result = self.ship_update(db, HEARTBEAT_QUERY,
+                                          (event['time'], event['bytes'], event['throughput'],
+                                           event['eta']))
+            elif event['event'] == 'size':
+                result = self.ship_update(db, "UPDATE backups SET total_size = %s WHERE id = %s",
+                                          (event['total_size'], ))
+            elif event['event'] == 'status':
+                result = self.ship_update(db, "UPDATE backups SET status = %s, "
+                                              "end_date = FROM_UNIXTIME(%s) WHERE id = %s",
+                                          (event['status'], event['time']))
+            else:
+                logger.warning('Unknown statistics event %s, ignoring it', event['event'])
+                return True
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            logger.exception('We lost the connection to the stats db')
+            result = False
+        if not result:
+            db.rollback()
+            return False
+        db.commit()
+        return True
+
+    def replay(self, spool_file):
+        """
+        Sends all the events of the given spool file, in order, and deletes the file
+        if all of them were sent. Returns True if it was successful, False otherwise.
+        Spool files still locked by a running backup are skipped (it ships them itself),
+        which is not considered a failure.
+        """
+        logger = logging.getLogger('backup')
+        try:
+            with open(spool_file, 'r') as spool:
+                if not lock_spool(spool, blocking=False):
+                    logger.info('%s is in use by a running backup, skipping it', spool_file)
+                    return True
+                if not is_same_file(spool, spool_file):
+                    return True  # sent and deleted by another replay meanwhile
+                for line in spool:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # e.g. a last line only partially written
+                        logger.warning('Ignoring malformed line on %s', spool_file)
+                        continue
+                    if not self.ship(event):
+                        return False
+                os.remove(spool_file)  # while still locked
+        except FileNotFoundError:
+            return True  # sent and deleted by another replay
+        except OSError:
+            logger.exception('We could not replay the spool file %s', spool_file)
+            return False
+        return True
+
+    def close(self):
+        if self.stats is not None:
+            self.stats.session.close()
+
+
+def replay_spool(spool_dir, stats_file, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Sends the statistics of all the spool files found at spool_dir to the database,
+    deleting the ones fully sent. Returns the number of files that could not be sent.
+    """
+    logger = logging.getLogger('backup')
+    failed = 0
+    try:
+        spool_files = sorted(f for f in os.listdir(spool_dir) if f.endswith(SPOOL_EXTENSION))
+    except OSError:
+        logger.exception('We could not read the spool dir %s', spool_dir)
+        return 1
+    for spool_file in spool_files:
+        logger.info('Replaying statistics from %s', spool_file)
+        replayer = SpoolReplayer(stats_file, batch_size)
+        if not replayer.replay(os.path.join(spool_dir, spool_file)):
+            failed += 1
+        replayer.close()
+    return failed
@@ -0,0 +1,73 @@
+"""
+Checkpoint of the completed phases of a backup run, so a failed run can be
+resumed from the first phase that did not finish, instead of repeating slow
+work (e.g. a snapshot prepare) that already succeeded.
+"""
+
+import json
+import logging
+import os
+import threading
+
+CHECKPOINT_EXTENSION = '.checkpoint'
+
+
+class Checkpoint:
+    """
+    Phases completed for the backup dir_name, stored as a small json file at
+    backup_dir/.dir_name.checkpoint. It is kept outside the backup dir itself, so
+    it is neither archived nor compressed, and as a dotfile, it is ignored by the
+    backup discovery, rotation and purging.
+    """
+
+    def __init__(self, backup_dir, dir_name):
+        self.path = os.path.join(backup_dir, '.' + dir_name + CHECKPOINT_EXTENSION)
+        self.completed = list()
+        self.lock = threading.Lock()  # phases can finish on different threads
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def load(self):
+        """
+        Reads the completed phases from the checkpoint file.
+        Returns True if it was successful, False otherwise (e.g. if it does not exist).
+        """
+        logger = logging.getLogger('backup')
+        try:
+            with open(self.path) as f:
+                self.completed = json.load(f)['completed']
+        except (OSError, ValueError, KeyError):
+            logger.warning('Checkpoint file %s could not be read', self.path)
+            return False
+        return True
+
+    def is_done(self, phase):
+        return phase in self.completed
+
+    def mark_done(self, phase):
+        """
+        Records the given phase as completed, replacing the checkpoint file atomically.
+        Failing to write it is not fatal (the backup would just not be resumable),
+        so it returns False instead of raising an exception.
+        """
+        logger = logging.getLogger('backup')
+        with self.lock:
+            if phase not in self.completed:
+                self.completed.append(phase)
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump({'completed': self.completed}, f)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                logger.warning('Checkpoint file %s could not be written', self.path)
+                return False
+        return True
+
+    def remove(self):
+        """Deletes the checkpoint file, if it exists"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
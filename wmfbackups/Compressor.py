@@ -0,0 +1,93 @@
+"""
+Compression backends used to generate (and later extract) the backup tarballs
+
+Each backend knows the extension of the files it generates, so the
+compression method of an existing backup can be detected from its name.
+"""
+
+import re
+
+
+class Compressor:
+    """
+    Plain tar, without compression (useful when the backup files are already
+    compressed individually)
+    """
+    name = 'none'
+    extension = '.tar'
+
+    def get_compress_cmd(self, threads):
+        """
+        Returns the command (as a list) reading from stdin and writing the compressed
+        stream to stdout, or None if no compression is done
+        """
+        return None
+
+    def get_decompress_cmd(self, threads):
+        """
+        Returns the command (as a list) reading a compressed stream from stdin and
+        writing it uncompressed to stdout, or None if no decompression is needed
+        """
+        return None
+
+
+class PigzCompressor(Compressor):
+    """Multi-threaded gzip compression"""
+    name = 'pigz'
+    extension = '.tar.gz'
+
+    def get_compress_cmd(self, threads):
+        return ['/usr/bin/pigz', '-p', str(threads)]
+
+    def get_decompress_cmd(self, threads):
+        return ['/usr/bin/pigz', '--decompress', '-p', str(threads)]
+
+
+class ZstdCompressor(Compressor):
+    """
+    Multi-threaded zstd compression, similar ratio than gzip but decompressing
+    several times faster, which speeds up recoveries
+    """
+    name = 'zstd'
+    extension = '.tar.zst'
+
+    def get_compress_cmd(self, threads):
+        return ['/usr/bin/zstd', '--quiet', '-T{}'.format(threads)]
+
+    def get_decompress_cmd(self, threads):
+        # zstd decompression is single-threaded
+        return ['/usr/bin/zstd', '--quiet', '--decompress']
+
+
+COMPRESSORS = {compressor.name: compressor
+               for compressor in [PigzCompressor(), ZstdCompressor(), Compressor()]}
+DEFAULT_COMPRESSOR = 'pigz'
+# longest extensions first, so .tar does not shadow .tar.gz
+TARBALL_EXTENSION_REGEX = '|'.join(re.escape(compressor.extension)
+                                   for compressor in sorted(COMPRESSORS.values(),
+                                                            key=lambda c: len(c.extension),
+                                                            reverse=True))
+
+
+def get_compressor(name=None):
+    """
+    Returns the compressor with the given name (or the default one if None).
+    Raises KeyError if it does not exist.
+    """
+    if name is None:
+        name = DEFAULT_COMPRESSOR
+    return COMPRESSORS[name]
+
+
+def split_extension(file_name):
+    """
+    Given a backup file name, returns a (name without extension, compressor) tuple
+    if it is a tarball generated by one of the compressors, or (file_name, None)
+    otherwise.
+    """
+    match = re.match(r'(.+?)(' + TARBALL_EXTENSION_REGEX + ')$', file_name)
+    if match is None:
+        return (file_name, None)
+    for compressor in COMPRESSORS.values():
+        if compressor.extension == match.group(2):
+            return (match.group(1), compressor)
@@ -0,0 +1,79 @@
+"""
+Directory traversal helpers based on os.scandir
+
+They reuse the file type information returned when reading the directory
+(so no extra stat() call is needed to know if an entry is a directory) and
+walk trees iteratively, so deep backup trees don't hit the recursion limit
+and symbolic links can not make the traversal loop forever.
+"""
+
+from collections import namedtuple
+import os
+import stat
+
+# path is relative to the top dir being walked ('' for its direct children)
+WalkEntry = namedtuple('WalkEntry', ['path', 'name', 'size', 'mtime', 'is_dir', 'is_link'])
+
+
+def list_dir(directory):
+    """
+    Returns the list of os.DirEntry objects of the given directory, sorted by name.
+    Raises OSError if the directory cannot be read.
+    """
+    with os.scandir(directory) as iterator:
+        return sorted(iterator, key=lambda entry: entry.name)
+
+
+def walk(top, follow_links=False):
+    """
+    Iterates over all the files and directories under top (not including top itself),
+    depth-first and sorted by name, yielding a WalkEntry for each of them.
+    Symbolic links are reported (with their own size) but not followed, unless
+    follow_links is True. In that case, directories already visited (same device and
+    inode) are not entered again, to avoid infinite loops.
+    Raises OSError if a file or directory cannot be read.
+    """
+    visited = set()
+    if follow_links:
+        statinfo = os.stat(top)
+        visited.add((statinfo.st_dev, statinfo.st_ino))
+    stack = [('', iter(list_dir(top)))]
+    while stack:
+        directory, entries = stack[-1]
+        entry = next(entries, None)
+        if entry is None:
+            stack.pop()
+            continue
+        is_link = entry.is_symlink()
+        try:
+            statinfo = entry.stat(follow_symlinks=follow_links)
+            is_dir = entry.is_dir(follow_symlinks=follow_links)
+        except FileNotFoundError:
+            if not is_link:
+                raise
+            # broken link
+            statinfo = entry.stat(follow_symlinks=False)
+            is_dir = False
+        yield WalkEntry(directory, entry.name, statinfo.st_size, statinfo.st_mtime, is_dir, is_link)
+        if is_dir:
+            if follow_links:
+                inode = (statinfo.st_dev, statinfo.st_ino)
+                if inode in visited:
+                    continue
+                visited.add(inode)
+            stack.append((os.path.join(directory, entry.name), iter(list_dir(entry.path))))
+
+
+def get_size(path):
+    """
+    Returns the total size, in bytes, of the given file or of all the files under the
+    given directory (not following symbolic links), or 0 if it does not exist.
+    Raises OSError if a file or directory cannot be read.
+    """
+    try:
+        statinfo = os.stat(path, follow_symlinks=False)
+    except FileNotFoundError:
+        return 0
+    if not stat.S_ISDIR(statinfo.st_mode):
+        return statinfo.st_size
+    return sum(entry.size for entry in walk(path) if not entry.is_dir)
@@ -11,19 +11,115 @@ command locally
 
 import os
 import re
+import shutil
 import subprocess
+import threading
 
 import wmfmariadbpy.dbutil as dbutil
+from wmfbackups.FileWalker import list_dir, walk
 from wmfbackups.NullBackup import NullBackup, BackupException
+from wmfbackups.Scheduling import parse_size
+from wmfbackups.SnapshotChain import SnapshotChain, is_incremental, read_checkpoints
 
 DEFAULT_PORT = 3306
 SERVER_VERSION_REGEX = r'(\d+\.\d+)\.(\d+)(\-([^\s]+))?'
+REDO_LOG_FILE = 'xtrabackup_logfile'  # redo log copied during the backup, applied on prepare
+MIN_PREPARE_MEMORY = 1024 ** 3
+PREPARE_MEMORY_PER_REDO = 2  # bytes of --use-memory per byte of redo log to apply
+PREPARE_MEMORY_HOST_FRACTION = 0.5  # max. fraction of the host memory used by a single prepare
+# (binary path, mtime): version of the xtrabackup binaries already probed by this process
+XTRABACKUP_VERSIONS = dict()
+XTRABACKUP_VERSIONS_LOCK = threading.Lock()
+# left loose when archiving, so the server can be started quickly after a recovery
+SYSTEM_DATABASES = ('mysql', 'performance_schema', 'sys')
 
 
 class XtrabackupError(BackupException):
     """Used to raise errors related to xtrabackup execution"""
 
 
+def uniformize_vendor_string(original_vendor):
+    """
+    Version string can be faked on config. In particular, it adds a '-log' string
+    depending if binary log is enabled or disabled.
+    """
+    if original_vendor is None or original_vendor in ['', 'log', 'debug', 'valgrind', 'embedded']:
+        return 'MySQL'
+    if original_vendor.startswith('MariaDB'):
+        return 'MariaDB'
+    if re.match(r'\d+([\.\-]\d+(\-.+)?)?', original_vendor):
+        return 'Percona Server'
+    return None
+
+
+def parse_server_version(text, source):
+    """
+    Returns the first server version found on text (e.g. 10.4.22-MariaDB-log) as major
+    version, minor version and vendor. Raises XtrabackupError, mentioning source,
+    if there is none.
+    """
+    search = re.search(SERVER_VERSION_REGEX, text)
+    if search is None:
+        raise XtrabackupError(f'{source} didn\'t provide a recognizable version')
+    major_version = search.group(1)
+    try:
+        minor_version = int(search.group(2))
+    except ValueError:
+        raise XtrabackupError(f'{source} didn\'t provide a numeric minor version')
+    vendor = uniformize_vendor_string(search.group(4))
+    return {'major': major_version, 'minor': minor_version, 'vendor': vendor}
+
+
+def check_version_compatibility(xtrabackup_version, backup_version):
+    """
+    Raises XtrabackupError if a backup of a server with backup_version cannot be prepared
+    by xtrabackup_version (different vendor or major version, or older minor version)
+    """
+    if (xtrabackup_version['vendor'] != backup_version['vendor'] or
+            xtrabackup_version['major'] != backup_version['major'] or
+            xtrabackup_version['minor'] < backup_version['minor']):
+        raise XtrabackupError(f'xtrabackup version mismatch- '
+                              f'xtrabackup version: {xtrabackup_version}, '
+                              f'backup version: {backup_version}')
+
+
+def get_host_memory():
+    """Returns the total physical memory of this host, in bytes, or None if unknown"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError):
+        return None
+
+
+def estimate_prepare_memory(redo_size, host_memory, max_memory):
+    """
+    Returns the --use-memory, in bytes, for the prepare of a snapshot with a redo log of
+    redo_size bytes: enough to apply it without evicting pages, but never more than
+    max_memory or a fraction of the host_memory (if known), so other prepares can run
+    at the same time.
+    """
+    limit = max_memory
+    if host_memory is not None:
+        limit = min(limit, int(host_memory * PREPARE_MEMORY_HOST_FRACTION))
+    return min(max(MIN_PREPARE_MEMORY, redo_size * PREPARE_MEMORY_PER_REDO), limit)
+
+
+def get_binary_key(path):
+    """
+    Returns a (real path, modification time) tuple identifying the executable path (which
+    can be a name on $PATH), so an upgraded binary is not mistaken by the previous one,
+    or None if it cannot be found
+    """
+    executable = shutil.which(path)
+    if executable is None:
+        return None
+    try:
+        executable = os.path.realpath(executable)
+        return (executable, os.stat(executable).st_mtime_ns)
+    except OSError:
+        return None
+
+
 class MariaBackup(NullBackup):
     """Implements NullBackup by allowing backup generation and preparation
        with mariabackup, while using the default xtrabackup executable on path"""
@@ -31,40 +127,34 @@ class MariaBackup(NullBackup):
     xtrabackup_path = 'xtrabackup'
     xtrabackup_prepare_memory = '40G'
     xtrabackup_open_files_limit = '200000'
+    output_success_marker = 'completed OK!'
 
-    def uniformize_vendor_string(self, original_vendor):
-        """
-        Version string can be faked on config. In particular, it adds a '-log' string
-        depending if binary log is enabled or disabled.
-        """
-        if original_vendor is None or original_vendor in ['', 'log', 'debug', 'valgrind', 'embedded']:
-            return 'MySQL'
-        if original_vendor.startswith('MariaDB'):
-            return 'MariaDB'
-        if re.match(r'\d+([\.\-]\d+(\-.+)?)?', original_vendor):
-            return 'Percona Server'
-        return None
+    uniformize_vendor_string = staticmethod(uniformize_vendor_string)
+    # (dir_name, checkpoints) of the snapshot, read when it is prepared, so it can be
+    # recorded on the chain once the run finishes, even if the dir was compressed meanwhile
+    snapshot_checkpoints = None
 
     def _get_xtrabackup_version(self):
         """
         Execute xtrabackup --version and return the server version it was
-        compiled against, as major version, minor version and vendor
+        compiled against, as major version, minor version and vendor.
+        The result is remembered for the rest of the process, for the same binary
+        (path and modification time).
         """
+        key = get_binary_key(self.xtrabackup_path)
+        with XTRABACKUP_VERSIONS_LOCK:
+            if key is not None and key in XTRABACKUP_VERSIONS:
+                return dict(XTRABACKUP_VERSIONS[key])
         cmd = [self.xtrabackup_path, '--version']
         process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         _, err = process.communicate()  # xtrabackup returns version to stderr
         if process.returncode != 0:
             raise XtrabackupError('--version failed to execute')
-        search = re.search(SERVER_VERSION_REGEX, err.decode())
-        if search is None:
-            raise XtrabackupError('--version didn\'t provide a recognizable version')
-        major_version = search.group(1)
-        try:
-            minor_version = int(search.group(2))
-        except ValueError:
-            raise XtrabackupError('--version didn\'t provide a numeric minor version')
-        vendor = self.uniformize_vendor_string(search.group(4))
-        return {'major': major_version, 'minor': minor_version, 'vendor': vendor}
+        version = parse_server_version(err.decode(), '--version')
+        if key is not None:
+            with XTRABACKUP_VERSIONS_LOCK:
+                XTRABACKUP_VERSIONS[key] = dict(version)
+        return version
 
     def _get_backup_source_server_version(self, backup_dir):
         """
@@ -78,23 +168,33 @@ class MariaBackup(NullBackup):
         if search is None or search.group(1) is None:
             raise XtrabackupError('xtrabackup_info file does not exist or '
                                   'it does not contain a server version')
-        major_version = search.group(2)
-        try:
-            minor_version = int(search.group(3))
-        except ValueError:
-            raise XtrabackupError('xtrabackup_info didn\'t provide a numeric minor version')
-        vendor = self.uniformize_vendor_string(search.group(5))
-        return {'major': major_version, 'minor': minor_version, 'vendor': vendor}
+        return parse_server_version(search.group(1), 'xtrabackup_info')
+
+    def get_chain(self, backup_dir):
+        """
+        Returns the (not yet loaded) chain of incremental snapshots of the section, stored
+        at backup_dir/.snapshot_chain.section
+        """
+        path = os.path.join(backup_dir, '.snapshot_chain.{}'.format(self.backup.name))
+        return SnapshotChain(path, int(self.config.get('max_chain_depth') or 0))
 
     def get_backup_cmd(self, backup_dir):
         """
         Given a config, returns a command line for mydumper, the name
         of the expected snapshot, and the log path.
+        If incremental snapshots are enabled (max_chain_depth) and the chain of the
+        section is not complete, only the pages changed since its last snapshot are copied.
         """
         cmd = [self.xtrabackup_path, '--backup']
 
         output_dir = os.path.join(backup_dir, self.backup.dir_name)
         cmd.extend(['--target-dir', output_dir])
+        chain = self.get_chain(backup_dir)
+        if chain.max_depth > 0:
+            chain.load()
+            incremental_lsn = chain.get_incremental_lsn()
+            if incremental_lsn is not None:
+                cmd.extend(['--incremental-lsn', str(incremental_lsn)])
         port = int(self.config.get('port', DEFAULT_PORT))
         datadir = dbutil.get_datadir_from_port(port)
         socket = dbutil.get_socket_from_port(port)
@@ -121,6 +221,22 @@ class MariaBackup(NullBackup):
             return True
         return False
 
+    def get_prepare_memory(self, snapshot_dir):
+        """
+        Returns the --use-memory value for the prepare of the snapshot at snapshot_dir:
+        the prepare_memory option, if set (e.g. sized by remote-backup-mariadb), or
+        otherwise, an estimation based on the size of its redo log and the memory of the
+        host, see estimate_prepare_memory(). If the redo log cannot be read, the default.
+        """
+        if self.config.get('prepare_memory') is not None:
+            return str(self.config['prepare_memory'])
+        try:
+            redo_size = os.stat(os.path.join(snapshot_dir, REDO_LOG_FILE)).st_size
+        except OSError:
+            return self.xtrabackup_prepare_memory
+        return str(estimate_prepare_memory(redo_size, get_host_memory(),
+                                           parse_size(self.xtrabackup_prepare_memory)))
+
     def _get_xtraback_prepare_cmd(self, backup_dir):
         """
         Returns the command needed to run the backup prepare
@@ -129,44 +245,144 @@ class MariaBackup(NullBackup):
         path = os.path.join(backup_dir, self.backup.dir_name)
         cmd = [self.xtrabackup_path, '--prepare']
         cmd.extend(['--target-dir', path])
-        # TODO: Make the amount of memory configurable
         # WARNING: apparently, --innodb-buffer-pool-size fails sometimes
-        cmd.extend(['--use-memory', self.xtrabackup_prepare_memory])
+        cmd.extend(['--use-memory', self.get_prepare_memory(path)])
         cmd.extend(['--open-files-limit', self.xtrabackup_open_files_limit])
 
         return cmd
 
-    def errors_on_output(self, stdout, stderr):
-        errors = stderr.decode("utf-8")
-        if 'completed OK!' not in errors:
-            self.logger.error(errors)
-            return True
-        return False
-
     def errors_on_log(self):
         return False
 
+    def read_snapshot_checkpoints(self, backup_dir):
+        """
+        Returns the checkpoints of the snapshot at backup_dir, read only once per snapshot.
+        Raises XtrabackupError if they could not be read.
+        """
+        dir_name = self.backup.dir_name
+        if self.snapshot_checkpoints is None or self.snapshot_checkpoints[0] != dir_name:
+            try:
+                checkpoints = read_checkpoints(os.path.join(backup_dir, dir_name))
+            except (OSError, ValueError) as ex:
+                raise XtrabackupError(f'The snapshot checkpoints could not be read: {ex}')
+            self.snapshot_checkpoints = (dir_name, checkpoints)
+        return self.snapshot_checkpoints[1]
+
+    def check_chain(self, backup_dir):
+        """
+        Checks the snapshot at backup_dir can be added to the chain of its section, if
+        incremental snapshots are enabled, without recording it yet (see record_success()).
+        Returns True if it is an incremental snapshot, False if it is a full one.
+        Raises XtrabackupError if it does not continue the chain.
+        """
+        chain = self.get_chain(backup_dir)
+        if chain.max_depth <= 0:
+            return False
+        chain.load()
+        checkpoints = self.read_snapshot_checkpoints(backup_dir)
+        if not chain.add(self.backup.dir_name, checkpoints):
+            raise XtrabackupError(f'The incremental snapshot starting at lsn {checkpoints["from_lsn"]} '
+                                  f'does not continue the chain at {chain.path}')
+        return is_incremental(checkpoints)
+
+    def record_success(self, backup_dir):
+        """
+        Records the snapshot on the chain of its section, if incremental snapshots are enabled,
+        so the next one is taken on top of it. Only snapshots that finished the whole run are
+        recorded: if it cannot be, the next one just continues from the previous member.
+        """
+        chain = self.get_chain(backup_dir)
+        if chain.max_depth <= 0:
+            return
+        chain.load()
+        try:
+            checkpoints = self.read_snapshot_checkpoints(backup_dir)
+        except XtrabackupError as ex:
+            self.logger.warning('%s was not recorded on the snapshot chain: %s',
+                                self.backup.dir_name, ex)
+            return
+        if not chain.add(self.backup.dir_name, checkpoints) or not chain.save():
+            self.logger.warning('%s could not be recorded on the snapshot chain %s',
+                                self.backup.dir_name, chain.path)
+
     def get_prepare_cmd(self, backup_dir):
         """
-        Once an xtrabackup backup has completed, run prepare so it is ready to be copied back
+        Once an xtrabackup backup has completed, run prepare so it is ready to be copied back.
+        With incremental snapshots enabled, full snapshots are prepared so the following
+        incremental ones can be applied on top of them later (see get_chain_prepare_cmds()),
+        and incremental ones are not prepared (they only contain the changed pages).
         """
+        if self.check_chain(backup_dir):
+            return ''
         # Fail hard under certain version missmatches
         xtrabackup_version = self._get_xtrabackup_version()
         backup_version = self._get_backup_source_server_version(backup_dir)
-        if (xtrabackup_version['vendor'] != backup_version['vendor'] or
-                xtrabackup_version['major'] != backup_version['major'] or
-                xtrabackup_version['minor'] < backup_version['minor']):
-            raise XtrabackupError(f'xtrabackup version mismatch- '
-                                  f'xtrabackup version: {xtrabackup_version}, '
-                                  f'backup version: {backup_version}')
+        check_version_compatibility(xtrabackup_version, backup_version)
 
         cmd = self._get_xtraback_prepare_cmd(backup_dir)
+        if self.get_chain(backup_dir).max_depth > 0 and xtrabackup_version['vendor'] != 'MariaDB':
+            # skip the rollback, so incremental snapshots can be applied (MariaDB does not need it)
+            cmd = cmd + ['--apply-log-only']
         return cmd
 
+    def get_chain_prepare_cmds(self, target_dir, incremental_dirs):
+        """
+        Returns the list of commands that apply, in order, the given incremental snapshot
+        dirs to the prepared full snapshot at target_dir, leaving it ready to be copied back.
+        """
+        apply_log_only = self._get_xtrabackup_version()['vendor'] != 'MariaDB'
+        if not incremental_dirs:
+            if not apply_log_only:
+                return list()
+            # only the rollback skipped when the full one was prepared is pending
+            return [[self.xtrabackup_path, '--prepare', '--target-dir', target_dir,
+                     '--use-memory', self.get_prepare_memory(target_dir),
+                     '--open-files-limit', self.xtrabackup_open_files_limit]]
+        cmds = list()
+        for position, incremental_dir in enumerate(incremental_dirs):
+            cmd = [self.xtrabackup_path, '--prepare', '--target-dir', target_dir,
+                   '--incremental-dir', incremental_dir,
+                   '--use-memory', self.get_prepare_memory(incremental_dir),
+                   '--open-files-limit', self.xtrabackup_open_files_limit]
+            if apply_log_only and position < len(incremental_dirs) - 1:
+                cmd.append('--apply-log-only')  # the rollback is only done on the last one
+            cmds.append(cmd)
+        return cmds
+
     def errors_on_prepare(self, stdout, stderr):
         return self.errors_on_output(stdout, stderr)
 
+    def group_database_files(self, source):
+        """
+        Returns a list of (tar file name, file list, total size in bytes) tuples, one per
+        database subdirectory of the snapshot at the directory source, not yet archived.
+        System files (ibdata, redo logs, ...), xtrabackup metadata (xtrabackup_checkpoints,
+        xtrabackup_info, ...), system databases and other non-database dirs (#innodb_temp,
+        hidden ones) are not included, so they are left loose.
+        """
+        groups = list()
+        for entry in list_dir(source):
+            if (not entry.is_dir(follow_symlinks=False) or entry.name in SYSTEM_DATABASES
+                    or entry.name.startswith(('.', '#'))):
+                continue
+            size = sum(item.size for item in walk(entry.path) if not item.is_dir)
+            groups.append((entry.name + self.archive_extension, [entry.name], size))
+        return groups
+
     def archive_databases(self, source, threads):
-        """Archive xtrabackup-generated dbs (generating a tar bundle per database) -
-           NOT IMPLEMENTED - configuring it will do nothing"""
-        # FIXME: allow archiving databases for xtrabackup backup method
+        """
+        Bundles the datadir subdirectory of each database of the snapshot at the directory
+        source on its own tar file (e.g. enwiki/ into enwiki.tar), with up to threads
+        archives generated in parallel, see archive_in_parallel(). Databases already
+        archived by a previous run are skipped. The snapshot has to be unarchived (see
+        unarchive_databases()) before it can be copied back or incrementals applied to it.
+        Returns 0 if all of them were archived successfully, or the number of databases
+        that failed otherwise.
+        """
+        if self.recover_partial_archives(source) != 0:
+            self.logger.error('Partially archived databases could not be recovered')
+            return -1
+        groups = self.group_database_files(source)
+        files = {name: group_files for name, group_files, _ in groups}
+        sizes = {name: size for name, _, size in groups}
+        return self.archive_in_parallel(source, files, sizes, threads)
@@ -5,13 +5,14 @@ Generates a logical dump using mydumper, allowing fast parallel and
 compressed copies of the database objects.
 """
 
-from multiprocessing.pool import ThreadPool
 import os
 
-from wmfbackups.NullBackup import NullBackup
+from wmfbackups.FileWalker import list_dir
+from wmfbackups.NullBackup import NullBackup, PARTIAL_SUFFIX
 
 DEFAULT_HOST = 'localhost'
 DEFAULT_PORT = 3306
+ARCHIVE_EXTENSION = '.gz.tar'  # per-database archives, e.g. enwiki.gz.tar
 
 
 class MyDumperBackup(NullBackup):
@@ -21,6 +22,8 @@ class MyDumperBackup(NullBackup):
     """
 
     rows = 20000000
+    output_error_markers = (' CRITICAL ', )
+    archive_extension = ARCHIVE_EXTENSION
 
     def get_backup_cmd(self, backup_dir):
         """
@@ -34,6 +37,8 @@ class MyDumperBackup(NullBackup):
         cmd.extend(['--compress', '--events', '--triggers', '--routines'])
 
         cmd.extend(['--logfile', self.backup.log_file])
+        # info messages include the tables being dumped, used to monitor the progress
+        cmd.extend(['--verbose', '3'])
         output_dir = os.path.join(backup_dir, self.backup.dir_name)
         cmd.extend(['--outputdir', output_dir])
 
@@ -57,6 +62,9 @@ class MyDumperBackup(NullBackup):
     def get_prepare_cmd(self, backup_dir):
         return ''
 
+    def get_progress_log(self):
+        return self.backup.log_file
+
     def errors_on_metadata(self, backup_dir):
         metadata_file = os.path.join(backup_dir, self.backup.dir_name, 'metadata')
         try:
@@ -68,43 +76,57 @@ class MyDumperBackup(NullBackup):
             return True
         return False
 
-    def archive_databases(self, source, threads):
+    def group_database_files(self, source):
         """
-        To avoid too many files per backup output, archive each database file in
-        separate tar files for given directory "source". The threads
-        parameter allows to control the concurrency (number of threads executing
-        tar in parallel).
+        Returns a list of (tar file name, file list, total size in bytes) tuples, one per
+        database of the dump at the directory source, not yet archived. Files are grouped
+        following mydumper naming: sorted by name, the db-schema-create.sql.gz file of each
+        database comes before all the other files of the same database.
         """
-
-        # TODO: Ignore already archived databases, so a second run is idempotent
-        files = sorted(os.listdir(source))
-
+        groups = list()
         schema_files = list()
+        size = 0
         name = None
-        pool = ThreadPool(threads)
-        for item in files:
+        for entry in list_dir(source):
+            item = entry.name
+            if item.endswith((ARCHIVE_EXTENSION, ARCHIVE_EXTENSION + PARTIAL_SUFFIX)):
+                continue  # already archived databases
             if item.endswith('-schema-create.sql.gz') or item == 'metadata':
                 if schema_files:
-                    pool.apply_async(self.backup.tar_and_remove, (source, name, schema_files))
+                    groups.append((name, schema_files, size))
                     schema_files = list()
+                    size = 0
                 if item != 'metadata':
                     schema_files.append(item)
-                    name = item.replace('-schema-create.sql.gz', '.gz.tar')
+                    size += entry.stat(follow_symlinks=False).st_size
+                    name = item.replace('-schema-create.sql.gz', ARCHIVE_EXTENSION)
             else:
                 schema_files.append(item)
+                size += entry.stat(follow_symlinks=False).st_size
         if schema_files:
-            pool.apply_async(self.backup.tar_and_remove, (source, name, schema_files))
-
-        # TODO: Missing error handling
-
-        pool.close()
-        pool.join()
+            groups.append((name, schema_files, size))
+        return groups
 
-    def errors_on_output(self, stdout, stderr):
-        errors = stderr.decode("utf-8")
-        if ' CRITICAL ' in errors:
-            return True
-        return False
+    def archive_databases(self, source, threads):
+        """
+        To avoid too many files per backup output, archive each database file in
+        separate tar files for given directory "source". The threads
+        parameter allows to control the concurrency (number of threads executing
+        tar in parallel), see archive_in_parallel().
+        Databases already archived by a previous run are skipped, so only the missing
+        ones are archived on a retry. Returns 0 if all of them were archived
+        successfully, or the number of databases that failed otherwise.
+        """
+        if self.recover_partial_archives(source) != 0:
+            self.logger.error('Partially archived databases could not be recovered')
+            return -1
+        groups = self.group_database_files(source)
+        files = {name: group_files for name, group_files, _ in groups if name is not None}
+        sizes = {name: size for name, _, size in groups if name is not None}
+        if len(files) < len(groups):
+            self.logger.warning('Files not belonging to any database were found, '
+                                'they will not be archived')
+        return self.archive_in_parallel(source, files, sizes, threads)
 
     def errors_on_log(self):
         log_file = self.backup.log_file
@@ -6,6 +6,16 @@ for debugging and other example purposes that, if run, does absolutely
 nothing (it generates no backup files or reads from anywhere)
 """
 
+from multiprocessing.pool import ThreadPool
+import os
+import subprocess
+import tarfile
+
+from wmfbackups.FileWalker import list_dir
+from wmfbackups.Scheduling import lpt_order, simulate_makespan
+
+PARTIAL_SUFFIX = '.partial'  # archives being generated, renamed once complete
+
 
 class BackupException(Exception):
     """Base class for concrete exceptions on backup preparation & generation"""
@@ -17,6 +27,10 @@ class NullBackup:
        backup methods on top. On instancing, this does nothing"""
 
     config = dict()
+    # checked line by line on the stderr of the backup and prepare commands, see OutputMonitor
+    output_error_markers = ()  # if any of them is found, the command failed
+    output_success_marker = None  # if set, the command failed unless it is found
+    archive_extension = '.tar'  # of the per-database archives, see archive_databases()
 
     def __init__(self, config, backup):
         """
@@ -44,7 +58,13 @@ class NullBackup:
         Returns true if there were errors on the output of the backup command. As parameters,
         a string containing the standard output and standard error ouput of the backup command.
         Return False if there were not detected errors.
+        It checks the same markers than OutputMonitor, for already buffered output.
         """
+        errors = stderr.decode("utf-8")
+        if (any(marker in errors for marker in self.output_error_markers) or
+                (self.output_success_marker is not None and self.output_success_marker not in errors)):
+            self.logger.error(errors)
+            return True
         return False
 
     def errors_on_log(self):
@@ -55,6 +75,13 @@ class NullBackup:
         """
         return False
 
+    def get_progress_log(self):
+        """
+        Returns the path of the log where the backup command reports the tables being
+        backed up, to monitor its progress, or None if there is none.
+        """
+        return None
+
     def errors_on_metadata(self, backup_dir):
         """
         Checks the metadata file of a backup, and sees if it has the right format and content.
@@ -65,3 +92,142 @@ class NullBackup:
 
     def errors_on_prepare(self, stdout, stderr):
         return False
+
+    def record_success(self, backup_dir):
+        """
+        Called once the backup generated at backup_dir finished its run successfully
+        (including its rotation, if requested). It does nothing.
+        """
+        pass
+
+    def archive_databases(self, source, threads):
+        """
+        Consolidates the files of the backup at the directory source, using up to the given
+        number of parallel threads. Returns 0 if it was successful, non-zero otherwise.
+        """
+        return 0
+
+    def archive_database(self, source, name, files):
+        """
+        Archives the given files of a database at the directory source into the tar file
+        name, removing them. The tar is generated with a partial suffix and only renamed
+        once complete, so an existing name is always a complete archive.
+        Returns 0 if it was successful, non-zero otherwise.
+        """
+        partial_name = name + PARTIAL_SUFFIX
+        result = self.backup.tar_and_remove(source, partial_name, files)
+        if result != 0:
+            return result
+        try:
+            os.rename(os.path.join(source, partial_name), os.path.join(source, name))
+        except OSError:
+            return -1
+        return 0
+
+    def archive_in_parallel(self, source, files, sizes, threads):
+        """
+        Archives each database at the directory source, given a dictionary with the tar
+        name and the list of files of each one, and another with its size in bytes.
+        Databases are archived largest first, so a dominant database does not start last
+        and the total time is bound by it. Returns the number of databases that failed.
+        """
+        order = lpt_order(sizes)
+        self.logger.info('Archiving %s databases (%s bytes) with %s threads, largest first. '
+                         'Expected makespan: %s bytes (%s bytes in alphabetical order)',
+                         len(order), sum(sizes.values()), threads,
+                         simulate_makespan(sizes, order, threads),
+                         simulate_makespan(sizes, sorted(sizes, key=str), threads))
+
+        pool = ThreadPool(threads)
+        results = dict()
+        for name in order:
+            self.logger.debug('Scheduling archive %s (%s files, %s bytes)',
+                              name, len(files[name]), sizes[name])
+            results[name] = pool.apply_async(self.archive_database, (source, name, files[name]))
+        pool.close()
+        pool.join()
+
+        failed = list()
+        for name in order:
+            try:
+                result = results[name].get()
+            except OSError:
+                result = -1
+            if result != 0:
+                failed.append(name)
+        if failed:
+            self.logger.error('%s databases could not be archived: %s',
+                              len(failed), ', '.join(failed))
+        return len(failed)
+
+    def is_extracted(self, source, archive):
+        """
+        Returns True if every member of the (possibly truncated) archive is present at
+        source with its full size, so the archive is no longer needed
+        """
+        members = list()
+        try:
+            with tarfile.open(archive) as tar:
+                try:
+                    for member in tar:
+                        members.append(member)
+                except tarfile.ReadError:
+                    pass  # truncated last member, its file was not removed yet
+        except (tarfile.TarError, OSError):
+            return False
+        for member in members:
+            path = os.path.join(source, member.name)
+            if member.isdir():
+                if not os.path.isdir(path):
+                    return False
+            elif not os.path.isfile(path) or os.path.getsize(path) != member.size:
+                return False
+        return True
+
+    def recover_partial_archives(self, source):
+        """
+        Extracts back the files of archives interrupted on a previous run (which were
+        already removed, as tar deletes them as it goes), without overwriting the
+        files still present, and deletes the partial archives, so they can be archived
+        again. As they are the only copy of those files, they are kept if they could
+        not be fully extracted. Returns 0 if it was successful, non-zero otherwise.
+        """
+        for entry in list_dir(source):
+            if not entry.name.endswith(self.archive_extension + PARTIAL_SUFFIX):
+                continue
+            self.logger.warning('Recovering files of the interrupted archive %s', entry.name)
+            cmd = ['/bin/tar', '--extract', '--skip-old-files', '--file', entry.path,
+                   '--directory', source]
+            process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            # a truncated last member is expected and reported as an error, but its original
+            # file was not removed yet, so it is fine as long as all members are there
+            returncode = process.wait()
+            if returncode != 0 and not self.is_extracted(source, entry.path):
+                self.logger.error('The files of %s could not be extracted (tar returned %s), '
+                                  'keeping it', entry.name, returncode)
+                return returncode
+            try:
+                os.remove(entry.path)
+            except OSError:
+                return -1
+        return 0
+
+    def unarchive_databases(self, source, threads, databases=None):
+        """
+        Extracts back, in parallel, the per-database archives generated by archive_databases()
+        at the directory source (only those of the given list of databases, if set), so the
+        backup has its original layout before recovering it.
+        Returns 0 if it was successful, or the number of archives that failed otherwise.
+        """
+        names = [entry.name for entry in list_dir(source)
+                 if entry.name.endswith(self.archive_extension)
+                 and (databases is None or entry.name[:-len(self.archive_extension)] in databases)]
+        pool = ThreadPool(threads)
+        results = [pool.apply_async(self.backup.untar_and_remove, (source, name)) for name in names]
+        pool.close()
+        pool.join()
+        failed = [name for name, result in zip(names, results) if result.get() != 0]
+        if failed:
+            self.logger.error('%s archives could not be extracted: %s',
+                              len(failed), ', '.join(failed))
+        return len(failed)
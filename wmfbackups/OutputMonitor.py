@@ -0,0 +1,76 @@
+"""
+Incremental consumption of the output of long-running backup processes
+(mydumper, xtrabackup backup and prepare)
+
+Instead of buffering the whole output in memory until the process finishes,
+it is read line by line as it is generated, forwarded to the log, checked for
+error and success markers, and only the last lines are kept, so memory usage
+stays flat no matter how much output the process generates.
+"""
+
+from collections import deque
+import subprocess
+import threading
+
+DEFAULT_TAIL_LINES = 50  # lines of output kept to be logged if the process fails
+MAX_LINE_LENGTH = 65536  # longer lines are processed in chunks of this size (in bytes)
+
+
+class OutputMonitor:
+    """
+    Runs a command, consuming its stdout and stderr line by line. The stderr lines
+    are matched against error_markers (if any is found, the command failed) and
+    success_marker (if given, the command failed unless it is found).
+    """
+
+    def __init__(self, name, logger, error_markers=(), success_marker=None,
+                 tail_lines=DEFAULT_TAIL_LINES):
+        self.name = name  # e.g. backup, prepare, only used for logging
+        self.logger = logger
+        self.error_markers = error_markers
+        self.success_marker = success_marker
+        self.tail = deque(maxlen=tail_lines)
+        self.lock = threading.Lock()
+        self.error_found = False
+        self.success_found = False
+        self.returncode = None
+
+    def feed(self, line, stderr=True):
+        """Processes a new line of output (decoded, without the final newline)"""
+        if stderr:
+            if any(marker in line for marker in self.error_markers):
+                self.error_found = True
+            if self.success_marker is not None and self.success_marker in line:
+                self.success_found = True
+        with self.lock:
+            self.tail.append(line)
+        self.logger.debug('[%s] %s', self.name, line)
+
+    def consume(self, stream, stderr):
+        """Reads the given binary stream until it is closed, feeding it line by line"""
+        for line in iter(lambda: stream.readline(MAX_LINE_LENGTH), b''):
+            self.feed(line.decode('utf-8', errors='replace').rstrip('\n'), stderr)
+        stream.close()
+
+    def run(self, cmd):
+        """Runs the given command until it finishes, and returns its exit code"""
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        readers = [threading.Thread(target=self.consume, args=(process.stdout, False)),
+                   threading.Thread(target=self.consume, args=(process.stderr, True))]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        self.returncode = process.wait()
+        return self.returncode
+
+    def has_errors(self):
+        """
+        Returns True (logging the last lines of output) if an error marker was found
+        or the expected success marker was not, False otherwise.
+        """
+        if self.error_found or (self.success_marker is not None and not self.success_found):
+            self.logger.error('Errors found on the %s output, last lines:\n%s',
+                              self.name, '\n'.join(self.tail))
+            return True
+        return False
@@ -0,0 +1,83 @@
+"""
+Instrumentation of the different phases of a backup run (backup, prepare,
+compress, ...), so it is possible to know which one is the bottleneck
+"""
+
+from collections import namedtuple
+from contextlib import contextmanager
+import resource
+import time
+
+from wmfbackups.FileWalker import get_size
+
+# start is a unix timestamp, wall_time and cpu_time are in seconds
+# bytes_before and bytes_after are None if the size could not be measured
+PhaseTiming = namedtuple('PhaseTiming', ['phase', 'start', 'wall_time', 'cpu_time',
+                                         'bytes_before', 'bytes_after'])
+
+
+def get_children_cpu_time():
+    """
+    Returns the user + system CPU time, in seconds, used so far by the finished
+    (already waited for) child processes of the current process.
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class PhaseTimer:
+    """
+    Measures the wall time, the CPU time used by child processes and the size of the
+    backup before and after each phase, logging it and storing it on the statistics.
+    CPU time is accounted per process, so if several backups run at the same time
+    on the same process (different threads), it will include the usage of all of them.
+    """
+
+    def __init__(self, paths, logger, stats):
+        self.paths = paths  # files and dirs whose size is measured (e.g. backup dir & tarball)
+        self.logger = logger
+        self.stats = stats
+        self.phases = list()
+        self.last_size = None
+
+    def measure_size(self):
+        """Returns the total size of self.paths, or None if it could not be read"""
+        try:
+            return sum(get_size(path) for path in set(self.paths))
+        except OSError:
+            self.logger.warning('The size of the backup could not be measured')
+            return None
+
+    @contextmanager
+    def phase(self, name, measure_size=True):
+        """
+        Context manager timing the code run inside it as the phase with the given name.
+        The timing is recorded even if the code raises an exception or returns early.
+        If measure_size is False (e.g. for a phase running at the same time than others
+        that modify the backup), the size is not measured and recorded as None.
+        """
+        if not measure_size:
+            bytes_before = None
+        # nothing happens between 2 phases, so reuse the last size
+        elif self.last_size is not None:
+            bytes_before = self.last_size
+        else:
+            bytes_before = self.measure_size()
+        start = time.time()
+        start_monotonic = time.monotonic()
+        start_cpu = get_children_cpu_time()
+        try:
+            yield
+        finally:
+            wall_time = time.monotonic() - start_monotonic
+            cpu_time = get_children_cpu_time() - start_cpu
+            bytes_after = None
+            if measure_size:
+                bytes_after = self.measure_size()
+                self.last_size = bytes_after
+            timing = PhaseTiming(name, start, wall_time, cpu_time, bytes_before, bytes_after)
+            self.phases.append(timing)
+            self.logger.info('Phase %s took %.1f seconds (%.1f seconds of CPU on subprocesses), '
+                             'size went from %s to %s bytes',
+                             name, wall_time, cpu_time, bytes_before, bytes_after)
+            self.stats.record_phase(timing)
@@ -0,0 +1,150 @@
+"""
+Progress of a running backup (mydumper or xtrabackup)
+
+While the backup process runs, the output directory is sampled periodically
+to compute how much was generated so far, at which speed, and, based on the
+size of the previous backup of the same section, how long it will take to
+finish. Each sample is written to a local status file and sent as a heartbeat
+to the statistics, so a slow backup (still growing) can be told apart from a
+hung one (not growing for a long time).
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+from wmfbackups.FileWalker import walk
+
+DEFAULT_PROGRESS_INTERVAL = 60  # seconds between samples
+STALL_WARNING = 30 * 60  # seconds without growth after which a warning is logged
+# mydumper info message logged when a table starts to be dumped (not when it finishes)
+TABLE_REGEX = re.compile(r'dumping data for `([^`]*)`\.`([^`]*)`')
+
+
+class ProgressMonitor:
+    """
+    Samples the size and number of files of output_dir every interval seconds, and
+    the tables started to be dumped according to log_file (if given, only with
+    mydumper), publishing them on
+    status_file and as stats heartbeats.
+    """
+
+    def __init__(self, output_dir, status_file, logger, stats, log_file=None,
+                 interval=DEFAULT_PROGRESS_INTERVAL):
+        self.output_dir = output_dir
+        self.status_file = status_file
+        self.logger = logger
+        self.stats = stats
+        self.log_file = log_file
+        self.interval = interval
+        self.expected_size = None  # total size of the previous backup, if known
+        self.tables_started = set()
+        self.log_offset = 0  # bytes of log_file already read
+        self.start_time = None
+        self.last_sample = None
+        self.last_sample_time = None  # time.monotonic() of the last sample
+        self.last_growth = None  # time.monotonic() when the backup last grew
+        self.warned = False
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def read_log(self):
+        """Adds the tables started on the new lines of the log since the last time"""
+        if self.log_file is None:
+            return
+        try:
+            with open(self.log_file, 'rb') as log:
+                log.seek(self.log_offset)
+                data = log.read()
+        except OSError:
+            return
+        lines = data.split(b'\n')
+        # the last line is read again next time, it may not be completely written yet
+        self.log_offset += len(data) - len(lines[-1])
+        for line in lines[:-1]:
+            match = TABLE_REGEX.search(line.decode('utf-8', errors='replace'))
+            if match is not None:
+                self.tables_started.add(match.groups())
+
+    def sample(self):
+        """Returns a dictionary with the current progress of the backup"""
+        now = time.monotonic()
+        size = 0
+        files = 0
+        try:
+            for entry in walk(self.output_dir):
+                if not entry.is_dir:
+                    size += entry.size
+                    files += 1
+        except OSError:
+            pass  # not yet created, or files renamed while reading them
+        self.read_log()
+        elapsed = now - self.start_time
+        throughput = size / elapsed if elapsed > 0 else 0.0  # average since the start
+        if self.last_sample is None:
+            current_throughput = throughput
+        else:
+            interval = now - self.last_sample_time
+            current_throughput = ((size - self.last_sample['bytes']) / interval
+                                  if interval > 0 else 0.0)
+        if (self.last_sample is None or
+                (size, files) != (self.last_sample['bytes'], self.last_sample['files'])):
+            self.last_growth = now
+        timestamp = time.time()
+        eta = None
+        if self.expected_size is not None and throughput > 0 and size < self.expected_size:
+            eta = timestamp + (self.expected_size - size) / throughput
+        progress = {'time': timestamp, 'output_dir': self.output_dir, 'bytes': size,
+                    'files': files,
+                    'tables_started': len(self.tables_started) if self.log_file else None,
+                    'elapsed': elapsed, 'throughput': throughput,
+                    'current_throughput': current_throughput,
+                    'expected_size': self.expected_size, 'eta': eta,
+                    'stalled': now - self.last_growth}
+        self.last_sample = progress
+        self.last_sample_time = now
+        return progress
+
+    def publish(self, progress, running=True):
+        """Writes progress to the status file (atomically) and sends it as a heartbeat"""
+        try:
+            tmp_path = self.status_file + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(dict(progress, running=running), f)
+            os.replace(tmp_path, self.status_file)
+        except OSError:
+            self.logger.warning('Status file %s could not be written', self.status_file)
+        self.stats.heartbeat(progress)
+
+    def check_stall(self, progress):
+        if progress['stalled'] >= STALL_WARNING and not self.warned:
+            self.logger.warning('%s has not grown in the last %.0f seconds', self.output_dir,
+                                progress['stalled'])
+            self.warned = True
+        elif progress['stalled'] < STALL_WARNING:
+            self.warned = False
+
+    def run(self):
+        """Background loop sampling and publishing the progress until stop() is called"""
+        self.expected_size = self.stats.get_previous_size()
+        while not self.stop_event.wait(self.interval):
+            progress = self.sample()
+            self.logger.debug('Progress: %s bytes, %s files, %s tables started, %.0f bytes/s',
+                              progress['bytes'], progress['files'], progress['tables_started'],
+                              progress['throughput'])
+            self.check_stall(progress)
+            self.publish(progress)
+
+    def start(self):
+        self.start_time = time.monotonic()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops sampling, publishing the final progress of the backup"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.publish(self.sample(), running=False)
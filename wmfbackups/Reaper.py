@@ -0,0 +1,180 @@
+"""
+Background deletion of expired backups
+
+Deleting an old uncompressed backup, with hundreds of thousands of files, can
+take a long time. Instead of doing it synchronously, expired backups are
+atomically renamed into a trash dir (so they disappear from the backup dirs
+immediately) and deleted later by a pool of threads, optionally rate limited
+so the freeing of space does not starve the I/O of the backups running at
+the same time.
+"""
+
+from multiprocessing.pool import ThreadPool
+import os
+import queue
+import tempfile
+import threading
+import time
+
+from wmfbackups.FileWalker import list_dir, walk
+from wmfbackups.PhaseTimer import PhaseTiming
+
+TRASH_DIR = '.trash'  # hidden, so it is ignored by the backup discovery, rotation and purging
+DEFAULT_PURGE_WORKERS = 4  # threads unlinking files
+CHUNK_SIZE = 64  # files sent to each worker at a time
+
+
+class Reaper:
+    """
+    Deletes the files and dirs discarded by the backups of the section name on
+    a background thread, using workers threads to unlink files and deleting at
+    most rate bytes per second (unlimited if rate is None).
+    Once all the queued deletions are done, they are logged; their timing (see
+    timing()) is left to be recorded by the owner of the backup statistics.
+    """
+
+    def __init__(self, name, logger, workers=DEFAULT_PURGE_WORKERS, rate=None):
+        self.name = name
+        self.logger = logger
+        self.workers = workers
+        self.rate = rate
+        self.queue = queue.Queue()
+        self.thread = None
+        self.closed = False
+        self.lock = threading.Lock()
+        self.next_slot = 0.0  # time.monotonic() when the rate limit allows the next deletion
+        self.deleted_bytes = 0
+        self.deleted_files = 0
+        self.errors = 0
+        self.start = None  # unix timestamp when the first deletion was queued
+        self.start_monotonic = None
+        self.wall_time = 0.0
+
+    def get_trash_dir(self, directory):
+        return os.path.join(directory, TRASH_DIR)
+
+    def enqueue(self, path):
+        """Queues the deletion of path, starting the background thread if needed"""
+        if self.thread is None:
+            self.start = time.time()
+            self.start_monotonic = time.monotonic()
+            self.thread = threading.Thread(target=self.run)
+            self.thread.start()
+        self.queue.put(path)
+
+    def discard(self, path):
+        """
+        Moves the file or dir at path (atomically, with a rename) to the trash dir of
+        the directory containing it, and queues its deletion.
+        Raises OSError if it could not be moved.
+        """
+        trash_dir = self.get_trash_dir(os.path.dirname(os.path.abspath(path)))
+        os.makedirs(trash_dir, exist_ok=True)
+        # a unique container per discarded path, so names never clash
+        container = tempfile.mkdtemp(prefix=self.name + '.', dir=trash_dir)
+        try:
+            os.rename(path, os.path.join(container, os.path.basename(path)))
+        except OSError:
+            os.rmdir(container)
+            raise
+        self.logger.debug('%s moved to %s to be deleted', path, container)
+        self.enqueue(container)
+
+    def collect(self, directory):
+        """
+        Queues the deletion of the files of this section left on the trash dir of directory
+        by previous runs that were interrupted before they were deleted
+        """
+        try:
+            entries = list_dir(self.get_trash_dir(directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.name.startswith(self.name + '.'):
+                self.enqueue(entry.path)
+
+    def throttle(self, size):
+        """Waits until size bytes can be deleted without exceeding the rate limit"""
+        if self.rate is None:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + size / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def remove_file(self, file):
+        """Unlinks the given (path, size) file, returning True if it was deleted"""
+        path, size = file
+        self.throttle(size)
+        try:
+            os.remove(path)
+        except OSError as ex:
+            self.logger.warning('Error while deleting %s: %s', path, ex)
+            return False
+        with self.lock:
+            self.deleted_bytes += size
+            self.deleted_files += 1
+        return True
+
+    def remove_tree(self, pool, top):
+        """Deletes top and all its contents, unlinking the files on the given pool"""
+        directories = [top]
+
+        def files():
+            for entry in walk(top):
+                path = os.path.join(top, entry.path, entry.name)
+                if entry.is_dir:
+                    directories.append(path)
+                else:
+                    yield (path, entry.size)
+
+        try:
+            for deleted in pool.imap_unordered(self.remove_file, files(), CHUNK_SIZE):
+                if not deleted:
+                    self.errors += 1
+            for directory in reversed(directories):
+                os.rmdir(directory)
+        except OSError as ex:
+            self.logger.error('Error while deleting %s: %s', top, ex)
+            self.errors += 1
+
+    def run(self):
+        """Background loop deleting the queued paths until close() is called"""
+        pool = ThreadPool(self.workers)
+        while True:
+            path = self.queue.get()
+            if path is None:
+                break
+            self.remove_tree(pool, path)
+            self.wall_time = time.monotonic() - self.start_monotonic
+        pool.close()
+        pool.join()
+        self.logger.info('Purged %s bytes (%s files) in %.1f seconds, %s errors',
+                         self.deleted_bytes, self.deleted_files, self.wall_time, self.errors)
+
+    def timing(self):
+        """Returns the PhaseTiming of the deletions done so far, or None if nothing was queued"""
+        if self.start is None:
+            return None
+        return PhaseTiming('purge', self.start, self.wall_time, 0.0, self.deleted_bytes, 0)
+
+    def close(self):
+        """
+        Signals that no more deletions will be queued: the background thread ends once
+        the pending ones are done. Nothing can be discarded after calling it.
+        """
+        if self.thread is not None and not self.closed:
+            self.queue.put(None)
+        self.closed = True
+
+    def wait(self):
+        """
+        Closes the reaper and waits until all the queued deletions are done.
+        Returns the number of errors found.
+        """
+        self.close()
+        if self.thread is not None:
+            self.thread.join()
+        return self.errors
@@ -0,0 +1,169 @@
+"""
+Helpers to schedule independent jobs of known (or estimated) cost, like
+archiving databases or running backups, over a fixed number of parallel workers
+or a shared amount of memory
+"""
+
+from collections import defaultdict, namedtuple
+import heapq
+from multiprocessing.pool import ThreadPool
+import queue
+import re
+import threading
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(size):
+    """
+    Returns the number of bytes of the given size, either an integer or a string with
+    an optional K, M, G or T suffix, like the ones accepted by --use-memory (e.g. '40G').
+    Raises ValueError if it has not that format.
+    """
+    match = re.match(r'^\s*(\d+)\s*([KMGT]?)B?\s*$', str(size), re.IGNORECASE)
+    if match is None:
+        raise ValueError('Invalid size: {}'.format(size))
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).upper()]
+
+
+def lpt_order(costs):
+    """
+    Given a dictionary of job: cost, returns the list of jobs sorted by decreasing
+    cost (Longest Processing Time first), breaking ties by name.
+    Submitting them in that order to a pool whose workers take the next pending job
+    as soon as they are free (e.g. a ThreadPool) keeps the total time within 4/3 of
+    the optimal, and avoids the largest job starting last.
+    """
+    return sorted(costs, key=lambda job: (-costs[job], str(job)))
+
+
+def simulate_makespan(costs, order, workers):
+    """
+    Returns the expected time to finish all jobs (in the same units than costs)
+    if they are submitted in the given order to a pool of the given number of workers.
+    """
+    finish_times = [0] * max(1, workers)
+    for job in order:
+        earliest = heapq.heappop(finish_times)
+        heapq.heappush(finish_times, earliest + costs[job])
+    return max(finish_times)
+
+
+def simulate_pipeline(stages, depth):
+    """
+    Returns the expected time to finish all jobs of a transfer and prepare pipeline, given
+    the list of (transfer, prepare) durations of each job, in the order they are run.
+    Transfers run one after another, each one starting once at most depth previous jobs are
+    waiting for or running their prepare, and prepares start as soon as their transfer
+    finishes (as many at the same time as needed). Jobs with a prepare of None run after
+    the previous transfer without waiting for any prepare.
+    """
+    clock = 0
+    prepared = [0]  # time at which the prepare of each job finishes
+    for transfer, prepare in stages:
+        if prepare is not None and len(prepared) > depth + 1:
+            clock = max(clock, sorted(prepared, reverse=True)[depth])
+        clock += transfer
+        prepared.append(clock + (prepare or 0))
+    return max(prepared)
+
+
+class MemoryBudget:
+    """
+    A total amount of memory (e.g. of a host) shared by jobs running at the same time,
+    each one reserving the memory it needs while it runs. Jobs needing more than the
+    total are allowed, but only alone.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, amount):
+        """Waits until amount is available (or nothing else is running) and reserves it"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.used == 0 or self.used + amount <= self.total)
+            self.used += amount
+
+    def release(self, amount):
+        """Returns the amount reserved by acquire() to the budget"""
+        with self.condition:
+            self.used -= amount
+            self.condition.notify_all()
+
+
+Job = namedtuple('Job', ['name', 'function', 'args', 'resources', 'cost'])
+
+
+class ResourceScheduler:
+    """
+    Runs named jobs on a pool of threads, each one holding a slot of every resource it
+    uses (e.g. its source and destination hosts) while it runs, with at most
+    limits[resource] (or default_limit) jobs using the same resource at the same time.
+    Whenever slots are free, pending jobs are started by decreasing cost (largest first,
+    like lpt_order(); jobs of unknown cost, None, go first in the order they were added),
+    skipping the ones whose resources are busy, so a blocked job does not hold back
+    the others.
+    """
+
+    def __init__(self, limits=None, default_limit=1):
+        self.limits = dict() if limits is None else limits
+        self.default_limit = default_limit
+        self.jobs = list()
+
+    def add(self, name, function, args=(), resources=(), cost=None):
+        self.jobs.append(Job(name, function, args, tuple(resources), cost))
+
+    def get_limit(self, resource):
+        return max(1, self.limits.get(resource, self.default_limit))
+
+    def get_order(self):
+        """Returns the names of the jobs, in the order they will be tried to be started"""
+        order = sorted(range(len(self.jobs)),
+                       key=lambda i: (self.jobs[i].cost is not None, -(self.jobs[i].cost or 0), i))
+        return [self.jobs[i].name for i in order]
+
+    def run(self):
+        """
+        Runs all the jobs and waits for them to finish. Returns a dictionary with the
+        result of each job, by name. Exceptions raised by a job are raised once the jobs
+        that were running have finished (the pending ones are not started, their result
+        is None).
+        """
+        jobs = {job.name: job for job in self.jobs}
+        pending = self.get_order()
+        used = defaultdict(int)
+        results = dict()
+        finished = queue.Queue()
+        running = 0
+        error = None
+        pool = ThreadPool(max(1, len(self.jobs)))
+        while pending or running > 0:
+            for name in list(pending):
+                job = jobs[name]
+                if error is not None:
+                    pending.remove(name)
+                    results[name] = None
+                elif all(used[resource] < self.get_limit(resource) for resource in job.resources):
+                    pending.remove(name)
+                    for resource in job.resources:
+                        used[resource] += 1
+                    pool.apply_async(job.function, job.args,
+                                     callback=lambda result, name=name: finished.put((name, result, None)),
+                                     error_callback=lambda ex, name=name: finished.put((name, None, ex)))
+                    running += 1
+            if running == 0:
+                continue
+            name, result, exception = finished.get()
+            running -= 1
+            for resource in jobs[name].resources:
+                used[resource] -= 1
+            results[name] = result
+            if exception is not None and error is None:
+                error = exception
+        pool.close()
+        pool.join()
+        if error is not None:
+            raise error
+        return results
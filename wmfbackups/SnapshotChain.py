@@ -0,0 +1,154 @@
+"""
+Chains of incremental snapshots
+
+A chain is a full snapshot followed by incremental ones, each one containing
+only the InnoDB pages changed since the previous one (from its LSN, the log
+sequence number where the previous backup ended). The chains of each section
+are recorded on a small json file, so the next snapshot knows from which LSN
+it has to copy, even after the previous ones were compressed and rotated, and
+so the snapshots needed to recover a more recent one are not purged.
+"""
+
+import json
+import logging
+import os
+
+CHECKPOINTS_FILE = 'xtrabackup_checkpoints'
+
+
+def read_checkpoints(directory):
+    """
+    Returns a dictionary with the contents of the xtrabackup_checkpoints file of the
+    snapshot at directory (backup_type, from_lsn, to_lsn, ...), with the lsns as integers.
+    Raises OSError if it cannot be read and ValueError if it has an unexpected format.
+    """
+    checkpoints = dict()
+    with open(os.path.join(directory, CHECKPOINTS_FILE), 'r') as f:
+        for line in f:
+            if '=' not in line:
+                continue
+            key, value = [part.strip() for part in line.split('=', 1)]
+            checkpoints[key] = int(value) if key.endswith('_lsn') else value
+    if 'backup_type' not in checkpoints or 'to_lsn' not in checkpoints:
+        raise ValueError('{} has not the expected format'.format(CHECKPOINTS_FILE))
+    return checkpoints
+
+
+def is_incremental(checkpoints):
+    return checkpoints['backup_type'] == 'incremental'
+
+
+class SnapshotChain:
+    """
+    The chains of snapshots of a section, stored at path as a list of
+    {name, incremental, from_lsn, to_lsn} dictionaries, oldest first: each full
+    snapshot starts a new chain, followed by its incremental ones. The last chain
+    is the one new snapshots continue.
+    """
+
+    def __init__(self, path, max_depth=0):
+        self.path = path
+        self.max_depth = max_depth  # max incrementals after a full, 0 to always take fulls
+        self.members = list()
+
+    def load(self):
+        """
+        Reads the chain from its file. An unreadable or missing chain is considered
+        empty (so the next snapshot is a full one). Returns True if it was read.
+        """
+        logger = logging.getLogger('backup')
+        try:
+            with open(self.path, 'r') as f:
+                self.members = json.load(f)['members']
+        except FileNotFoundError:
+            self.members = list()
+            return False
+        except (OSError, ValueError, KeyError):
+            logger.warning('Snapshot chain %s could not be read, a full snapshot will be taken',
+                           self.path)
+            self.members = list()
+            return False
+        return True
+
+    def save(self):
+        """Writes the chain atomically. Returns True if it was successful."""
+        logger = logging.getLogger('backup')
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'members': self.members}, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            logger.error('Snapshot chain %s could not be written', self.path)
+            return False
+        return True
+
+    def get_chain(self, name=None):
+        """
+        Returns the members needed to recover the snapshot name (the last one, if None):
+        the full snapshot starting its chain and the incremental ones up to it, in order.
+        Returns an empty list if it is not recorded or its full snapshot is not.
+        """
+        names = [member['name'] for member in self.members]
+        if name is None:
+            position = len(names) - 1
+        elif name in names:
+            position = names.index(name)
+        else:
+            return list()
+        start = position
+        while start >= 0 and self.members[start]['incremental']:
+            start -= 1
+        if start < 0:
+            return list()
+        return self.members[start:position + 1]
+
+    def get_dependents(self, name):
+        """
+        Returns the names of the incremental snapshots recorded after name on its same
+        chain, which cannot be recovered without it
+        """
+        names = [member['name'] for member in self.members]
+        if name not in names:
+            return list()
+        dependents = list()
+        for member in self.members[names.index(name) + 1:]:
+            if not member['incremental']:
+                break
+            dependents.append(member['name'])
+        return dependents
+
+    def remove(self, names):
+        """Forgets the given snapshots, e.g. once they have been purged"""
+        self.members = [member for member in self.members if member['name'] not in names]
+
+    @property
+    def depth(self):
+        """Number of incremental snapshots on top of the full one of the last chain"""
+        return max(0, len(self.get_chain()) - 1)
+
+    def get_incremental_lsn(self):
+        """
+        Returns the lsn the next snapshot has to start from, if it should be an incremental
+        one, or None if a new full snapshot has to be taken (no chain yet, chains disabled or
+        the max depth was reached).
+        """
+        if self.max_depth <= 0 or not self.get_chain() or self.depth >= self.max_depth:
+            return None
+        return self.members[-1]['to_lsn']
+
+    def add(self, name, checkpoints):
+        """
+        Records the snapshot name, given its checkpoints, as the last of the last chain.
+        A full one starts a new chain. Returns False if it is an incremental snapshot that
+        does not continue the last chain (in which case, nothing is recorded).
+        """
+        if any(member['name'] == name for member in self.members):
+            return True  # already recorded, e.g. a resumed postprocessing
+        member = {'name': name, 'incremental': is_incremental(checkpoints),
+                  'from_lsn': checkpoints.get('from_lsn', 0), 'to_lsn': checkpoints['to_lsn']}
+        if member['incremental'] and (not self.get_chain()
+                                      or self.members[-1]['to_lsn'] != member['from_lsn']):
+            return False
+        self.members.append(member)
+        return True
@@ -0,0 +1,179 @@
+"""
+Streaming archiver
+
+Builds the final compressed tarball of a backup while the backup is still
+being generated: files that have not been modified for a while are added to
+a tar stream piped into the compression program as soon as they are found,
+so most of the data is read back while it is still on the page cache and the
+compression overlaps with the backup generation.
+Files are only removed once the whole tarball has been generated and checked,
+so if anything goes wrong (e.g. a file was modified after being added), the
+tarball is discarded and the backup dir can still be compressed the usual way.
+"""
+
+import os
+import shutil
+import subprocess
+import tarfile
+import threading
+import time
+
+from wmfbackups.FileWalker import walk
+
+DEFAULT_QUIET_PERIOD = 60  # seconds without modification to consider a file finished
+DEFAULT_POLL_INTERVAL = 10  # seconds between scans of the backup dir
+TEMPORARY_FILE_SUFFIXES = ('.partial', '.tmp')  # renamed at the end, only add them on finish
+
+
+class StreamingArchiver:
+    """
+    Generates backup_dir/file_name, a tarball of backup_dir/dir_name compressed with
+    compression_cmd (or uncompressed, if it is None), adding files to it while they
+    are being generated.
+    """
+
+    def __init__(self, backup_dir, dir_name, file_name, compression_cmd, logger,
+                 quiet_period=DEFAULT_QUIET_PERIOD, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.backup_dir = backup_dir
+        self.dir_name = dir_name
+        self.output_dir = os.path.join(backup_dir, dir_name)
+        self.tar_file = os.path.join(backup_dir, file_name)
+        self.compression_cmd = compression_cmd
+        self.logger = logger
+        self.quiet_period = quiet_period
+        self.poll_interval = poll_interval
+        self.added = dict()  # relative path: (size, mtime) of each file added
+        self.error = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.output = None
+        self.process = None
+        self.tar = None
+
+    def add_entries(self, final=False):
+        """
+        Adds to the tar stream the directories and the files not modified in the last
+        quiet_period seconds (or all of them, if final is True) not already added.
+        """
+        if not os.path.isdir(self.output_dir):
+            return  # backup not yet started
+        if self.dir_name not in self.added:
+            self.tar.addfile(self.tar.gettarinfo(self.output_dir, arcname=self.dir_name))
+            self.added[self.dir_name] = None
+        now = time.time()
+        for entry in walk(self.output_dir):
+            relative_path = os.path.join(entry.path, entry.name)
+            if relative_path in self.added:
+                continue
+            if not final and not entry.is_dir and (entry.name.endswith(TEMPORARY_FILE_SUFFIXES)
+                                                   or now - entry.mtime < self.quiet_period):
+                continue
+            path = os.path.join(self.output_dir, relative_path)
+            tarinfo = self.tar.gettarinfo(path, arcname=os.path.join(self.dir_name, relative_path))
+            if tarinfo.isreg():
+                with open(path, 'rb') as f:
+                    self.tar.addfile(tarinfo, f)
+                self.added[relative_path] = (tarinfo.size, entry.mtime)
+            else:
+                self.tar.addfile(tarinfo)
+                self.added[relative_path] = None
+
+    def run(self):
+        """Background loop adding finished files until stop() is called"""
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                self.add_entries()
+            except (OSError, tarfile.TarError) as ex:
+                self.error = ex
+                return
+
+    def start(self):
+        """Starts the compression process and the background thread"""
+        self.logger.debug('Streaming %s into %s', self.output_dir, self.tar_file)
+        self.output = open(self.tar_file, 'wb')
+        if self.compression_cmd is None:
+            stream = self.output
+        else:
+            self.process = subprocess.Popen(self.compression_cmd, stdin=subprocess.PIPE,
+                                            stdout=self.output, stderr=subprocess.DEVNULL)
+            stream = self.process.stdin
+        self.tar = tarfile.open(fileobj=stream, mode='w|', format=tarfile.GNU_FORMAT)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops the background thread"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def changed_files(self):
+        """Returns the list of files added that were later modified or deleted"""
+        changed = list()
+        for relative_path, added in self.added.items():
+            if added is None:
+                continue
+            try:
+                statinfo = os.stat(os.path.join(self.output_dir, relative_path))
+            except OSError:
+                changed.append(relative_path)
+                continue
+            if (statinfo.st_size, statinfo.st_mtime) != added:
+                changed.append(relative_path)
+        return changed
+
+    def finish(self):
+        """
+        Once the backup has finished, adds the remaining files, checks no file
+        was modified after being added, and finishes the compressed tarball, removing
+        the original dir. Returns 0 if it was successful. Otherwise, it deletes the
+        tarball (keeping the original dir) and returns a non-zero value.
+        """
+        self.stop()
+        try:
+            if self.error is not None:
+                raise self.error
+            self.add_entries(final=True)
+            changed = self.changed_files()
+            if changed:
+                self.logger.warning('%s file(s) changed after being streamed, e.g. %s',
+                                    len(changed), changed[0])
+                self.abort()
+                return 1
+            self.tar.close()
+            if self.process is not None:
+                self.process.stdin.close()
+        except (OSError, tarfile.TarError) as ex:
+            self.logger.warning('Streaming compression failed: %s', ex)
+            self.abort()
+            return 1
+        returncode = 0 if self.process is None else self.process.wait()
+        self.output.close()
+        if returncode != 0:
+            self.abort()
+            return returncode
+        shutil.rmtree(self.output_dir)
+        return 0
+
+    def abort(self):
+        """Stops streaming and deletes the partial tarball, leaving the original dir alone"""
+        self.stop()
+        if self.tar is not None:
+            try:
+                self.tar.close()  # otherwise it is closed (and written to) when garbage collected
+            except (OSError, ValueError, tarfile.TarError):
+                pass
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+        if self.output is not None:
+            self.output.close()
+        try:
+            os.remove(self.tar_file)
+        except OSError:
+            pass
@@ -0,0 +1,74 @@
+"""
+Execution of independent steps of a backup run at the same time
+
+Some postprocessing steps have to wait for others (e.g. the compression of a
+backup, for the archiving of its databases), but others do not depend on them
+(e.g. sending the statistics, which is mostly waiting on the database), so
+they can overlap.
+"""
+
+from multiprocessing.pool import ThreadPool
+import queue
+
+
+class TaskGraph:
+    """
+    Set of named tasks, each one a function returning 0 on success and an error
+    code otherwise, which are run on a pool of threads as soon as all the tasks
+    they depend on have finished successfully.
+    """
+
+    def __init__(self):
+        self.tasks = dict()  # name: (function, args, dependencies), in insertion order
+
+    def add(self, name, function, args=(), dependencies=()):
+        """
+        Adds a task. Dependencies on tasks that were not added are ignored (e.g. because
+        that step was not needed), so optional steps can be added conditionally.
+        """
+        self.tasks[name] = (function, args, dependencies)
+
+    def run(self):
+        """
+        Runs all the tasks and waits for them to finish. Returns a dictionary with the
+        result of each task: its return value, or None if it was not run because a task
+        it depends on failed. Exceptions raised by a task are raised once all the
+        tasks that were running have finished.
+        """
+        dependencies = {name: [dependency for dependency in task[2] if dependency in self.tasks]
+                        for name, task in self.tasks.items()}
+        results = dict()
+        finished = queue.Queue()
+        pending = list(self.tasks)
+        running = 0
+        error = None
+        pool = ThreadPool(max(1, len(self.tasks)))
+        while pending or running > 0:
+            for name in list(pending):
+                done = [dependency for dependency in dependencies[name] if dependency in results]
+                if error is not None or any(results[dependency] != 0 for dependency in done):
+                    # a dependency failed or was skipped, or a task raised an exception
+                    pending.remove(name)
+                    results[name] = None
+                elif len(done) == len(dependencies[name]):
+                    pending.remove(name)
+                    function, args, _ = self.tasks[name]
+                    pool.apply_async(function, args,
+                                     callback=lambda result, name=name: finished.put((name, result, None)),
+                                     error_callback=lambda ex, name=name: finished.put((name, None, ex)))
+                    running += 1
+            if running == 0:
+                if pending:
+                    error = ValueError('Circular dependency between tasks {}'.format(pending))
+                    pending = list()
+                continue
+            name, result, exception = finished.get()
+            running -= 1
+            results[name] = result
+            if exception is not None and error is None:
+                error = exception
+        pool.close()
+        pool.join()
+        if error is not None:
+            raise error
+        return results
@@ -1,26 +1,40 @@
-import re
 import datetime
 import logging
+from multiprocessing.pool import ThreadPool
 import os
 import subprocess
 import shutil
 import sys
 
-from wmfbackups.BackupStatistics import DatabaseBackupStatistics, DisabledBackupStatistics
+from wmfbackups.BackupCatalog import BackupCatalog, DATE_FORMAT, parse_backup_name
+from wmfbackups.BackupStatistics import DatabaseBackupStatistics, DisabledBackupStatistics, \
+    SpoolBackupStatistics
+from wmfbackups.Checkpoint import Checkpoint
+from wmfbackups.Compressor import COMPRESSORS, get_compressor, split_extension
+from wmfbackups.FileWalker import walk
 from wmfbackups.NullBackup import NullBackup, BackupException
 from wmfbackups.MariaBackup import MariaBackup
 from wmfbackups.MyDumperBackup import MyDumperBackup
+from wmfbackups.OutputMonitor import OutputMonitor
+from wmfbackups.PhaseTimer import PhaseTimer, PhaseTiming
+from wmfbackups.ProgressMonitor import ProgressMonitor, DEFAULT_PROGRESS_INTERVAL
+from wmfbackups.Reaper import Reaper
+from wmfbackups.Scheduling import parse_size
+from wmfbackups.StreamingArchiver import StreamingArchiver
+from wmfbackups.TaskGraph import TaskGraph
+import wmfbackups.TarArchiver as TarArchiver
 
 DEFAULT_BACKUP_PATH = '/srv/backups'
 ONGOING_BACKUP_DIR = 'ongoing'
 FINAL_BACKUP_DIR = 'latest'
 ARCHIVE_BACKUP_DIR = 'archive'
-DATE_FORMAT = '%Y-%m-%d--%H-%M-%S'
 DEFAULT_BACKUP_TYPE = 'dump'
 DEFAULT_BACKUP_THREADS = 18
 DEFAULT_PORT = 3306
 DEFAULT_RETENTION_DAYS = 18
 SUPPORTED_BACKUP_TYPES = ['dump', 'snapshot', 'null']
+DEFAULT_ARCHIVE_METHOD = 'tar'
+SUPPORTED_ARCHIVE_METHODS = ['tar', 'python']
 
 
 class WMFBackup:
@@ -48,14 +62,22 @@ class WMFBackup:
 
     @property
     def name_regex(self):
-        return self.config['type'] + \
-               r'\.([a-z0-9\-_]+)\.(20\d\d-[01]\d-[0123]\d\--\d\d-\d\d-\d\d)(\.[a-z0-9\.]+)?'
+        """
+        Regex of the backup names of this type, kept for external callers: backups are
+        parsed with BackupCatalog.parse_backup_name()
+        """
+        return (self.config['type']
+                + r'\.([a-z0-9\-_]+)\.(20\d\d-[01]\d-[0123]\d\--\d\d-\d\d-\d\d)(\.[a-z0-9\.]+)?')
+
+    @property
+    def compressor(self):
+        return get_compressor(self.config.get('compressor'))
 
     def generate_file_name(self, backup_dir):
         formatted_date = datetime.datetime.now().strftime(DATE_FORMAT)
         self.dir_name = f'{self.config.get("type")}.{self.name}.{formatted_date}'
         if self.config.get('compress', False):
-            extension = '.tar.gz'
+            extension = self.compressor.extension
         else:
             extension = ''
         self.file_name = self.dir_name + extension
@@ -67,20 +89,20 @@ class WMFBackup:
         backup_dir, dir_name, file_name, and log file
         """
         type = self.config['type']
-        regex = r'.*/(([^/\.]+)\.([^/\.]+)\.\d\d\d\d-\d\d-\d\d--\d\d-\d\d-\d\d)/*$'
-        result = re.match(regex, self.name)
-        if not result or not os.path.isdir(self.name):
+        path = os.path.normpath(self.name)
+        parsed = parse_backup_name(os.path.basename(path))
+        if parsed is None or parsed[3] != '' or not os.path.isdir(self.name):
             self.logger.error('%s is not a valid absolute path directory', self.name)
             return None
-        if result.group(2) != type:
+        if parsed[0] != type:
             msg = 'A %s backup was requested, but a %s dir was provided'
-            self.logger.error(msg, type, result.group(2))
+            self.logger.error(msg, type, parsed[0])
             return None
-        backup_dir = os.path.normpath(os.path.join(self.name, '..'))  # /backups/ongoing
-        self.name = result.group(3)  # section identifier e.g. 's1'
-        self.dir_name = result.group(1)  # type.section.date
+        backup_dir = os.path.dirname(path)  # /backups/ongoing
+        self.name = parsed[1]  # section identifier e.g. 's1'
+        self.dir_name = os.path.basename(path)  # type.section.date
         if self.config.get('compress', False):
-            extension = '.tar.gz'
+            extension = self.compressor.extension
         else:
             extension = ''
         self.file_name = self.dir_name + extension  # e.g. type.section.date.tar.gz
@@ -91,100 +113,232 @@ class WMFBackup:
         """
         Generates the backup name and returns the log path of the only backup file/dir within
         backup_dir patch of the correct name and type.
+        If it is an already compressed tarball, file_name is set to it, whatever the
+        configured compression.
         If there is none or more than one, log an error and return None.
         """
         type = self.config['type']
         name = self.name
-        # TODO: Use regex instead? Or make compulsory a full name?
-        try:
-            potential_files = [f for f in os.listdir(backup_dir) if f.startswith('.'.join([type,
-                                                                                           name,
-                                                                                           '']))]
-        except FileNotFoundError:
+        if not os.path.isdir(backup_dir):
             self.logger.error('%s directory not found', backup_dir)
             return None
+        potential_files = BackupCatalog([backup_dir]).scan().backups(type, name)
+        if self.config.get('resume', False):
+            potential_files = self.discard_partial_tarball(backup_dir, potential_files)
         if len(potential_files) != 1:
             msg = 'Expecting 1 matching %s for %s, found %s'
             self.logger.error(msg, type, name, len(potential_files))
             return None
-        self.dir_name = potential_files[0]
-        if self.config.get('compress', False):
-            extension = '.tar.gz'
+        self.dir_name, compressor = split_extension(potential_files[0].name)
+        if compressor is not None:
+            extension = compressor.extension
+        elif self.config.get('compress', False):
+            extension = self.compressor.extension
         else:
             extension = ''
         self.file_name = self.dir_name + extension
         self.log_file = os.path.join(backup_dir, f'{type}_log.{name}')
         return 0
 
-    def os_rename(self, source, destination):
+    def discard_partial_tarball(self, backup_dir, records):
         """
-        os.rename only works between same devices (not physical rename with
-        copy + delete. Reimplement it with execution of mv and handle
-        the errors.
+        Given the backup records found at backup_dir, if they are the dir and the tarball of
+        the same backup, and the checkpoint of the dir does not have the compression as done,
+        the tarball is the leftover of a failed compression: it is deleted and only the dir is
+        returned. Otherwise, the records are returned unchanged.
         """
-        cmd = ['/bin/mv', source, destination]
-        process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        returncode = subprocess.Popen.wait(process)
-        return returncode
+        directories = [record for record in records if record.is_dir]
+        if len(records) != 2 or len(directories) != 1 or records[0].dir_name != records[1].dir_name:
+            return records
+        checkpoint = Checkpoint(backup_dir, directories[0].name)
+        if not checkpoint.exists() or not checkpoint.load() or checkpoint.is_done('compress'):
+            return records
+        tarball = [record for record in records if not record.is_dir][0]
+        self.logger.warning('Deleting %s, left by a compression that did not finish', tarball.path)
+        try:
+            os.remove(tarball.path)
+        except OSError as ex:
+            self.logger.error('Error while deleting %s: %s', tarball.path, ex)
+            return records
+        return directories
+
+    def same_filesystem(self, source, destination):
+        """
+        Returns True if source and the directory that will contain destination are on
+        the same device, so a rename is possible. Raises OSError if they don't exist.
+        """
+        destination_dir = os.path.dirname(os.path.abspath(destination))
+        return os.stat(source, follow_symlinks=False).st_dev == os.stat(destination_dir).st_dev
+
+    @staticmethod
+    def remove_partial_copy(temporary):
+        """Deletes the partial copy left at temporary by copy_and_remove(), if any"""
+        if os.path.isdir(temporary) and not os.path.islink(temporary):
+            shutil.rmtree(temporary, ignore_errors=True)
+            return
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+
+    def copy_and_remove(self, source, destination):
+        """
+        Copies the file or directory tree source to destination, copying the files
+        concurrently (largest first), and deletes source once everything has been copied.
+        The copy is done on a hidden temporary name, renamed at the end, so destination
+        is never seen partially copied. Returns 0 if it was successful, non-zero otherwise
+        (in which case the copy is deleted and source kept).
+        """
+        temporary = os.path.join(os.path.dirname(os.path.abspath(destination)),
+                                 '.' + os.path.basename(destination) + '.partial')
+        try:
+            if not os.path.isdir(source) or os.path.islink(source):
+                shutil.copy2(source, temporary, follow_symlinks=False)
+                os.rename(temporary, destination)
+                os.remove(source)
+                return 0
+            files = list()
+            os.mkdir(temporary)
+            for entry in walk(source):
+                relative_path = os.path.join(entry.path, entry.name)
+                if entry.is_dir:
+                    os.mkdir(os.path.join(temporary, relative_path))
+                else:
+                    files.append((entry.size, relative_path))
+        except OSError as ex:
+            self.logger.error('Error while copying %s to %s: %s', source, destination, ex)
+            self.remove_partial_copy(temporary)
+            return ex.errno or 1
+
+        def copy(relative_path):
+            try:
+                shutil.copy2(os.path.join(source, relative_path),
+                             os.path.join(temporary, relative_path), follow_symlinks=False)
+            except OSError as ex:
+                return ex
+            return None
+
+        pool = ThreadPool(self.config.get('threads', DEFAULT_BACKUP_THREADS))
+        errors = [error for error in pool.map(copy, [path for _, path in sorted(files, reverse=True)])
+                  if error is not None]
+        pool.close()
+        pool.join()
+        try:
+            if errors:
+                raise errors[0]
+            # directory metadata last, as adding the files modifies it
+            for entry in walk(source):
+                if entry.is_dir:
+                    relative_path = os.path.join(entry.path, entry.name)
+                    shutil.copystat(os.path.join(source, relative_path),
+                                    os.path.join(temporary, relative_path))
+            shutil.copystat(source, temporary)
+            os.rename(temporary, destination)
+        except OSError as ex:
+            self.logger.error('Error while copying %s to %s (%s errors), e.g.: %s',
+                              source, destination, max(1, len(errors)), ex)
+            self.remove_partial_copy(temporary)
+            return ex.errno or 1
+        shutil.rmtree(source)
+        return 0
 
-    def move_backups(self, name, source, destination, regex):
+    def os_rename(self, source, destination):
+        """
+        Moves the file or directory source to destination. If both are on the same
+        filesystem, it is just a rename (a metadata operation); otherwise, it falls back
+        to a parallel copy followed by the deletion of the source.
+        Returns 0 if it was successful, non-zero otherwise.
+        """
+        try:
+            if self.same_filesystem(source, destination):
+                os.rename(source, destination)
+                return 0
+        except OSError as ex:
+            self.logger.error('Error while moving %s to %s: %s', source, destination, ex)
+            return ex.errno or 1
+        return self.copy_and_remove(source, destination)
+
+    def move_backups(self, name, source, destination, catalog=None):
         """
         Move directories (and all its contents) from source to destination
         for all dirs that have the right format (dump.section.date) and
-        section matches the given name
+        section matches the given name. If a catalog including source is given,
+        it is used (and updated) instead of reading source again.
         """
-        files = os.listdir(source)
-        pattern = re.compile(regex)
-        for entry in files:
-            match = pattern.match(entry)
-            if match is None:
-                continue
-            if name == match.group(1):
-                self.logger.debug('Archiving %s', entry)
-                path = os.path.join(source, entry)
-                result = self.os_rename(path, os.path.join(destination, entry))
-                if result != 0:
-                    return result
+        if catalog is None:
+            catalog = BackupCatalog([source]).scan()
+        for record in catalog.backups(self.config['type'], name, source):
+            self.logger.debug('Archiving %s', record.name)
+            result = self.os_rename(record.path, os.path.join(destination, record.name))
+            if result != 0:
+                return result
+            catalog.move(record, destination)
         return 0
 
-    def purge_backups(self, source=None, days=None, regex=None):
+    def purge_backups(self, source=None, days=None, catalog=None, chain=None):
         """
         Remove subdirectories in source dir and all its contents for dirs/files that
         have the right format (dump.section.date), its sections matches the current
         section, and are older than the given
         number of days.
+        They are moved to the trash dir of source and deleted in the background (see
+        wait_for_purge()). Returns 0 if successful, the error code of the failed move otherwise.
+        If a catalog including source is given, it is used (and updated) instead of reading
+        source again. If a SnapshotChain is given, snapshots needed to recover a more recent
+        one that is kept are not purged, and the purged ones are removed from the chain.
         """
         if source is None:
             source = self.default_archive_backup_dir
         if days is None:
             days = self.config['retention']
-        if regex is None:
-            regex = self.name_regex
-        files = os.listdir(source)
-        pattern = re.compile(regex)
-        for entry in files:
-            path = os.path.join(source, entry)
-            match = pattern.match(entry)
-            if match is None:
+        if catalog is None:
+            catalog = BackupCatalog([source]).scan()
+        self.reaper.collect(source)
+        expired = [record for record in catalog.backups(self.config['type'], self.name, source)
+                   if (record.date < (datetime.datetime.now() - datetime.timedelta(days=days)) and
+                       record.date > datetime.datetime(2018, 1, 1))]
+        expired_names = set(record.dir_name for record in expired)
+        purged = list()
+        result = 0
+        for record in expired:
+            if chain is not None and any(name not in expired_names
+                                         for name in chain.get_dependents(record.dir_name)):
+                self.logger.debug('keeping backup %s, needed by more recent incremental '
+                                  'snapshots', record.path)
                 continue
-            if self.name != match.group(1):
-                continue
-            timestamp = datetime.datetime.strptime(match.group(2), DATE_FORMAT)
-            if (timestamp < (datetime.datetime.now() - datetime.timedelta(days=days)) and
-                    timestamp > datetime.datetime(2018, 1, 1)):
-                self.logger.debug('purging backup %s', path)
-                try:
-                    if os.path.isdir(path):
-                        shutil.rmtree(path)
-                    else:
-                        os.remove(path)
-                except OSError as e:
-                    return e.errno
-        return 0
+            self.logger.debug('purging backup %s', record.path)
+            try:
+                self.reaper.discard(record.path)
+            except OSError as e:
+                result = e.errno
+                break
+            catalog.remove(record)
+            purged.append(record.dir_name)
+        if chain is not None and purged:
+            chain.remove(purged)
+            chain.save()
+        return result
+
+    def wait_for_purge(self):
+        """
+        Waits until the old backups purged by rotate_backups() have been deleted and
+        records the purge phase, from the calling thread, as the statistics connection
+        cannot be shared with the deletion thread.
+        Returns 0 if all of them were deleted, 1 otherwise.
+        """
+        errors = self.reaper.wait()
+        timing = self.reaper.timing()
+        if timing is not None:
+            self.stats.record_phase(timing)
+            self.stats.close()
+        return 0 if errors == 0 else 1
 
     def tar_and_remove(self, source, name, files, compression=None):
         """Create a tar with the given path and remove the original file or files
-           at the same time, to save space"""
+           at the same time, to save space. Uncompressed tars are generated in-process
+           if archive_method is 'python'"""
+        if compression is None and self.config.get('archive_method', DEFAULT_ARCHIVE_METHOD) == 'python':
+            return TarArchiver.tar_and_remove(source, name, files)
         cmd = ['/bin/tar']
         tar_file = os.path.join(source, '{}'.format(name))
         cmd.extend(['--create', '--remove-files', '--file', tar_file, '--directory', source])
@@ -197,17 +351,246 @@ class WMFBackup:
         returncode = subprocess.Popen.wait(process)
         return returncode
 
+    def untar_and_remove(self, source, name):
+        """Extract the uncompressed tar source/name into source and remove it, in-process
+           if archive_method is 'python'"""
+        if self.config.get('archive_method', DEFAULT_ARCHIVE_METHOD) == 'python':
+            return TarArchiver.untar_and_remove(name, source)
+        tar_file = os.path.join(source, name)
+        cmd = ['/bin/tar', '--extract', '--file', tar_file, '--directory', source]
+        self.logger.debug(cmd)
+        process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        returncode = subprocess.Popen.wait(process)
+        if returncode == 0:
+            os.remove(tar_file)
+        return returncode
+
+    def extract_backup(self, record, target_dir):
+        """
+        Copies the backup of the given BackupRecord into target_dir, extracting it if it is a
+        tarball, and leaving the original untouched. Returns 0 if successful, non-zero otherwise.
+        """
+        if record.is_dir:
+            try:
+                shutil.copytree(record.path, os.path.join(target_dir, record.name), symlinks=True)
+            except OSError as ex:
+                self.logger.error('Error while copying %s to %s: %s', record.path, target_dir, ex)
+                return ex.errno or 1
+            return 0
+        _, compressor = split_extension(record.name)
+        if compressor is None:
+            self.logger.error('%s is not a known backup tarball', record.path)
+            return 1
+        cmd = ['/bin/tar', '--extract', '--file', record.path, '--directory', target_dir]
+        decompression = compressor.get_decompress_cmd(self.config.get('threads', DEFAULT_BACKUP_THREADS))
+        if decompression is not None:
+            cmd.extend(['--use-compress-program', ' '.join(decompression)])
+        self.logger.debug(cmd)
+        process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return process.wait()
+
+    def copy_unarchived(self, backup, record, target_dir):
+        """
+        Copies the backup of the given BackupRecord into target_dir (see extract_backup())
+        and extracts back its per-database archives, so it has its original layout.
+        Returns 0 if successful, 11 if it could not be copied (or it already exists at
+        target_dir) and 14 if its databases could not be unarchived.
+        """
+        directory = os.path.join(target_dir, record.dir_name)
+        if os.path.exists(directory):
+            self.logger.error('%s already exists', directory)
+            return 11
+        self.logger.info('Copying %s to %s', record.path, target_dir)
+        if self.extract_backup(record, target_dir) != 0:
+            self.logger.error('%s could not be copied', record.path)
+            return 11
+        if backup.unarchive_databases(directory, self.config.get('threads', DEFAULT_BACKUP_THREADS)) != 0:
+            return 14
+        return 0
+
+    def restore_backup(self, target_dir):
+        """
+        Copies the most recent backup of the section, found on the ongoing, latest or
+        archive dirs, into target_dir, decompressed and with its databases unarchived: e.g.
+        a full snapshot (already prepared) is left ready to be copied back, without needing
+        a chain. Returns 0 if successful, 10 if there is no backup of the section, 11 if it
+        could not be copied and 14 if its databases could not be unarchived.
+        """
+        type = self.config.get('type', DEFAULT_BACKUP_TYPE)
+        backup_dir = self.config.get('backup_dir', self.default_ongoing_backup_dir)
+        catalog = BackupCatalog([backup_dir, self.default_final_backup_dir,
+                                 self.default_archive_backup_dir]).scan()
+        record = catalog.latest(type, self.name)
+        if record is None:
+            self.logger.error('There is no %s of %s to restore', type, self.name)
+            return 10
+        if type == 'dump':
+            backup = MyDumperBackup(self.config, self)
+        else:
+            backup = MariaBackup(self.config, self)
+            chain = backup.get_chain(backup_dir)
+            chain.load()
+            if any(member['name'] == record.dir_name and member['incremental']
+                   for member in chain.members):
+                self.logger.error('%s is an incremental snapshot, use --apply-chain to restore '
+                                  'it', record.dir_name)
+                return 10
+        os.makedirs(target_dir, exist_ok=True)
+        result = self.copy_unarchived(backup, record, target_dir)
+        if result == 0:
+            self.logger.info('%s is ready at %s', record.dir_name, target_dir)
+        return result
+
+    def restore_chain(self, target_dir):
+        """
+        Rebuilds the most recent snapshot of the section from its chain of incremental
+        snapshots: the full snapshot of the chain and its incremental ones, found on the
+        ongoing, latest or archive dirs, are copied into target_dir (decompressed and with
+        their databases unarchived) and the incremental ones are applied in order on top of
+        the full one, which is left prepared at target_dir, ready to be copied back.
+        Returns 0 if successful, 10 if a snapshot of the chain was not found, 11 if it could
+        not be copied, 14 if its databases could not be unarchived and 6 if the prepare failed.
+        """
+        backup_dir = self.config.get('backup_dir', self.default_ongoing_backup_dir)
+        backup = MariaBackup(self.config, self)
+        chain = backup.get_chain(backup_dir)
+        chain.load()
+        members = [member['name'] for member in chain.get_chain()]
+        if not members:
+            self.logger.error('There is no snapshot chain recorded at %s', chain.path)
+            return 10
+        catalog = BackupCatalog([backup_dir, self.default_final_backup_dir,
+                                 self.default_archive_backup_dir]).scan()
+        records = {record.dir_name: record for record in catalog.backups('snapshot', self.name)}
+        missing = [name for name in members if name not in records]
+        if missing:
+            self.logger.error('Snapshots of the chain not found: %s', ', '.join(missing))
+            return 10
+        os.makedirs(target_dir, exist_ok=True)
+        directories = list()
+        for name in members:
+            result = self.copy_unarchived(backup, records[name], target_dir)
+            if result != 0:
+                return result
+            directories.append(os.path.join(target_dir, name))
+        for cmd in backup.get_chain_prepare_cmds(directories[0], directories[1:]):
+            self.logger.debug(cmd)
+            output = OutputMonitor('prepare', self.logger, backup.output_error_markers,
+                                   backup.output_success_marker)
+            output.run(cmd)
+            if output.has_errors():
+                self.logger.error('Applying the snapshot chain did not complete successfully')
+                return 6
+        for directory in directories[1:]:
+            shutil.rmtree(directory)
+        self.logger.info('%s is prepared and ready to be copied back', directories[0])
+        return 0
+
+    def rotate_backups(self, backup_dir):
+        """
+        Moves the old latest backup of the same section to the archive, and the current
+        one (at backup_dir) as the latest. Then deletes old backups of the same section, according to
+        the retention config. Returns 0 on success, 12 if the backup could not be moved.
+        """
+        # both dirs are only read once
+        catalog = BackupCatalog([self.default_final_backup_dir,
+                                 self.default_archive_backup_dir]).scan()
+        result = self.move_backups(self.name, self.default_final_backup_dir,
+                                   self.default_archive_backup_dir, catalog)
+        if result != 0:
+            self.logger.warning('Archiving backups failed')
+        result = self.os_rename(os.path.join(backup_dir, self.file_name),
+                                os.path.join(self.default_final_backup_dir, self.file_name))
+        if result != 0:
+            self.logger.error('Moving backup to final dir failed')
+            return 12
+        chain = None
+        if self.config['type'] == 'snapshot':
+            chain = MariaBackup(self.config, self).get_chain(backup_dir)
+            chain.load()
+        result = self.purge_backups(catalog=catalog, chain=chain)
+        if result != 0:
+            self.logger.warning('Purging old backups failed')
+        self.reaper.close()
+        return 0
+
+    def gather_metrics(self, stats, timer, checkpoint):
+        """
+        Metrics phase: stores the file statistics of the backup. Failing to do so is
+        not fatal, so it always returns 0, but it is only marked as completed if they
+        were stored, so a resumed run retries it.
+        """
+        # the size of the backup changes meanwhile, due to other phases
+        with timer.phase('metrics', measure_size=False):
+            stored = stats.gather_metrics()
+        if stored:
+            checkpoint.mark_done('metrics')
+        else:
+            self.logger.warning('The metrics of the backup could not be stored')
+        return 0
+
+    def archive_databases(self, backup, output_dir, threads, timer, checkpoint):
+        """Archive phase: returns 0 if successful, 14 if archiving the databases failed"""
+        with timer.phase('archive'):
+            result = backup.archive_databases(output_dir, threads)
+        if result != 0:
+            self.logger.error('Archiving the databases failed')
+            return 14
+        checkpoint.mark_done('archive')
+        return 0
+
+    def compress_backup(self, backup_dir, streaming, threads, timer, checkpoint):
+        """
+        Compress phase: finishes the streaming compression, if it was running, or compresses
+        the whole backup dir otherwise. Returns 0 if successful, 11 if compression failed.
+        """
+        with timer.phase('compress'):
+            result = None
+            if streaming is not None:
+                result = streaming.finish()
+                if result != 0:
+                    self.logger.warning('Streaming compression failed, compressing the whole '
+                                        'backup again')
+            if result != 0:
+                # no consolidation per-db, just compress the whole thing
+                cmd = self.compressor.get_compress_cmd(threads)
+                result = self.tar_and_remove(backup_dir, self.file_name, [self.dir_name, ],
+                                             compression=None if cmd is None else ' '.join(cmd))
+        if result != 0:
+            self.logger.error('The compression process failed')
+            # do not leave a partial tarball next to the backup dir, so it can be resumed
+            try:
+                os.remove(os.path.join(backup_dir, self.file_name))
+            except FileNotFoundError:
+                pass
+            except OSError as ex:
+                self.logger.warning('The partial tarball could not be deleted: %s', ex)
+            return 11
+        checkpoint.mark_done('compress')
+        return 0
+
+    def abort_streaming(self, streaming):
+        """
+        Stops the streaming compression of a failed backup, if it was running,
+        deleting the partial tarball.
+        """
+        if streaming is not None:
+            streaming.abort()
+
     def run(self):
         """
         Perform a backup of the given instance,
         with the given config. Once finished successfully, consolidate the
         number of files if asked, and move it to the "latest" dir. Archive
         any previous dump of the same name, if required.
+        Completed phases are recorded on a checkpoint file, so if resume is set,
+        a failed run can continue from the first phase that did not finish.
         """
         type = self.config.get('type', DEFAULT_BACKUP_TYPE)
         backup_dir = self.config.get('backup_dir', self.default_ongoing_backup_dir)
         archive = self.config.get('archive', False)
-        only_postprocess = self.config.get('only_postprocess', False)
+        resume = self.config.get('resume', False)
+        only_postprocess = self.config.get('only_postprocess', False) or resume
         compress = self.config.get('compress', False)
         rotate = self.config.get('rotate', False)
         threads = self.config.get('threads', DEFAULT_BACKUP_THREADS)
@@ -227,6 +610,23 @@ class WMFBackup:
         else:
             self.generate_file_name(backup_dir)
 
+        checkpoint = Checkpoint(backup_dir, self.dir_name)
+        if resume:
+            if checkpoint.load():
+                self.logger.info('Resuming %s, completed phases: %s', self.dir_name,
+                                 ', '.join(checkpoint.completed))
+            else:
+                self.logger.warning('No checkpoint found for %s, postprocessing it from the start',
+                                    self.dir_name)
+
+        if (only_postprocess and not checkpoint.completed and self.file_name != self.dir_name
+                and os.path.isfile(os.path.join(backup_dir, self.file_name))):
+            # a previous run already compressed it, only the rotation can be pending
+            self.logger.info('%s is already compressed, skipping postprocessing', self.file_name)
+            if rotate:
+                return self.rotate_backups(backup_dir)
+            return 0
+
         output_dir = os.path.join(backup_dir, self.dir_name)
         if type == 'dump':
             backup = MyDumperBackup(self.config, self)
@@ -247,84 +647,147 @@ class WMFBackup:
             source = self.config.get('host', 'localhost') + \
                      ':' + \
                      str(self.config.get('port', DEFAULT_PORT))
-            stats = DatabaseBackupStatistics(dir_name=self.dir_name, section=self.name,
-                                             type=type, config={'stats_file': self.config.get('stats_file')},
-                                             backup_dir=output_dir, source=source)
+            stats_config = {'stats_file': self.config.get('stats_file')}
+            if 'stats_batch_size' in self.config:
+                stats_config['batch_size'] = self.config['stats_batch_size']
+            if 'stats_flush_timeout' in self.config:
+                stats_config['flush_timeout'] = self.config['stats_flush_timeout']
+            if self.config.get('stats_spool_dir') is not None:
+                # do not wait for the stats db, write to a local spool and ship it later
+                stats_config['spool_dir'] = self.config['stats_spool_dir']
+                stats = SpoolBackupStatistics(dir_name=self.dir_name, section=self.name,
+                                              type=type, config=stats_config,
+                                              backup_dir=output_dir, source=source)
+            else:
+                stats = DatabaseBackupStatistics(dir_name=self.dir_name, section=self.name,
+                                                 type=type, config=stats_config,
+                                                 backup_dir=output_dir, source=source)
         else:
             stats = DisabledBackupStatistics()
+        self.stats = stats  # the purge phase is recorded by wait_for_purge()
 
-        stats.start()
+        if resume:
+            stats.resume()
+        else:
+            stats.start()
+            if self.config.get('transfer_start') is not None:
+                # remote snapshots are copied before the entry exists, record it as a phase
+                stats.record_phase(PhaseTiming('transfer', self.config['transfer_start'],
+                                               self.config.get('transfer_time'), None, None, None))
+        # measure the size of both the backup dir and the final tarball, if different
+        timer = PhaseTimer([output_dir, os.path.join(backup_dir, self.file_name)],
+                           self.logger, stats)
+
+        # compress the files while they are generated, if possible
+        streaming = None
+        if not only_postprocess and compress and self.config.get('stream_compress', False):
+            if type != 'dump' or archive:
+                self.logger.warning('Streaming compression is only available for dumps without '
+                                    'per-database archiving, compressing at the end')
+            else:
+                streaming = StreamingArchiver(backup_dir, self.dir_name, self.file_name,
+                                              self.compressor.get_compress_cmd(threads),
+                                              self.logger)
+                streaming.start()
 
         if not only_postprocess:
             # run backup command
             self.logger.debug(cmd)
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            out, err = process.communicate()
-            if backup.errors_on_output(out, err):
+            output = OutputMonitor('backup', self.logger, backup.output_error_markers,
+                                   backup.output_success_marker)
+            # publish the progress while it runs, at backup_dir/type_status.section
+            interval = self.config.get('progress_interval')
+            monitor = ProgressMonitor(output_dir,
+                                      os.path.join(backup_dir, f'{type}_status.{self.name}'),
+                                      self.logger, stats, backup.get_progress_log(),
+                                      DEFAULT_PROGRESS_INTERVAL if interval is None else int(interval))
+            with timer.phase('backup'):
+                monitor.start()
+                try:
+                    output.run(cmd)
+                finally:
+                    monitor.stop()
+            if output.has_errors():
+                self.abort_streaming(streaming)
                 stats.fail()
                 return 3
+            checkpoint.mark_done('backup')
 
         # Check log for errors
-        if backup.errors_on_log():
-            self.logger.error('Error log found at %s', self.log_file)
-            stats.fail()
-            return 4
+        if not checkpoint.is_done('check_log'):
+            with timer.phase('check_log'):
+                errors_on_log = backup.errors_on_log()
+            if errors_on_log:
+                self.logger.error('Error log found at %s', self.log_file)
+                self.abort_streaming(streaming)
+                stats.fail()
+                return 4
+            checkpoint.mark_done('check_log')
 
         # Check medatada file exists and containg the finish date
-        if backup.errors_on_metadata(backup_dir):
-            self.logger.error('Incorrect metadata file')
-            stats.fail()
-            return 5
+        if not checkpoint.is_done('check_metadata'):
+            with timer.phase('check_metadata'):
+                errors_on_metadata = backup.errors_on_metadata(backup_dir)
+            if errors_on_metadata:
+                self.logger.error('Incorrect metadata file')
+                self.abort_streaming(streaming)
+                stats.fail()
+                return 5
+            checkpoint.mark_done('check_metadata')
 
         # Backups seems ok, prepare it for recovery and cleanup
-        try:
-            cmd = backup.get_prepare_cmd(backup_dir)
-        except BackupException as ex:
-            self.logger.error(str(ex))
-            stats.fail()
-            return 13
-        if cmd != '':
-            self.logger.debug(cmd)
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            out, err = process.communicate()
-            if backup.errors_on_prepare(out, err):
-                self.logger.error('The mariabackup prepare process did not complete successfully')
+        if not checkpoint.is_done('prepare'):
+            try:
+                cmd = backup.get_prepare_cmd(backup_dir)
+            except BackupException as ex:
+                self.logger.error(str(ex))
+                self.abort_streaming(streaming)
                 stats.fail()
-                return 6
-
-        # get file statistics
-        stats.gather_metrics()
-
-        if archive:
-            backup.archive_databases(output_dir, threads)
-
-        if compress:
-            # no consolidation per-db, just compress the whole thing
-            result = self.tar_and_remove(backup_dir, self.file_name, [self.dir_name, ],
-                                         compression='/usr/bin/pigz -p {}'.format(threads))
-            if result != 0:
-                self.logger.error('The compression process failed')
+                return 13
+            if cmd != '':
+                self.logger.debug(cmd)
+                output = OutputMonitor('prepare', self.logger, backup.output_error_markers,
+                                       backup.output_success_marker)
+                with timer.phase('prepare'):
+                    output.run(cmd)
+                if output.has_errors():
+                    self.logger.error('The mariabackup prepare process did not complete successfully')
+                    self.abort_streaming(streaming)
+                    stats.fail()
+                    return 6
+            checkpoint.mark_done('prepare')
+
+        # sending the file statistics mostly waits on the database, so it is done at the
+        # same time than the archiving and compression, from a file list read before
+        graph = TaskGraph()
+        if not checkpoint.is_done('metrics'):
+            with timer.phase('inventory'):
+                stats.take_inventory()
+            graph.add('metrics', self.gather_metrics, (stats, timer, checkpoint))
+        if archive and not checkpoint.is_done('archive'):
+            graph.add('archive', self.archive_databases,
+                      (backup, output_dir, threads, timer, checkpoint))
+        if compress and not checkpoint.is_done('compress'):
+            graph.add('compress', self.compress_backup,
+                      (backup_dir, streaming, threads, timer, checkpoint), dependencies=['archive'])
+        results = graph.run()
+        for phase in ['archive', 'compress']:
+            if results.get(phase) not in (0, None):
                 stats.fail()
-                return 11
+                return results[phase]
 
         if rotate:
-            # perform rotations
-            # move the old latest one to the archive, and the current as the latest
-            # then delete old backups of the same section, according to the retention
-            # config
-            result = self.move_backups(self.name, self.default_final_backup_dir,
-                                       self.default_archive_backup_dir, self.name_regex)
-            if result != 0:
-                self.logger.warning('Archiving backups failed')
-            result = self.os_rename(os.path.join(backup_dir, self.file_name),
-                                    os.path.join(self.default_final_backup_dir, self.file_name))
+            with timer.phase('rotate'):
+                result = self.rotate_backups(backup_dir)
             if result != 0:
-                self.logger.error('Moving backup to final dir failed')
                 stats.fail()
-                return 12
-            result = self.purge_backups()
-            if result != 0:
-                self.logger.warning('Purging old backups failed')
+                return result
+
+        # e.g. only a snapshot that made it to the end is the base of the next incremental one
+        backup.record_success(backup_dir)
+
+        # nothing left to resume
+        checkpoint.remove()
 
         # we are done
         stats.finish()
@@ -342,6 +805,22 @@ class WMFBackup:
         elif config['type'] not in SUPPORTED_BACKUP_TYPES:
             self.logger.error('Unknown dump type: %s', config['type'])
             sys.exit(-1)
+        if config.get('archive_method') is not None and config['archive_method'] not in SUPPORTED_ARCHIVE_METHODS:
+            self.logger.error('Unknown archive method: %s', config['archive_method'])
+            sys.exit(-1)
+        if config.get('compressor') is not None and config['compressor'] not in COMPRESSORS:
+            self.logger.error('Unknown compressor: %s', config['compressor'])
+            sys.exit(-1)
+        if config.get('prepare_memory') is not None:
+            try:
+                parse_size(config['prepare_memory'])
+            except ValueError:
+                self.logger.error('Invalid prepare memory: %s', config['prepare_memory'])
+                sys.exit(-1)
+        self.stats = DisabledBackupStatistics()
+        purge_rate = config.get('purge_rate')
+        self.reaper = Reaper(name, self.logger,
+                             rate=None if purge_rate is None else float(purge_rate) * 1024 * 1024)
         if 'retention' not in config:
             self.config['retention'] = DEFAULT_RETENTION_DAYS
         else:
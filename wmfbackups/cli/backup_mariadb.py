@@ -4,7 +4,11 @@
 #               mydumper at /usr/bin/mydumper (if dumps are used)
 #               wmf-mariadb10* (or any xtrabackup installation, if snapshotting is used)
 #               pigz on /usr/bin/pigz (if snapshotting or compression is used)
+#               zstd on /usr/bin/zstd (if the zstd compressor is used)
 #               tar at /bin/tar
+from wmfbackups.BackupStatistics import replay_spool, DEFAULT_SPOOL_DIR, DEFAULT_STATS_FILE
+from wmfbackups.Compressor import COMPRESSORS, DEFAULT_COMPRESSOR
+from wmfbackups.ProgressMonitor import DEFAULT_PROGRESS_INTERVAL
 from wmfbackups.WMFBackup import WMFBackup
 
 import argparse
@@ -74,6 +78,22 @@ def parse_options():
                         help=('If present, only postprocess and perform the metadata '
                               'gathering metrics for the given ongoing section backup, '
                               'skipping the actual backup. Default: Do the whole process.'))
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help=('If present, continue a failed backup of the given section (or '
+                              'absolute path) from the first phase that did not finish, '
+                              'according to its checkpoint file, instead of postprocessing '
+                              'it from the start. Implies --only-postprocess.'))
+    parser.add_argument('--transfer-start',
+                        type=float,
+                        help=('With --only-postprocess, unix timestamp when the files were '
+                              'started to be copied from a remote host, recorded together with '
+                              '--transfer-time as the transfer phase of the backup statistics. '
+                              'Default: not recorded.'))
+    parser.add_argument('--transfer-time',
+                        type=float,
+                        help=('Seconds the copy started at --transfer-start took. '
+                              'Default: not recorded.'))
     parser.add_argument('--rotate',
                         action='store_true',
                         help=('If present, run the rotation process, by moving it to the standard.'
@@ -82,6 +102,37 @@ def parse_options():
                         type=int,
                         help=('If rotate is set, purge backups of this section older than '
                               'the given value, in days. Default: 18 days.'))
+    parser.add_argument('--purge-rate',
+                        type=float,
+                        help=('If rotate is set, maximum speed, in MiB per second, at which the '
+                              'purged backups are deleted on the background, so it does not '
+                              'starve the I/O of other backups. Default: unlimited.'))
+    parser.add_argument('--max-chain-depth',
+                        type=int,
+                        help=('Only for snapshots, maximum number of incremental snapshots '
+                              'taken after each full one. As recovering one requires all the '
+                              'previous ones up to the full snapshot, expired snapshots are not '
+                              'purged while a more recent one of their chain is kept. '
+                              'Default: 0 (always take full snapshots).'))
+    parser.add_argument('--apply-chain',
+                        metavar='TARGET_DIR',
+                        help=('Only for snapshots, do not run any backup: copy the last chain of '
+                              'incremental snapshots of the given section into TARGET_DIR and '
+                              'apply them in order on top of its full snapshot, leaving it '
+                              'prepared, ready to be copied back.'),
+                        default=None)
+    parser.add_argument('--unarchive',
+                        metavar='TARGET_DIR',
+                        help=('Do not run any backup: copy the most recent backup of the given '
+                              'section and type into TARGET_DIR, decompressed and with its '
+                              'per-database archives extracted, so it has its original layout '
+                              '(a snapshot is left ready to be copied back).'),
+                        default=None)
+    parser.add_argument('--prepare-memory',
+                        help=('Only for snapshots, memory used by xtrabackup to prepare them '
+                              '(--use-memory), in bytes or with a K, M, G or T suffix. Default: '
+                              'estimated from the size of the redo log of each snapshot and '
+                              'the memory of the host, up to 40G.'))
     parser.add_argument('--backup-dir',
                         help=('Directory where the backup will be stored. '
                               'Default: {}.').format(DEFAULT_BACKUP_DIR),
@@ -93,11 +144,35 @@ def parse_options():
                         default=DEFAULT_ROWS)
     parser.add_argument('--archive',
                         action='store_true',
-                        help=('If present, archive each db on its own tar file.'))
+                        help=('If present, archive each db on its own tar file. For snapshots, '
+                              'each database subdirectory is archived, leaving system files, '
+                              'system databases and the xtrabackup metadata files loose.'))
+    parser.add_argument('--archive-method',
+                        choices=['tar', 'python'],
+                        help=('How uncompressed tars (like the --archive ones) are generated: '
+                              'spawning /bin/tar, or in-process (faster for thousands of small '
+                              'databases). Default: tar.'),
+                        default=None)
     parser.add_argument('--compress',
                         action='store_true',
-                        help=('If present, compress everything into a tar.gz.'
+                        help=('If present, compress everything into a tarball (see --compressor).'
                               'Default: Do not compress.'))
+    parser.add_argument('--compressor',
+                        choices=sorted(COMPRESSORS),
+                        help=('Program used by --compress: pigz (.tar.gz), zstd (.tar.zst) or '
+                              'none (an uncompressed .tar). Default: {}.').format(DEFAULT_COMPRESSOR),
+                        default=None)
+    parser.add_argument('--stream-compress',
+                        action='store_true',
+                        help=('If present together with --compress, compress the files of a '
+                              'dump while it is still being generated, instead of at the end. '
+                              'Default: Compress after the backup finishes.'))
+    parser.add_argument('--progress-interval',
+                        type=int,
+                        help=('Seconds between samples of the progress of the running backup '
+                              '(size, files, tables started, throughput and estimated end), written to '
+                              'BACKUP_DIR/TYPE_status.SECTION and to the statistics. '
+                              'Default: {} seconds.').format(DEFAULT_PROGRESS_INTERVAL))
     parser.add_argument('--regex',
                         help=('Only backup tables matching this regular expression,'
                               'with format: database.table. Default: all tables'),
@@ -106,6 +181,17 @@ def parse_options():
                         help=('Separate file where the statistics options are '
                               'defined.'),
                         default=None)
+    parser.add_argument('--stats-spool-dir',
+                        help=('If set, statistics are written first to a local spool file on '
+                              'this directory and sent to the statistics database in the '
+                              'background, so the backup never waits for it. '
+                              'Default: write directly to the database.'),
+                        default=None)
+    parser.add_argument('--replay-stats',
+                        action='store_true',
+                        help=('If present, do not run any backup, only send to the statistics '
+                              'database the pending spool files left on --stats-spool-dir '
+                              '(by default, {}).').format(DEFAULT_SPOOL_DIR))
     options = parser.parse_args().__dict__
 
     return options
@@ -170,7 +256,15 @@ def main():
     logger = logging.getLogger('backup')
 
     options = parse_options()
-    if options['section'] is None:
+    if options['replay_stats']:
+        # only send the statistics that could not be sent on previous runs
+        failed = replay_spool(options['stats_spool_dir'] or DEFAULT_SPOOL_DIR,
+                              options['stats_file'] or DEFAULT_STATS_FILE)
+        if failed > 0:
+            logger.error('%s statistics spool file(s) could not be sent', failed)
+            sys.exit(1)
+        sys.exit(0)
+    elif options['section'] is None:
         # no section name, read the config file, validate it and
         # execute it, including rotation of old dumps
         config = parse_config_file(options['config_file'])
@@ -183,13 +277,24 @@ def main():
 
         backup_pool.close()
         backup_pool.join()
+        # let the background deletion of purged backups finish
+        for section in backup:
+            backup[section].wait_for_purge()
 
         sys.exit(result[max(result, key=lambda key: result[key].get())].get())
 
     else:
         # a section name was given, only dump that one
         backup = WMFBackup(options['section'], options)
+        if options['apply_chain'] is not None:
+            if options['type'] != 'snapshot':
+                logger.error('--apply-chain requires --type snapshot')
+                sys.exit(2)
+            sys.exit(backup.restore_chain(options['apply_chain']))
+        if options['unarchive'] is not None:
+            sys.exit(backup.restore_backup(options['unarchive']))
         result = backup.run()
+        backup.wait_for_purge()
         if 0 == result:
             logger.info('Backup {} generated correctly.'.format(options['section']))
         else:
@@ -2,21 +2,23 @@
 
 # Dependencies: mydumper (for /usr/bin/myloader)
 #               tar at (/bin/tar)
+#               pigz or zstd (to decompress .tar.gz or .tar.zst backups)
 
 import argparse
 import os
-import re
 from multiprocessing.pool import ThreadPool
 import subprocess
 import sys
 
+from wmfbackups.BackupCatalog import BackupCatalog, parse_backup_name
+from wmfbackups.Compressor import split_extension
+import wmfbackups.TarArchiver as TarArchiver
+
 DEFAULT_THREADS = 16
 DEFAULT_HOST = 'localhost'
 DEFAULT_PORT = 3306
 DEFAULT_USER = 'root'
 BACKUP_DIR = '/srv/backups/dumps/latest'
-# FIXME: backups will stop working on Jan 1st 2100
-DUMPNAME_REGEX = r'dump\.([a-z0-9\-]+)\.(20\d\d-[01]\d-[0123]\d\--\d\d-\d\d-\d\d)(\.tar\.gz)?'
 
 
 def parse_options():
@@ -34,6 +36,12 @@ def parse_options():
     parser.add_argument('--password', help='Password to recover', default='')
     parser.add_argument('--socket', help='Socket to recover to', default=None)
     parser.add_argument('--database', help='Only recover this database', default=None)
+    parser.add_argument('--archive-method',
+                        choices=['tar', 'python'],
+                        help=('How the per-database archives are extracted: spawning /bin/tar, '
+                              'or in-process (faster for thousands of small databases). '
+                              'Default: tar.'),
+                        default='tar')
     parser.add_argument('--replicate',
                         help=('Enable binlog on import, for imports '
                               'to a master that have to be replicated (but makes load slower).'
@@ -43,10 +51,12 @@ def parse_options():
     return parser.parse_args()
 
 
-def untar_and_remove(file_name, directory):
+def untar_and_remove(file_name, directory, decompression=None):
     cmd = ['/bin/tar']
     tar_file = os.path.join(directory, file_name)
     cmd.extend(['--extract', '--file', tar_file, '--directory', directory])
+    if decompression is not None:
+        cmd.extend(['--use-compress-program', ' '.join(decompression)])
 
     # print(cmd)
     process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -76,12 +86,16 @@ def get_my_loader_cmd(backup_dir, options):
 
 
 def unarchive_databases(backup_dir, options):
+    if options.archive_method == 'python':
+        untar = TarArchiver.untar_and_remove
+    else:
+        untar = untar_and_remove
     if options.database:
         # We decompress only 1 database, the one to be recovered
         db_tar_name = '{}.gz.tar'.format(options.database)
         if os.path.isfile(os.path.join(backup_dir, db_tar_name)):
             print('Unarchiving {} ...'.format(db_tar_name))
-            untar_and_remove(db_tar_name, backup_dir)
+            untar(db_tar_name, backup_dir)
     else:
         # We decompress all databases in parallel
         pool = ThreadPool(options.threads)
@@ -92,7 +106,7 @@ def unarchive_databases(backup_dir, options):
                 if not printed_message:
                     print('Unarchiving consolidated databases...')
                     printed_message = True
-                pool.apply_async(untar_and_remove, (entry, backup_dir))
+                pool.apply_async(untar, (entry, backup_dir))
         pool.close()
         pool.join()
 
@@ -103,24 +117,16 @@ def recover_logical_dump(options):
     if os.path.isabs(options.section):
         # Recover from absolute path
         path = options.section.rstrip(os.sep)  # basename() differs from unix basename
-        pattern = re.compile('.+(' + DUMPNAME_REGEX + ')')
-        if pattern.match(path) is not None:
+        parsed = parse_backup_name(os.path.basename(path))
+        if parsed is not None and parsed[0] == 'dump':
             backup_name = os.path.basename(path)
             backup_dir = os.path.dirname(path)
     else:
         # Recover from default dir
-        files = sorted(os.listdir(BACKUP_DIR), reverse=True)
-
-        for entry in files:
-            path = os.path.join(BACKUP_DIR, entry)
-            pattern = re.compile(DUMPNAME_REGEX)
-            match = pattern.match(entry)
-            if match is None:
-                continue
-            if options.section == match.group(1):
-                backup_name = match.group(0)
-                backup_dir = os.path.dirname(path)
-                break
+        latest = BackupCatalog([BACKUP_DIR]).scan().latest('dump', options.section)
+        if latest is not None:
+            backup_name = latest.name
+            backup_dir = latest.directory
 
     if backup_name is None:
         print('Latest backup with name "{}" not found'.format(options.section))
@@ -129,10 +135,11 @@ def recover_logical_dump(options):
     print('Attempting to recover "{}" ...'.format(backup_name))
 
     # decompress if we have a tarball
-    if backup_name.endswith('.tar.gz'):
+    name, compressor = split_extension(backup_name)
+    if compressor is not None:
         print('Decompressing {}...'.format(backup_name))
-        untar_and_remove(backup_name, backup_dir)
-        backup_name = backup_name[:-7]
+        untar_and_remove(backup_name, backup_dir, compressor.get_decompress_cmd(options.threads))
+        backup_name = name
 
     full_path = os.path.join(backup_dir, backup_name)
 
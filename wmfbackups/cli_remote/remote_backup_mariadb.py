@@ -7,17 +7,26 @@ using cumin and transfer.py
 
 import argparse
 import datetime
-from multiprocessing.pool import Pool
+from multiprocessing.pool import Pool, ThreadPool
 import logging
 import os
 import subprocess
 import sys
+import threading
+import time
 import yaml
 
 from wmfmariadbpy.RemoteExecution.CuminExecution import (
     CuminExecution as RemoteExecution,
 )
 import wmfmariadbpy.dbutil as dbutil
+from wmfbackups.BackupStatistics import (DEFAULT_STATS_FILE, StatsSession, query_previous_duration,
+                                         query_previous_size, query_previous_transfer_time)
+from wmfbackups.MariaBackup import (MariaBackup, REDO_LOG_FILE, XtrabackupError,
+                                    check_version_compatibility, estimate_prepare_memory,
+                                    parse_server_version)
+from wmfbackups.Scheduling import (MemoryBudget, ResourceScheduler, lpt_order, parse_size,
+                                   simulate_pipeline)
 
 DEFAULT_CONFIG_FILE = '/etc/wmfbackups/remote_backups.cnf'
 DEFAULT_THREADS = 16
@@ -27,6 +36,17 @@ DEFAULT_TRANSFER_DIR = '/srv/backups/snapshots/ongoing'
 DATE_FORMAT = '%Y-%m-%d--%H-%M-%S'
 DUMP_USER = 'dump'
 DUMP_GROUP = 'dump'
+MYSQL_CLIENT = 'mysql'
+PREPARE_MEMORY_BUDGET_FRACTION = 0.75  # of the destination host memory, if not configured
+DEFAULT_SCHEDULER = 'destination'
+DEFAULT_ORDERING = 'order'
+DEFAULT_GLOBAL_ORDERING = 'history'
+SUPPORTED_ORDERINGS = ['order', 'history']
+SUPPORTED_SCHEDULERS = ['destination', 'global']
+DEFAULT_MAX_TRANSFERS_PER_SOURCE = 1
+DEFAULT_MAX_TRANSFERS_PER_DESTINATION = 1
+DEFAULT_PIPELINE_DEPTH = 1  # snapshots waiting for or running their prepare during a transfer
+TRANSFER_SPACE_FACTOR = 1.2  # free space needed on the destination per byte of the last snapshot
 
 
 def get_cmd_arguments():
@@ -79,7 +99,11 @@ def parse_config_file(config_file, arguments):
     """
     allowed_options = ['host', 'port', 'password', 'destination', 'rotate', 'retention',
                        'compress', 'archive', 'threads', 'statistics', 'only_postprocess',
-                       'type', 'stop_slave', 'order', 'stats_file']
+                       'type', 'stop_slave', 'order', 'stats_file', 'stats_spool_dir',
+                       'compressor', 'archive_method', 'purge_rate', 'prepare_memory',
+                       'prepare_memory_budget', 'scheduler', 'max_transfers_per_source',
+                       'max_transfers_per_destination', 'pipeline_depth', 'ordering',
+                       'history_stats_file']
     logger = logging.getLogger('backup')
     try:
         read_config = yaml.load(open(config_file), yaml.SafeLoader)
@@ -131,6 +155,24 @@ def parse_config_file(config_file, arguments):
                     'Found unknown config option "%s" on section %s',
                     str(key), str(section))
                 sys.exit(2)
+        for key in ['prepare_memory', 'prepare_memory_budget']:
+            if key in config[section]:
+                try:
+                    parse_size(config[section][key])
+                except ValueError:
+                    logger.error('Invalid size for option "%s" on section %s', key, section)
+                    sys.exit(2)
+        if not str(config[section].get('pipeline_depth', DEFAULT_PIPELINE_DEPTH)).isdigit():
+            logger.error('Invalid pipeline depth on section %s', section)
+            sys.exit(2)
+        if config[section].get('ordering', DEFAULT_ORDERING) not in SUPPORTED_ORDERINGS:
+            logger.error('Unknown ordering "%s" on section %s',
+                         config[section]['ordering'], section)
+            sys.exit(2)
+        if config[section].get('scheduler', DEFAULT_SCHEDULER) not in SUPPORTED_SCHEDULERS:
+            logger.error('Unknown scheduler "%s" on section %s',
+                         config[section]['scheduler'], section)
+            sys.exit(2)
     return config
 
 
@@ -196,12 +238,25 @@ def get_prepare_cmd(section, config):
         cmd.append('--rotate')
     if 'retention' in config:
         cmd.extend(['--retention', str(config['retention'])])
+    if 'purge_rate' in config:
+        cmd.extend(['--purge-rate', str(config['purge_rate'])])
+    if 'prepare_memory' in config:
+        cmd.extend(['--prepare-memory', str(config['prepare_memory'])])
     if 'compress' in config and config['compress']:
         cmd.append('--compress')
+    if 'compressor' in config:
+        cmd.extend(['--compressor', config['compressor']])
     if 'archive' in config and config['archive']:
         cmd.append('--archive')
+    if 'archive_method' in config:
+        cmd.extend(['--archive-method', config['archive_method']])
     if 'stats_file' in config:
         cmd.extend(['--stats-file', config['stats_file']])
+    if 'stats_spool_dir' in config:
+        cmd.extend(['--stats-spool-dir', config['stats_spool_dir']])
+    if 'transfer_start' in config:
+        cmd.extend(['--transfer-start', '{:.0f}'.format(config['transfer_start'])])
+        cmd.extend(['--transfer-time', '{:.0f}'.format(config['transfer_time'])])
 
     return cmd
 
@@ -226,6 +281,56 @@ def execute_remotely(host, local_command):
     return result.returncode, result.stdout, result.stderr
 
 
+def get_source_version_cmd(config):
+    """
+    Returns a list with the command to run on the source host to print its server version
+    """
+    port = int(config.get('port', DEFAULT_PORT))
+    return [MYSQL_CLIENT, '--socket', dbutil.get_socket_from_port(port), '--batch',
+            '--skip-column-names', '--execute', 'SELECT @@version']
+
+
+def check_versions(section, config):
+    """
+    Before transferring a snapshot, checks the xtrabackup of the destination host will be
+    able to prepare it, comparing its version with the one of the source server (the same
+    check done by backup-mariadb on prepare, but before the long transfer, not after it).
+    Returns 0 if they are compatible, or if any of them could not be found out (the prepare
+    will check it again), and 13 (like backup-mariadb) if they are not.
+    """
+    logger = logging.getLogger('backup')
+    try:
+        returncode, out, err = execute_remotely(config['host'], get_source_version_cmd(config))
+        if returncode != 0:
+            raise XtrabackupError(f'the server version could not be queried: {err}')
+        server_version = parse_server_version(out, 'the source server')
+        cmd = [MariaBackup.xtrabackup_path, '--version']
+        returncode, out, err = execute_remotely(config['destination'], cmd)
+        if returncode != 0:
+            raise XtrabackupError(f'--version failed to execute: {err}')
+        # xtrabackup returns version to stderr
+        xtrabackup_version = parse_server_version(f'{err}\n{out}', '--version')
+    except XtrabackupError as ex:
+        logger.warning('Versions of section %s could not be checked before the transfer: %s',
+                       section, ex)
+        return 0
+    try:
+        check_version_compatibility(xtrabackup_version, server_version)
+    except XtrabackupError as ex:
+        logger.error('Section %s cannot be prepared at %s, skipping its transfer: %s',
+                     section, config['destination'], ex)
+        return 13
+    return 0
+
+
+def add_transfer_time(config, start):
+    """
+    Returns a copy of config with the start and duration of the transfer started at start
+    (a unix timestamp), so the prepare records it on the statistics as part of the backup
+    """
+    return dict(config, transfer_start=start, transfer_time=time.time() - start)
+
+
 def run_transfer(section, config, port=0):
     """
     Executes transfer.py in mode xtrabackup, transfering the contents of a live mysql/mariadb
@@ -280,18 +385,298 @@ def prepare_backup(section, config):
     return returncode
 
 
+def get_host_memory(host):
+    """Returns the total memory of the given remote host, in bytes, or None if unknown"""
+    returncode, out, _ = execute_remotely(host, ['/bin/grep', 'MemTotal', '/proc/meminfo'])
+    if returncode != 0:
+        return None
+    try:
+        return parse_size(out.split(':', 1)[1].strip().replace(' kB', 'K'))
+    except (IndexError, ValueError):
+        return None
+
+
+def get_prepare_memory(config, path, host_memory):
+    """
+    Returns the memory, in bytes, to prepare the snapshot transferred to path: the
+    configured one or, by default, estimated from the size of its redo log
+    """
+    default = parse_size(MariaBackup.xtrabackup_prepare_memory)
+    if 'prepare_memory' in config:
+        return parse_size(config['prepare_memory'])
+    cmd = ['/usr/bin/stat', '--format', '%s', os.path.join(path, REDO_LOG_FILE)]
+    returncode, out, _ = execute_remotely(config['destination'], cmd)
+    try:
+        if returncode != 0:
+            raise ValueError
+        redo_size = int(out.strip())
+    except ValueError:
+        return default
+    return estimate_prepare_memory(redo_size, host_memory, default)
+
+
+def get_prepare_budget(sections, host_memory):
+    """
+    Returns the total memory, in bytes, the prepares running at the same time on a destination
+    can use: the one configured on its first section or a fraction of its memory.
+    If none are known, prepares are run one at a time.
+    """
+    for _, section_config in sections:
+        if 'prepare_memory_budget' in section_config:
+            return parse_size(section_config['prepare_memory_budget'])
+        break
+    if host_memory is None:
+        return 0
+    return int(host_memory * PREPARE_MEMORY_BUDGET_FRACTION)
+
+
+def prepare_snapshot(path, config, budget, memory):
+    """
+    Prepares the snapshot transferred to path with the given memory, once it is available
+    on the memory budget of its destination
+    """
+    logger = logging.getLogger('backup')
+    budget.acquire(memory)
+    try:
+        logger.info('Preparing %s with %s bytes of memory (%s of %s bytes of the budget in use)',
+                    path, memory, budget.used, budget.total)
+        return prepare_backup(path, dict(config, prepare_memory=memory))
+    finally:
+        budget.release(memory)
+
+
+def get_free_space(host):
+    """Returns the free space, in bytes, of the transfer dir of the given host, or None if unknown"""
+    cmd = ['/bin/df', '--output=avail', '--block-size=1', DEFAULT_TRANSFER_DIR]
+    returncode, out, _ = execute_remotely(host, cmd)
+    try:
+        if returncode != 0:
+            raise ValueError
+        return int(out.split()[-1])
+    except (IndexError, ValueError):
+        return None
+
+
+class DestinationPipeline:
+    """
+    Prepares the snapshots transferred to a destination on the background, while the next
+    ones are transferred: a transfer only starts if at most depth (pipeline_depth) previous
+    snapshots are waiting for or running their prepare (0 never overlaps them), and if the
+    destination has enough free space for it (according to the size of the previous
+    snapshot of its section), counting the transfers already running.
+    Prepares run within the memory budget of the destination.
+    """
+
+    def __init__(self, destination, sections):
+        """sections is a list of (section, config) tuples backed up to destination"""
+        self.destination = destination
+        self.host_memory = get_host_memory(destination)
+        self.budget = MemoryBudget(get_prepare_budget(sections, self.host_memory))
+        self.depth = int(sections[0][1].get('pipeline_depth', DEFAULT_PIPELINE_DEPTH))
+        self.pool = ThreadPool(max(1, len(sections)))
+        self.condition = threading.Condition()
+        self.preparing = 0
+        self.reserved = 0  # space, in bytes, reserved by the running transfers
+        # queried once, instead of measuring the live datadir of the source on each transfer
+        self.sizes = query_history(dict(sections), query_previous_size)
+
+    def reserve_space(self, section):
+        """
+        Waits until the destination has enough free space to receive a new snapshot of
+        section (as large as its previous one) and reserves it, waiting for the pending
+        prepares to finish (as they rotate and purge old backups) if needed. Returns the
+        space reserved (0 if the previous size or the free space are unknown), or None if
+        there is not enough free space even after all prepares finished.
+        """
+        logger = logging.getLogger('backup')
+        size = self.sizes.get(section)
+        if size is None:
+            logger.warning('No previous snapshot of %s found, free space will not be checked',
+                           section)
+            return 0
+        required = int(size * TRANSFER_SPACE_FACTOR)
+        while True:
+            available = get_free_space(self.destination)
+            if available is None:
+                logger.warning('The free space of %s could not be found', self.destination)
+                return 0
+            with self.condition:
+                if available - self.reserved >= required:
+                    self.reserved += required
+                    return required
+                if self.preparing == 0:
+                    logger.error('Not enough free space at %s to transfer %s: %s bytes needed, '
+                                 '%s bytes available', self.destination, section, required,
+                                 available - self.reserved)
+                    return None
+                logger.warning('Not enough free space at %s to transfer %s yet, waiting for %s '
+                               'prepare(s) to finish', self.destination, section, self.preparing)
+                self.condition.wait()
+
+    def start(self, section, config):
+        """
+        Transfers the snapshot of the given section and queues its prepare. Returns the
+        result of the transfer (15 if there was not enough free space) and, if it was
+        successful, the AsyncResult of the prepare.
+        """
+        result = check_versions(section, config)
+        if result != 0:
+            return (result, None)
+        with self.condition:
+            self.condition.wait_for(lambda: self.preparing <= self.depth)
+        reserved = self.reserve_space(section)
+        if reserved is None:
+            return (15, None)
+        start = time.time()
+        try:
+            result, path = run_transfer(section, config)
+        finally:
+            with self.condition:
+                self.reserved -= reserved
+        if result != 0:
+            return (result, None)
+        config = add_transfer_time(config, start)
+        memory = get_prepare_memory(config, path, self.host_memory)
+        with self.condition:
+            self.preparing += 1
+        return (0, self.pool.apply_async(self.prepare, (path, config, memory)))
+
+    def prepare(self, path, config, memory):
+        try:
+            return prepare_snapshot(path, config, self.budget, memory)
+        finally:
+            with self.condition:
+                self.preparing -= 1
+                self.condition.notify_all()
+
+    def run(self, section, config):
+        """Transfers and prepares the snapshot of the given section, returns the result"""
+        result, prepare = self.start(section, config)
+        return result if prepare is None else prepare.get()
+
+    def join(self):
+        """Waits for all the queued prepares to finish"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.preparing == 0)
+
+    def close(self):
+        """Waits for all the queued prepares to finish, nothing can be started after it"""
+        self.pool.close()
+        self.pool.join()
+
+
+def query_history(config, query):
+    """
+    Returns a dictionary with the result of query(db, type, section) (e.g.
+    query_previous_size) for each section on the statistics database, or None for the
+    sections without history (or all of them if the database is not reachable).
+    The database is read from this host, with history_stats_file (stats_file is the
+    one of the destination hosts).
+    """
+    logger = logging.getLogger('backup')
+    history = {section: None for section in config}
+    stats_file = next(iter(config.values())).get('history_stats_file', DEFAULT_STATS_FILE)
+    if not os.path.isfile(stats_file):
+        logger.warning('No statistics config at %s (history_stats_file), backup history '
+                       'will not be used', stats_file)
+        return history
+    session = StatsSession(stats_file)
+    db = session.connect()
+    if db is None:
+        return history
+    for section, section_config in config.items():
+        history[section] = query(db, section_config['type'], section)
+    session.close()
+    return history
+
+
+def get_expected_costs(config):
+    """
+    Returns a dictionary with the expected cost of the backup of each section: the duration,
+    in seconds, of its previous finished backup (including the transfer, for snapshots), or
+    None if unknown (no history, or the statistics database is not reachable)
+    """
+    return query_history(config, query_previous_duration)
+
+
+def sort_by_order(sections):
+    """Returns the list of (section, config) tuples of the given sections, by their order option"""
+    return sorted(sections.items(), key=lambda section: section[1].get('order', sys.maxsize))
+
+
+def estimate_pipeline(sorted_config, durations):
+    """
+    Returns the expected time, in seconds, to run the given list of (section, config) tuples
+    of a destination with known durations, in that order: snapshot transfers overlap the
+    prepares of the previous snapshots according to pipeline_depth (see DestinationPipeline,
+    assuming the prepares fit the memory budget), other backups run on their own.
+    """
+    transfers = query_history(dict(sorted_config), query_previous_transfer_time)
+    depth = int(sorted_config[0][1].get('pipeline_depth', DEFAULT_PIPELINE_DEPTH))
+    stages = list()
+    for section, section_config in sorted_config:
+        duration = durations[section]
+        if duration is None:
+            continue
+        if is_snapshot_transfer(section_config):
+            transfer = min(transfers[section] or 0, duration)
+            stages.append((transfer, duration - transfer))
+        else:
+            stages.append((duration, None))
+    return simulate_pipeline(stages, depth)
+
+
+def sort_sections(sections):
+    """
+    Returns the list of (section, config) tuples of a destination in the order they have to
+    be run: by their order option or, with ordering: history, by decreasing expected cost
+    (longest first), with the ones without history first, by order.
+    Also logs when the batch is expected to finish, according to the history, see
+    estimate_pipeline().
+    """
+    logger = logging.getLogger('backup')
+    by_order = sort_by_order(sections)
+    if by_order[0][1].get('ordering', DEFAULT_ORDERING) != 'history':
+        return by_order
+    durations = get_expected_costs(sections)
+    known = [duration for duration in durations.values() if duration is not None]
+    if not known:
+        logger.info('No backup history found, running the backups by their order')
+        return by_order
+    sorted_config = ([item for item in by_order if durations[item[0]] is None]
+                     + [(section, sections[section])
+                        for section in lpt_order({section: duration
+                                                  for section, duration in durations.items()
+                                                  if duration is not None})])
+    finish = datetime.datetime.now() + datetime.timedelta(
+        seconds=estimate_pipeline(sorted_config, durations))
+    logger.info('Running %s backup(s) longest first: %s. Expected to finish by %s%s',
+                len(sorted_config), ', '.join(section for section, _ in sorted_config),
+                finish.strftime('%Y-%m-%d %H:%M:%S'),
+                '' if len(known) == len(durations) else
+                ' plus the time of {} backup(s) without history'.format(len(durations) - len(known)))
+    return sorted_config
+
+
+def is_snapshot_transfer(config):
+    """Returns True if the backup has to be transferred before being prepared"""
+    return config['type'] == 'snapshot' and not config.get('only_postprocess', False)
+
+
 def run(section, config, port=0):
     """
     Executes transfer and prepare (if transfer is correct) on the given section, with the
     given config
     """
-    if (('only_postprocess' in config and config['only_postprocess'])
-            or config['type'] != 'snapshot'):
+    if not is_snapshot_transfer(config):
         result = prepare_backup(section, config)
     else:
-        result, path = run_transfer(section, config, port)
+        result = check_versions(section, config)
+        if result == 0:
+            start = time.time()
+            result, path = run_transfer(section, config, port)
         if result == 0:
-            result = prepare_backup(path, config)
+            result = prepare_backup(path, add_transfer_time(config, start))
     return result
 
 
@@ -303,20 +688,108 @@ def run_destination(destination, sections):
     """
     logger = logging.getLogger('backup')
     result = dict()
-    sorted_config = sorted(sections.items(),
-                           key=lambda section: section[1].get('order', sys.maxsize))
-    # first try
+    sorted_config = sort_sections(sections)
+    # first try: snapshots are transferred one at a time, but prepared on the background
+    # while the next ones are transferred
+    pipeline = DestinationPipeline(destination, sorted_config)
+    prepares = dict()
     for section, section_config in sorted_config:
-        result[section] = run(section, section_config)
+        if is_snapshot_transfer(section_config):
+            result[section], prepares[section] = pipeline.start(section, section_config)
+        else:
+            result[section] = run(section, section_config)
+    pipeline.join()
+    for section, prepare in prepares.items():
+        if prepare is not None:
+            result[section] = prepare.get()
     # do we need to retry once after the first run is completed?
     for section, section_config in sorted_config:
-        if result[section] != 0:
+        if result[section] != 0 and is_snapshot_transfer(section_config):
+            result[section] = pipeline.run(section, section_config)
+        elif result[section] != 0:
             result[section] = run(section, section_config)
+    pipeline.close()
 
     logger.info('All %s backup(s) sent to %s finished', len(result), destination)
     return result
 
 
+def get_transfer_limits(config):
+    """
+    Returns the maximum number of backups running at the same time on each ('source', host)
+    and ('destination', host) resource, read from the config of each section (which inherits
+    the defaults). If the sections of a host set different limits, the lowest one is used.
+    """
+    limits = dict()
+    for section_config in config.values():
+        for resource, option, default in (
+                (('source', section_config['host']), 'max_transfers_per_source',
+                 DEFAULT_MAX_TRANSFERS_PER_SOURCE),
+                (('destination', section_config['destination']), 'max_transfers_per_destination',
+                 DEFAULT_MAX_TRANSFERS_PER_DESTINATION)):
+            limit = int(section_config.get(option, default))
+            limits[resource] = min(limit, limits.get(resource, limit))
+    return limits
+
+
+def run_global(config):
+    """
+    Runs the backups of all destinations together, with at most max_transfers_per_source
+    backups (transfers or dumps) reading from the same source host, and at most
+    max_transfers_per_destination writing to the same destination host at the same time.
+    Backups are started as soon as their source and destination are free, longest first
+    according to their history (or by their order option, with ordering: order), and
+    snapshots are prepared on the background, see DestinationPipeline. Failed backups are
+    retried once at the end.
+    Returns a dictionary of return values by section.
+    """
+    logger = logging.getLogger('backup')
+    first_config = next(iter(config.values()))
+    limits = get_transfer_limits(config)
+    if first_config.get('ordering', DEFAULT_GLOBAL_ORDERING) == 'history':
+        costs = get_expected_costs(config)
+    else:
+        costs = {section: None for section in config}  # jobs of unknown cost run as added
+
+    pipelines = {destination: DestinationPipeline(destination, list(sections.items()))
+                 for destination, sections in group_config_by_destination(config).items()}
+
+    def schedule(function, sections):
+        scheduler = ResourceScheduler(limits)
+        for section, section_config in sort_by_order(sections):
+            resources = [('source', section_config['host']),
+                         ('destination', section_config['destination'])]
+            scheduler.add(section, function, (section, section_config), resources, costs[section])
+        logger.info('Running %s backup(s) in this order, as soon as their hosts are free: %s',
+                    len(sections), ', '.join(scheduler.get_order()))
+        return scheduler.run()
+
+    def start(section, section_config):
+        if not is_snapshot_transfer(section_config):
+            return (run(section, section_config), None)
+        return pipelines[section_config['destination']].start(section, section_config)
+
+    def retry(section, section_config):
+        if not is_snapshot_transfer(section_config):
+            return run(section, section_config)
+        return pipelines[section_config['destination']].run(section, section_config)
+
+    started = schedule(start, config)
+    for pipeline in pipelines.values():
+        pipeline.join()
+    result = dict()
+    for section, (returncode, prepare) in started.items():
+        result[section] = returncode if prepare is None else prepare.get()
+
+    failed = {section: config[section] for section in config if result[section] != 0}
+    if failed:
+        result.update(schedule(retry, failed))
+    for pipeline in pipelines.values():
+        pipeline.close()
+    logger.info('All %s backup(s) finished', len(result))
+    return result
+
+
 def main():
     """
     main backup logic: setup, argument parsing, config reading,
@@ -339,23 +812,27 @@ def main():
     arguments = get_cmd_arguments()
 
     # reading configuration
-    config = group_config_by_destination(parse_config_file(DEFAULT_CONFIG_FILE, arguments))
-
-    destination_result = dict()
-    result = dict()
+    config = parse_config_file(DEFAULT_CONFIG_FILE, arguments)
 
-    # parallel execution
-    destination_pool = Pool(len(config))
-    for destination, sections in sorted(config.items()):
-        destination_result[destination] = destination_pool.apply_async(
-            run_destination, (destination, sections)
-        )
-    destination_pool.close()
-    destination_pool.join()
-
-    # results handling
-    for destination, result_list in destination_result.items():
-        result.update(result_list.get())
+    if next(iter(config.values())).get('scheduler', DEFAULT_SCHEDULER) == 'global':
+        result = run_global(config)
+    else:
+        config = group_config_by_destination(config)
+        destination_result = dict()
+        result = dict()
+
+        # parallel execution
+        destination_pool = Pool(len(config))
+        for destination, sections in sorted(config.items()):
+            destination_result[destination] = destination_pool.apply_async(
+                run_destination, (destination, sections)
+            )
+        destination_pool.close()
+        destination_pool.join()
+
+        # results handling
+        for destination, result_list in destination_result.items():
+            result.update(result_list.get())
     failed_backups = [fb for fb in result if result[fb] > 0]
     if len(failed_backups) == 0:
         logger.info('All %s configured backup(s) run finished correctly', str(len(result)))
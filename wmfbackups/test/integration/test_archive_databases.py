@@ -0,0 +1,82 @@
+"""
+Benchmark of MyDumperBackup.archive_databases on a synthetic dump where
+one database dominates the size (like enwiki on s1), comparing the
+largest-first scheduling with the previous alphabetical order.
+"""
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from wmfbackups.MyDumperBackup import MyDumperBackup
+from wmfbackups.Scheduling import lpt_order, simulate_makespan
+from wmfbackups.WMFBackup import WMFBackup
+
+SMALL_DATABASES = 12
+SMALL_SIZE = 4 * 1024 * 1024
+BIG_SIZE = 16 * SMALL_SIZE
+THREADS = 4
+
+
+class TestArchiveDatabasesBenchmark(unittest.TestCase):
+    """compare the makespan of archiving with both scheduling orders"""
+
+    def create_dump(self, directory):
+        """creates a skewed dump: many small databases and a big one, sorted last"""
+        databases = [('db{:02d}'.format(i), SMALL_SIZE) for i in range(SMALL_DATABASES)]
+        databases.append(('zzwiki', BIG_SIZE))
+        for database, size in databases:
+            with open(os.path.join(directory, database + '-schema-create.sql.gz'), 'wb') as f:
+                f.write(b'CREATE DATABASE')
+            for chunk in range(4):
+                with open(os.path.join(directory, '{}.t.{:05d}.sql.gz'.format(database, chunk)),
+                          'wb') as f:
+                    f.write(os.urandom(size // 4))
+        with open(os.path.join(directory, 'metadata'), 'w') as f:
+            f.write('Finished dump at: 2022-01-01 00:00:00')
+
+    def archive(self, alphabetical):
+        """
+        archives a new synthetic dump, checking it was successful, and returns the size of
+        each database archive and the order in which they were scheduled
+        """
+        orders = list()
+
+        def schedule(sizes):
+            order = sorted(sizes) if alphabetical else lpt_order(sizes)
+            orders.append(order)
+            return order
+
+        with tempfile.TemporaryDirectory() as directory:
+            self.create_dump(directory)
+            backup = WMFBackup('test', {'type': 'dump'})
+            mydumper = MyDumperBackup(backup.config, backup)
+            sizes = {name: size for name, _, size in mydumper.group_database_files(directory)
+                     if name is not None}
+            with patch('wmfbackups.NullBackup.lpt_order', new=schedule):
+                self.assertEqual(mydumper.archive_databases(directory, THREADS), 0)
+            names = os.listdir(directory)
+            self.assertEqual(sorted(name for name in names if name.endswith('.gz.tar')),
+                             sorted(sizes))
+            self.assertEqual([name for name in names if name.endswith('.partial')], [])
+            self.assertEqual(sorted(name for name in names if not name.endswith('.gz.tar')),
+                             ['metadata'])
+        self.assertEqual(len(orders), 1)
+        return sizes, orders[0]
+
+    def test_benchmark(self):
+        """both orders archive everything, and largest first has a shorter makespan"""
+        sizes, alphabetical = self.archive(alphabetical=True)
+        _, largest_first = self.archive(alphabetical=False)
+        self.assertEqual(len(sizes), SMALL_DATABASES + 1)
+        self.assertEqual(largest_first[0], 'zzwiki.gz.tar')
+        # the big database bounds the makespan, instead of starting after the small ones
+        self.assertLess(simulate_makespan(sizes, largest_first, THREADS),
+                        simulate_makespan(sizes, alphabetical, THREADS))
+        self.assertLess(simulate_makespan(sizes, largest_first, THREADS),
+                        sizes['zzwiki.gz.tar'] * 1.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
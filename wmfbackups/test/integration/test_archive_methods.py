@@ -0,0 +1,70 @@
+"""
+Benchmark of the two archive methods (a /bin/tar process per database or the
+in-process TarArchiver) on a synthetic dump with many small databases (like s3)
+"""
+
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from wmfbackups.MyDumperBackup import MyDumperBackup
+from wmfbackups.WMFBackup import WMFBackup
+
+DATABASES = 1000
+TABLES = 3
+THREADS = 4
+
+
+class TestArchiveMethodsBenchmark(unittest.TestCase):
+    """compare the archives generated by both methods"""
+
+    def create_dump(self, directory):
+        """creates a dump of many small databases"""
+        for i in range(DATABASES):
+            database = 'wiki{:04d}'.format(i)
+            with open(os.path.join(directory, database + '-schema-create.sql.gz'), 'wb') as f:
+                f.write(b'CREATE DATABASE')
+            for table in range(TABLES):
+                with open(os.path.join(directory, '{}.t{}.00000.sql.gz'.format(database, table)),
+                          'wb') as f:
+                    f.write(os.urandom(4096))
+        with open(os.path.join(directory, 'metadata'), 'w') as f:
+            f.write('Finished dump at: 2022-01-01 00:00:00')
+
+    def archive(self, directory, method):
+        """archives the dump at directory with the given method, checking it was successful"""
+        backup = WMFBackup('test', {'type': 'dump', 'archive_method': method})
+        mydumper = MyDumperBackup(backup.config, backup)
+        self.assertEqual(mydumper.archive_databases(directory, THREADS), 0)
+        self.assertEqual(len(os.listdir(directory)), DATABASES + 1)
+
+    def read_archive(self, path):
+        """returns the list of (name, contents) of the members of the given tar"""
+        with tarfile.open(path) as tar:
+            return [(member.name, tar.extractfile(member).read()) for member in tar]
+
+    def test_benchmark(self):
+        """both methods archive the same dump into tars with the same members and contents"""
+        with tempfile.TemporaryDirectory() as directory:
+            subprocess_dir = os.path.join(directory, 'tar')
+            in_process_dir = os.path.join(directory, 'python')
+            os.mkdir(subprocess_dir)
+            self.create_dump(subprocess_dir)
+            shutil.copytree(subprocess_dir, in_process_dir)
+            self.archive(subprocess_dir, 'tar')
+            self.archive(in_process_dir, 'python')
+
+            self.assertEqual(sorted(os.listdir(subprocess_dir)), sorted(os.listdir(in_process_dir)))
+            for name in os.listdir(subprocess_dir):
+                if not name.endswith('.gz.tar'):
+                    continue
+                subprocess_members = self.read_archive(os.path.join(subprocess_dir, name))
+                self.assertEqual(len(subprocess_members), TABLES + 1)
+                self.assertEqual(subprocess_members,
+                                 self.read_archive(os.path.join(in_process_dir, name)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Testing of the backup catalog
+"""
+
+import datetime
+import os
+import tempfile
+import unittest
+
+from wmfbackups.BackupCatalog import BackupCatalog, parse_backup_name
+
+
+class TestBackupCatalog(unittest.TestCase):
+    """test backup names are parsed and indexed by type, section and date"""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.latest = os.path.join(self.tmp.name, 'latest')
+        self.archive = os.path.join(self.tmp.name, 'archive')
+        os.mkdir(self.latest)
+        os.mkdir(self.archive)
+        for directory, name in [(self.latest, 'dump.s1.2022-01-03--00-00-00'),
+                                (self.latest, 'dump.s2.2022-01-03--00-00-00'),
+                                (self.latest, 'dump_log.s1'),
+                                (self.archive, 'dump.s1.2022-01-02--00-00-00.tar.gz'),
+                                (self.archive, 'dump.s1.2022-01-01--00-00-00'),
+                                (self.archive, 'snapshot.s1.2022-01-04--00-00-00.tar.gz'),
+                                (self.archive, 'dump.s1.2022-19-01--00-00-00')]:
+            os.mkdir(os.path.join(directory, name))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_parse_backup_name(self):
+        """test backup names are parsed into their components"""
+        self.assertEqual(parse_backup_name('dump.s1.2022-01-02--03-04-05.tar.gz'),
+                         ('dump', 's1', datetime.datetime(2022, 1, 2, 3, 4, 5), '.tar.gz'))
+        self.assertEqual(parse_backup_name('snapshot.x1_test.2022-01-02--03-04-05'),
+                         ('snapshot', 'x1_test', datetime.datetime(2022, 1, 2, 3, 4, 5), ''))
+        # any section name without dots, like the previous parser accepted
+        self.assertEqual(parse_backup_name('dump.S4+Test.2022-01-02--03-04-05'),
+                         ('dump', 'S4+Test', datetime.datetime(2022, 1, 2, 3, 4, 5), ''))
+        self.assertIsNone(parse_backup_name('dump_log.s1'))
+        self.assertIsNone(parse_backup_name('dump.s1.2022-01-02 03:04:05'))
+        self.assertIsNone(parse_backup_name('dump.s1.2022-19-02--03-04-05'))
+
+    def test_catalog(self):
+        """test lookups, in a single directory and in all of them"""
+        catalog = BackupCatalog([self.latest, self.archive, '/a/missing/dir']).scan()
+        self.assertEqual([r.name for r in catalog.backups('dump', 's1')],
+                         ['dump.s1.2022-01-01--00-00-00', 'dump.s1.2022-01-02--00-00-00.tar.gz',
+                          'dump.s1.2022-01-03--00-00-00'])
+        self.assertEqual([r.name for r in catalog.backups('dump', 's1', self.archive + '/')],
+                         ['dump.s1.2022-01-01--00-00-00', 'dump.s1.2022-01-02--00-00-00.tar.gz'])
+        latest = catalog.latest('dump', 's1')
+        self.assertEqual(latest.path, os.path.join(self.latest, 'dump.s1.2022-01-03--00-00-00'))
+        self.assertTrue(latest.is_dir)
+        record = catalog.latest('dump', 's1', self.archive)
+        self.assertEqual((record.dir_name, record.extension),
+                         ('dump.s1.2022-01-02--00-00-00', '.tar.gz'))
+        self.assertEqual(catalog.latest('snapshot', 's1').section, 's1')
+        self.assertIsNone(catalog.latest('dump', 's3'))
+
+    def test_updates(self):
+        """test moved and removed backups are reflected on the index"""
+        catalog = BackupCatalog([self.latest, self.archive]).scan()
+        moved = catalog.move(catalog.latest('dump', 's1', self.latest), self.archive)
+        self.assertEqual(moved.directory, self.archive)
+        self.assertIsNone(catalog.latest('dump', 's1', self.latest))
+        self.assertEqual(catalog.latest('dump', 's1', self.archive), moved)
+        catalog.remove(moved)
+        self.assertEqual(len(catalog.backups('dump', 's1')), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,367 @@
+"""
+Testing of the BackupStatistics classes
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import pymysql
+
+from wmfbackups.BackupStatistics import DatabaseBackupStatistics, StatsSession, \
+    SpoolBackupStatistics, SpoolReplayer, get_backup_object, query_previous_duration, \
+    query_previous_transfer_time
+from wmfbackups.PhaseTimer import PhaseTiming
+
+
+class TestBackupObjects(unittest.TestCase):
+    """test the identification of the objects each backup file belongs to"""
+
+    def test_get_backup_object(self):
+        """test mydumper and xtrabackup file names"""
+        self.assertIsNone(get_backup_object('dump', '', 'metadata'))
+        self.assertEqual(get_backup_object('dump', '', 'enwiki-schema-create.sql.gz'), ('enwiki', None))
+        self.assertEqual(get_backup_object('dump', '', 'enwiki-schema-post.sql.gz'), ('enwiki', None))
+        self.assertEqual(get_backup_object('dump', '', 'enwiki.gz.tar'), ('enwiki', None))
+        self.assertEqual(get_backup_object('dump', '', 'enwiki.page-schema.sql.gz'), ('enwiki', 'page'))
+        self.assertEqual(get_backup_object('dump', '', 'enwiki.page-schema-triggers.sql.gz'),
+                         ('enwiki', 'page'))
+        self.assertEqual(get_backup_object('dump', '', 'enwiki.page.00012.sql.gz'), ('enwiki', 'page'))
+        self.assertEqual(get_backup_object('dump', '', 'enwiki.page.sql.gz'), ('enwiki', 'page'))
+        self.assertEqual(get_backup_object('dump', '', 'enwiki.page_props.00000.sql.zst'),
+                         ('enwiki', 'page_props'))
+        self.assertIsNone(get_backup_object('snapshot', '', 'ibdata1'))
+        self.assertIsNone(get_backup_object('snapshot', '', 'xtrabackup_info'))
+        self.assertEqual(get_backup_object('snapshot', 'enwiki', 'page.ibd'), ('enwiki', 'page'))
+        self.assertEqual(get_backup_object('snapshot', 'enwiki', 'page.frm'), ('enwiki', 'page'))
+        self.assertEqual(get_backup_object('snapshot', 'enwiki', 'log#P#p1.ibd'), ('enwiki', 'log'))
+        self.assertEqual(get_backup_object('snapshot', 'enwiki', 'db.opt'), ('enwiki', None))
+        self.assertEqual(get_backup_object('snapshot', '', 'enwiki.tar'), ('enwiki', None))
+        self.assertIsNone(get_backup_object('null', '', 'a'))
+
+
+class TestDatabaseBackupStatistics(unittest.TestCase):
+    """test module implementing the storage of backup metadata on a database"""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.stats = DatabaseBackupStatistics(dir_name='dump.s1.2022-01-01--00-00-00', section='s1',
+                                              type='dump', source='db1001:3306',
+                                              backup_dir='/a/dir', config={'batch_size': 2})
+
+    def test_insert_file_list(self):
+        """test file metadata is inserted using batched multi-row inserts"""
+        stats = self.stats
+        db = MagicMock()
+        cursor = db.cursor.return_value.__enter__.return_value
+        cursor.execute.side_effect = lambda query, parameters: len(parameters) // 6
+        files = [('', 'a', 1, 0, None), ('', 'b', 2, 0, 7), ('c', 'd', 3, 0, None)]
+        self.assertTrue(stats.insert_file_list(db, 10, files))
+        self.assertEqual(cursor.execute.call_count, 2)
+        query, parameters = cursor.execute.call_args_list[0][0]
+        self.assertEqual(query.count('FROM_UNIXTIME'), 2)
+        self.assertEqual(parameters, [10, '', 'a', 1, 0, None, 10, '', 'b', 2, 0, 7])
+        query, parameters = cursor.execute.call_args_list[1][0]
+        self.assertEqual(query.count('FROM_UNIXTIME'), 1)
+        db.commit.assert_not_called()
+
+        # some rows were not inserted
+        cursor.execute.side_effect = None
+        cursor.execute.return_value = 1
+        self.assertFalse(stats.insert_file_list(db, 10, files))
+
+        # nothing to insert
+        cursor.execute.reset_mock()
+        self.assertTrue(stats.insert_file_list(db, 10, []))
+        cursor.execute.assert_not_called()
+
+    @patch('wmfbackups.BackupStatistics.pymysql.connect')
+    def test_status_changes_reuse_connection(self, mock_connect):
+        """test one connection is used for the whole run, and the inserted id is remembered"""
+        stats = self.stats
+        cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        cursor.execute.return_value = 1
+        cursor.lastrowid = 1234
+        stats.start()
+        self.assertEqual(stats.backup_id, '1234')
+        self.assertEqual(stats.find_backup_id(mock_connect.return_value), '1234')
+        stats.finish()
+        mock_connect.assert_called_once()
+        query, parameters = cursor.execute.call_args[0]
+        self.assertTrue(query.startswith('UPDATE backups SET status'))
+        self.assertEqual(parameters, ('finished', '1234'))
+        mock_connect.return_value.close.assert_called_once()
+
+    @patch('wmfbackups.BackupStatistics.pymysql.connect')
+    def test_record_phase(self, mock_connect):
+        """test phase timings are stored linked to the current backup"""
+        stats = self.stats
+        stats.backup_id = '1234'
+        cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        self.assertTrue(stats.record_phase(PhaseTiming('compress', 1000, 2.5, 10.0, 300, 100)))
+        query, parameters = cursor.execute.call_args[0]
+        self.assertTrue(query.startswith('INSERT INTO backup_phases'))
+        self.assertEqual(parameters, ('1234', 'compress', 1000, 2.5, 10.0, 300, 100))
+        mock_connect.return_value.commit.assert_called_once()
+
+        cursor.execute.side_effect = pymysql.err.ProgrammingError()
+        self.assertFalse(stats.record_phase(PhaseTiming('rotate', 1000, 2.5, 10.0, 100, 0)))
+        mock_connect.return_value.rollback.assert_called_once()
+
+    @patch('wmfbackups.BackupStatistics.pymysql.connect')
+    def test_record_phase_resumed(self, mock_connect):
+        """test a phase redone by a resumed run overwrites its timing instead of failing"""
+        stats = self.stats
+        stats.backup_id = '1234'
+        cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        phases = dict()
+
+        def execute(query, parameters):
+            key = parameters[:2]
+            if key in phases and 'ON DUPLICATE KEY UPDATE' not in query:
+                raise pymysql.err.IntegrityError(1062, 'Duplicate entry')
+            phases[key] = parameters[2:]
+
+        cursor.execute.side_effect = execute
+        self.assertTrue(stats.record_phase(PhaseTiming('compress', 1000, 2.5, 10.0, 300, None)))
+        # the resumed run reuses the same entry and redoes the phase
+        self.assertTrue(stats.record_phase(PhaseTiming('compress', 2000, 3.0, 12.0, 300, 100)))
+        self.assertEqual(phases, {('1234', 'compress'): (2000, 3.0, 12.0, 300, 100)})
+
+        # any other database error is not fatal either
+        cursor.execute.side_effect = pymysql.err.OperationalError(2013, 'Lost connection')
+        self.assertFalse(stats.record_phase(PhaseTiming('rotate', 3000, 1.0, 1.0, 100, 100)))
+
+    @patch('wmfbackups.BackupStatistics.pymysql.connect')
+    def test_record_phase_concurrently(self, mock_connect):
+        """test phases finishing on different threads do not share the connection at once"""
+        stats = self.stats
+        stats.backup_id = '1234'
+        cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        running = list()
+        overlaps = list()
+
+        def execute(query, parameters):
+            running.append(parameters[1])
+            overlaps.append(len(running) > 1)
+            time.sleep(0.05)
+            running.remove(parameters[1])
+
+        cursor.execute.side_effect = execute
+        threads = [threading.Thread(target=stats.record_phase,
+                                    args=(PhaseTiming(phase, 1000, 1.0, 1.0, None, None), ))
+                   for phase in ['metrics', 'compress']]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(overlaps, [False, False])
+
+    @patch('wmfbackups.BackupStatistics.pymysql.connect')
+    def test_heartbeat(self, mock_connect):
+        """test the progress is stored on the backup entry, and the previous size read"""
+        stats = self.stats
+        stats.backup_id = '1234'
+        cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        self.assertTrue(stats.heartbeat({'time': 1000, 'bytes': 200, 'throughput': 2.0,
+                                         'eta': 1400}))
+        query, parameters = cursor.execute.call_args[0]
+        self.assertTrue(query.startswith('UPDATE backups SET heartbeat_date'))
+        self.assertEqual(parameters, (1000, 200, 2.0, 1400, '1234'))
+
+        # a lost connection is not raised, so the progress monitor keeps sampling
+        cursor.execute.side_effect = pymysql.err.OperationalError(2013, 'Lost connection')
+        self.assertFalse(stats.heartbeat({'time': 1060, 'bytes': 300, 'throughput': 2.0,
+                                          'eta': 1400}))
+        cursor.execute.side_effect = None
+
+        cursor.fetchall.return_value = [{'value': 5000}]
+        self.assertEqual(stats.get_previous_size(), 5000)
+        cursor.fetchall.return_value = []
+        self.assertIsNone(stats.get_previous_size())
+
+    def test_query_previous_duration(self):
+        """test the duration and transfer time of the last finished backup are queried"""
+        db = MagicMock()
+        cursor = db.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [{'value': 3600}]
+        self.assertEqual(query_previous_duration(db, 'snapshot', 's1'), 3600)
+        query, parameters = cursor.execute.call_args[0]
+        self.assertIn('TIMESTAMPDIFF(SECOND, start_date, end_date) + ', query)
+        self.assertIn("phase = 'transfer'", query)
+        self.assertEqual(parameters, ('snapshot', 's1'))
+        cursor.execute.side_effect = pymysql.err.ProgrammingError()
+        self.assertIsNone(query_previous_duration(db, 'snapshot', 's1'))
+
+        cursor.execute.side_effect = None
+        cursor.fetchall.return_value = [{'value': 600}]
+        self.assertEqual(query_previous_transfer_time(db, 'snapshot', 's1'), 600)
+        query, _ = cursor.execute.call_args[0]
+        self.assertNotIn('TIMESTAMPDIFF', query)
+        self.assertIn("phase = 'transfer'", query)
+
+
+class TestStatsSession(unittest.TestCase):
+    """test the persistent connection to the statistics database"""
+
+    @patch('wmfbackups.BackupStatistics.pymysql.connect')
+    def test_connect(self, mock_connect):
+        """test connection is created once and pinged (reconnecting) afterwards"""
+        session = StatsSession('/a/file.ini')
+        db = session.connect()
+        self.assertEqual(db, mock_connect.return_value)
+        self.assertEqual(session.connect(), db)
+        mock_connect.assert_called_once_with(read_default_file='/a/file.ini')
+        db.ping.assert_called_once_with(reconnect=True)
+
+        # reconnection failed
+        db.ping.side_effect = pymysql.err.OperationalError()
+        self.assertIsNone(session.connect())
+        self.assertIsNone(session.db)
+
+        # connection failed
+        mock_connect.side_effect = pymysql.err.OperationalError()
+        self.assertIsNone(session.connect())
+
+
+class TestSpoolBackupStatistics(unittest.TestCase):
+    """test statistics are spooled locally and replayed idempotently"""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.backup_dir = os.path.join(self.tmp.name, 'dump.s1.2022-01-01--00-00-00')
+        os.mkdir(self.backup_dir)
+        for name, content in [('metadata', 'Finished dump at: 2022-01-01 00:00:00'),
+                              ('enwiki-schema-create.sql.gz', 'abc'),
+                              ('enwiki.page.00000.sql.gz', 'abcdefg')]:
+            with open(os.path.join(self.backup_dir, name), 'w') as f:
+                f.write(content)
+        self.stats = SpoolBackupStatistics(dir_name='dump.s1.2022-01-01--00-00-00', section='s1',
+                                           type='dump', source='db1001:3306',
+                                           backup_dir=self.backup_dir,
+                                           config={'spool_dir': self.tmp.name})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_spool(self):
+        """test events are appended to the spool file"""
+        stats = self.stats
+        self.assertTrue(stats.set_status('ongoing'))
+        self.assertTrue(stats.gather_metrics())
+        self.assertTrue(stats.record_phase(PhaseTiming('metrics', 1000, 2.5, 0.0, 47, 47)))
+        self.assertTrue(stats.set_status('finished'))
+        with open(stats.spool_file) as f:
+            events = [json.loads(line) for line in f]
+        self.assertEqual([e['event'] for e in events],
+                         ['start', 'objects', 'files', 'size', 'phase', 'status'])
+        self.assertEqual(events[0]['source'], 'db1001')
+        self.assertEqual(events[1]['objects'], [['enwiki', None, 10], ['enwiki', 'page', 7]])
+        self.assertEqual([f[:3] + f[4:] for f in events[2]['files']],
+                         [['', 'enwiki-schema-create.sql.gz', 3, 'enwiki', None],
+                          ['', 'enwiki.page.00000.sql.gz', 7, 'enwiki', 'page'],
+                          ['', 'metadata', 37, None, None]])
+        self.assertEqual(events[3]['total_size'], 47)
+        self.assertEqual(events[4]['phase'], 'metrics')
+        self.assertEqual(events[5]['status'], 'finished')
+
+    def test_inventory(self):
+        """test the file list read before the files are archived is the one recorded"""
+        stats = self.stats
+        stats.set_status('ongoing')
+        self.assertTrue(stats.take_inventory())
+        os.remove(os.path.join(self.backup_dir, 'enwiki.page.00000.sql.gz'))
+        self.assertTrue(stats.gather_metrics())
+        self.assertEqual(len(stats.events.queue[2]['files']), 3)
+        self.assertEqual(stats.events.queue[3]['total_size'], 47)
+
+    @patch('wmfbackups.BackupStatistics.pymysql.connect')
+    def test_replay(self, mock_connect):
+        """test a spool file is replayed and deleted"""
+        stats = self.stats
+        stats.set_status('ongoing')
+        stats.gather_metrics()
+        stats.finish()
+        with open(stats.spool_file, 'a') as f:
+            f.write('{"event":"sta')  # truncated line
+        db = mock_connect.return_value
+        cursor = db.cursor.return_value.__enter__.return_value
+        # the backup entry and its objects already exist
+        cursor.fetchall.side_effect = [[{'id': 33}],
+                                       [{'id': 1, 'db': 'enwiki', 'name': None},
+                                        {'id': 2, 'db': 'enwiki', 'name': 'page'}]]
+        cursor.execute.return_value = 1
+        replayer = SpoolReplayer('/a/file.ini')
+        self.assertTrue(replayer.replay(stats.spool_file))
+        self.assertFalse(os.path.exists(stats.spool_file))
+        queries = [c[0][0] for c in cursor.execute.call_args_list]
+        self.assertTrue(queries[0].startswith('SELECT id FROM backups'))
+        self.assertTrue(queries[1].startswith('SELECT id, db, name FROM backup_objects'))
+        self.assertTrue(queries[2].startswith('INSERT IGNORE INTO backup_files'))
+        self.assertEqual(cursor.execute.call_args_list[2][0][1][5::6], [1, 2, None])
+        self.assertEqual(cursor.execute.call_args[0][1], ('finished', stats.events.queue[-1]['time'], '33'))
+        self.assertEqual(db.commit.call_count, 5)
+
+        # database down, the spool is kept
+        stats.set_status('ongoing')
+        stats.fail()
+        mock_connect.side_effect = pymysql.err.OperationalError()
+        self.assertFalse(SpoolReplayer('/a/file.ini').replay(stats.spool_file))
+        self.assertTrue(os.path.exists(stats.spool_file))
+
+    @patch('wmfbackups.BackupStatistics.pymysql.connect')
+    def test_replay_running_backup(self, mock_connect):
+        """test the spool of a running backup is not replayed until it is released"""
+        stats = self.stats
+        stats.set_status('ongoing')
+        replayer = SpoolReplayer('/a/file.ini')
+        self.assertTrue(replayer.replay(stats.spool_file))  # skipped, not a failure
+        mock_connect.assert_not_called()
+        self.assertTrue(os.path.exists(stats.spool_file))
+        stats.record_phase(PhaseTiming('backup', 1000, 2.5, 0.0, 47, 47))
+        stats.finish()
+        cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [{'id': 33}]
+        self.assertTrue(replayer.replay(stats.spool_file))
+        self.assertEqual(mock_connect.return_value.commit.call_count, 3)
+        self.assertFalse(os.path.exists(stats.spool_file))
+
+    @patch('wmfbackups.BackupStatistics.pymysql.connect')
+    def test_record_late_phase(self, mock_connect):
+        """test phases finishing after the final status are sent on their own spool file"""
+        stats = self.stats
+        stats.set_status('ongoing')
+        stats.set_status('finished')
+        mock_connect.side_effect = pymysql.err.OperationalError()
+        self.assertTrue(stats.record_phase(PhaseTiming('purge', 1000, 60.0, 0.0, 10000, 0)))
+        stats.late_shipper.join()  # sent on the background, and failed
+        late_spool_file = os.path.join(self.tmp.name, 'dump.s1.2022-01-01--00-00-00.purge.spool')
+        with open(late_spool_file) as f:
+            events = [json.loads(line) for line in f]
+        self.assertEqual([e['event'] for e in events], ['start', 'phase'])
+        self.assertEqual(events[1]['bytes_before'], 10000)
+        self.assertEqual(len(stats.events.queue), 2)  # not queued on the finished shipper
+
+    @patch('wmfbackups.BackupStatistics.SpoolReplayer.ship')
+    def test_finish_does_not_wait(self, mock_ship):
+        """test a backup does not wait for its statistics to be shipped, unless configured"""
+        sent = threading.Event()
+        mock_ship.side_effect = lambda event: sent.wait(5)
+        stats = self.stats
+        stats.start()
+        start = time.monotonic()
+        stats.finish()
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertTrue(os.path.exists(stats.spool_file))  # kept until sent
+        sent.set()
+        stats.shipper.join()
+        self.assertFalse(os.path.exists(stats.spool_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
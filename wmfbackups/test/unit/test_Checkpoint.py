@@ -0,0 +1,57 @@
+"""
+Testing of the backup phase checkpoints
+"""
+
+import os
+import tempfile
+import unittest
+
+from wmfbackups.Checkpoint import Checkpoint
+
+
+class TestCheckpoint(unittest.TestCase):
+    """test completed phases are persisted and read back"""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_checkpoint(self):
+        """test marking, loading and removing a checkpoint"""
+        checkpoint = Checkpoint(self.tmp.name, 'snapshot.s1.2022-01-01--00-00-00')
+        self.assertEqual(checkpoint.path, os.path.join(self.tmp.name,
+                                                       '.snapshot.s1.2022-01-01--00-00-00.checkpoint'))
+        self.assertFalse(checkpoint.exists())
+        self.assertFalse(checkpoint.load())
+        self.assertTrue(checkpoint.mark_done('check_log'))
+        self.assertTrue(checkpoint.mark_done('prepare'))
+        self.assertTrue(checkpoint.mark_done('prepare'))
+
+        resumed = Checkpoint(self.tmp.name, 'snapshot.s1.2022-01-01--00-00-00')
+        self.assertTrue(resumed.load())
+        self.assertEqual(resumed.completed, ['check_log', 'prepare'])
+        self.assertTrue(resumed.is_done('prepare'))
+        self.assertFalse(resumed.is_done('compress'))
+        self.assertEqual(os.listdir(self.tmp.name), ['.snapshot.s1.2022-01-01--00-00-00.checkpoint'])
+
+        resumed.remove()
+        self.assertFalse(resumed.exists())
+        resumed.remove()
+
+        # corrupted file
+        with open(checkpoint.path, 'w') as f:
+            f.write('{"compl')
+        self.assertFalse(checkpoint.load())
+
+    def test_unwritable(self):
+        """test failing to write the checkpoint is not fatal"""
+        checkpoint = Checkpoint(os.path.join(self.tmp.name, 'missing'), 'dump.s1')
+        self.assertFalse(checkpoint.mark_done('backup'))
+        self.assertTrue(checkpoint.is_done('backup'))
+
+
+if __name__ == "__main__":
+    unittest.main()
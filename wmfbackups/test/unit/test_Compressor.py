@@ -0,0 +1,39 @@
+"""
+Testing of the compressor backends
+"""
+
+import re
+import unittest
+
+from wmfbackups.Compressor import get_compressor, split_extension, TARBALL_EXTENSION_REGEX
+
+
+class TestCompressor(unittest.TestCase):
+    """test the selection and detection of compression backends"""
+
+    def test_get_compressor(self):
+        """test compressors are found by name"""
+        self.assertEqual(get_compressor().extension, '.tar.gz')
+        self.assertEqual(get_compressor('zstd').extension, '.tar.zst')
+        self.assertEqual(get_compressor('zstd').get_compress_cmd(8), ['/usr/bin/zstd', '--quiet', '-T8'])
+        self.assertIsNone(get_compressor('none').get_compress_cmd(8))
+        self.assertRaises(KeyError, get_compressor, 'bzip2')
+
+    def test_split_extension(self):
+        """test the compression method is detected from the file name"""
+        name, compressor = split_extension('dump.s1.2022-01-01--00-00-00.tar.gz')
+        self.assertEqual(name, 'dump.s1.2022-01-01--00-00-00')
+        self.assertEqual(compressor.name, 'pigz')
+        name, compressor = split_extension('dump.s1.2022-01-01--00-00-00.tar.zst')
+        self.assertEqual(name, 'dump.s1.2022-01-01--00-00-00')
+        self.assertEqual(compressor.name, 'zstd')
+        name, compressor = split_extension('dump.s1.2022-01-01--00-00-00.tar')
+        self.assertEqual(name, 'dump.s1.2022-01-01--00-00-00')
+        self.assertEqual(compressor.name, 'none')
+        self.assertEqual(split_extension('dump.s1.2022-01-01--00-00-00'),
+                         ('dump.s1.2022-01-01--00-00-00', None))
+        self.assertEqual(re.match('a(' + TARBALL_EXTENSION_REGEX + ')', 'a.tar.zst').group(1), '.tar.zst')
+
+
+if __name__ == "__main__":
+    unittest.main()
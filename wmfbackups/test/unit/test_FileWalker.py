@@ -0,0 +1,63 @@
+"""
+Testing of the os.scandir-based directory traversal helpers
+"""
+
+import os
+import tempfile
+import unittest
+
+from wmfbackups.FileWalker import get_size, list_dir, walk
+
+
+class TestFileWalker(unittest.TestCase):
+    """test directory listing and iterative traversal"""
+
+    def setUp(self):
+        """Create a small tree: a, b/c, b/d/e and a link from b/d/loop to b"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.top = self.tmp.name
+        os.makedirs(os.path.join(self.top, 'b', 'd'))
+        for path, content in [('a', b'1'), ('b/c', b'22'), ('b/d/e', b'333')]:
+            with open(os.path.join(self.top, path), 'wb') as f:
+                f.write(content)
+        os.symlink(os.path.join(self.top, 'b'), os.path.join(self.top, 'b', 'd', 'loop'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_list_dir(self):
+        """test sorted listing"""
+        self.assertEqual([entry.name for entry in list_dir(self.top)], ['a', 'b'])
+        self.assertRaises(OSError, list_dir, os.path.join(self.top, 'missing'))
+
+    def test_walk(self):
+        """test depth-first, sorted traversal without following links"""
+        entries = list(walk(self.top))
+        self.assertEqual([(e.path, e.name) for e in entries],
+                         [('', 'a'), ('', 'b'), ('b', 'c'), ('b', 'd'),
+                          (os.path.join('b', 'd'), 'e'), (os.path.join('b', 'd'), 'loop')])
+        sizes = {e.name: e.size for e in entries if not e.is_dir and not e.is_link}
+        self.assertEqual(sizes, {'a': 1, 'c': 2, 'e': 3})
+        link = entries[-1]
+        self.assertTrue(link.is_link)
+        self.assertFalse(link.is_dir)
+
+    def test_walk_follow_links(self):
+        """test link loops are only entered once when following links"""
+        entries = list(walk(self.top, follow_links=True))
+        names = [os.path.join(e.path, e.name) for e in entries]
+        self.assertEqual(names, ['a', 'b', os.path.join('b', 'c'), os.path.join('b', 'd'),
+                                 os.path.join('b', 'd', 'e'), os.path.join('b', 'd', 'loop')])
+        self.assertTrue(entries[-1].is_dir)
+        self.assertTrue(entries[-1].is_link)
+
+    def test_get_size(self):
+        """test size of files and trees, links counted but not followed"""
+        link_size = os.lstat(os.path.join(self.top, 'b', 'd', 'loop')).st_size
+        self.assertEqual(get_size(self.top), 6 + link_size)
+        self.assertEqual(get_size(os.path.join(self.top, 'b', 'c')), 2)
+        self.assertEqual(get_size(os.path.join(self.top, 'missing')), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,11 +2,14 @@
 Testing of the MariaBackup class
 """
 
+import os
+import tempfile
 import unittest
 from unittest.mock import patch, mock_open
 
-from wmfbackups.MariaBackup import MariaBackup, XtrabackupError
+from wmfbackups.MariaBackup import MariaBackup, XtrabackupError, estimate_prepare_memory
 from wmfbackups.WMFBackup import WMFBackup
+from wmfbackups.test.unit.test_SnapshotChain import write_checkpoints
 
 
 class TestMariaBackup(unittest.TestCase):
@@ -34,8 +37,9 @@ class TestMariaBackup(unittest.TestCase):
         self.assertEqual(mb.uniformize_vendor_string('16-57'), 'Percona Server')
         self.assertEqual(mb.uniformize_vendor_string('16-57-log'), 'Percona Server')
 
+    @patch('wmfbackups.MariaBackup.get_binary_key', return_value=None)
     @patch('subprocess.Popen')
-    def test__get_xtrabackup_version(self, mock):
+    def test__get_xtrabackup_version(self, mock, _):
         """Test getting xtrabackup version"""
         mb = self.maria_backup
 
@@ -91,6 +95,26 @@ class TestMariaBackup(unittest.TestCase):
         mock.return_value = process_mock
         self.assertRaises(XtrabackupError, mb._get_xtrabackup_version)
 
+    @patch('subprocess.Popen')
+    def test__get_xtrabackup_version_cache(self, mock):
+        """Test the version is only probed once per binary path and mtime"""
+        mb = self.maria_backup
+        process_mock = mock.Mock()
+        process_mock.configure_mock(**{
+            'communicate.return_value': (b'', b'xtrabackup based on MariaDB server 10.6.12-MariaDB'),
+            'returncode': 0
+        })
+        mock.return_value = process_mock
+        version = {'major': '10.6', 'minor': 12, 'vendor': 'MariaDB'}
+        with patch.dict('wmfbackups.MariaBackup.XTRABACKUP_VERSIONS', clear=True), \
+                patch('wmfbackups.MariaBackup.get_binary_key', return_value=('/usr/bin/xtrabackup', 1)):
+            self.assertEqual(mb._get_xtrabackup_version(), version)
+            self.assertEqual(mb._get_xtrabackup_version(), version)
+            self.assertEqual(mock.call_count, 1)
+            with patch('wmfbackups.MariaBackup.get_binary_key', return_value=('/usr/bin/xtrabackup', 2)):
+                self.assertEqual(mb._get_xtrabackup_version(), version)  # upgraded binary
+            self.assertEqual(mock.call_count, 2)
+
     def test__get_backup_source_server_version(self):
         """Test retrieving the server version from the xtrabackup_info file"""
         mb = self.maria_backup
@@ -227,6 +251,22 @@ class TestMariaBackup(unittest.TestCase):
                                                                   '--use-memory', '40G',
                                                                   '--open-files-limit', '200000'])
 
+    def test_get_prepare_memory(self):
+        """test the prepare memory is sized from the redo log, unless configured"""
+        gib = 1024 ** 3
+        self.assertEqual(estimate_prepare_memory(10, None, 40 * gib), gib)
+        self.assertEqual(estimate_prepare_memory(3 * gib, None, 40 * gib), 6 * gib)
+        self.assertEqual(estimate_prepare_memory(30 * gib, None, 40 * gib), 40 * gib)
+        self.assertEqual(estimate_prepare_memory(30 * gib, 64 * gib, 40 * gib), 32 * gib)
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            self.assertEqual(self.maria_backup.get_prepare_memory(snapshot_dir), '40G')
+            with open(os.path.join(snapshot_dir, 'xtrabackup_logfile'), 'wb') as f:
+                f.truncate(gib)
+            with patch('wmfbackups.MariaBackup.get_host_memory', return_value=None):
+                self.assertEqual(self.maria_backup.get_prepare_memory(snapshot_dir), str(2 * gib))
+            mb = MariaBackup({'type': 'null', 'prepare_memory': '8G'}, self.backup)
+            self.assertEqual(mb.get_prepare_memory(snapshot_dir), '8G')
+
     def test_errors_on_output(self):
         """Check errors on standard output & standard error after backup"""
         mb = self.maria_backup
@@ -310,6 +350,73 @@ class TestMariaBackup(unittest.TestCase):
                 patch.object(MariaBackup, '_get_xtraback_prepare_cmd', return_value=prepare_cmd):
             self.assertRaises(XtrabackupError, mb.get_prepare_cmd, '/a/dir')
 
+    def test_incremental_snapshots(self):
+        """test snapshots continue the chain of the section until its max depth"""
+        mb = MariaBackup({'type': 'null', 'max_chain_depth': 1}, self.backup)
+        prepare_cmd = ['xtrabackup', '--prepare']
+        version = {'major': '10.4', 'minor': 22, 'vendor': 'Percona Server'}
+        with tempfile.TemporaryDirectory() as backup_dir, \
+                patch.object(MariaBackup, '_get_xtrabackup_version', return_value=version), \
+                patch.object(MariaBackup, '_get_backup_source_server_version', return_value=version), \
+                patch.object(MariaBackup, '_get_xtraback_prepare_cmd', return_value=prepare_cmd):
+            # first snapshot is a full one, prepared without the rollback
+            self.assertNotIn('--incremental-lsn', mb.get_backup_cmd(backup_dir))
+            write_checkpoints(os.path.join(backup_dir, 'test'), 'full-backuped', 0, 100)
+            self.assertEqual(mb.get_prepare_cmd(backup_dir), prepare_cmd + ['--apply-log-only'])
+            # it is only the base of the next one once its run finished
+            self.assertNotIn('--incremental-lsn', mb.get_backup_cmd(backup_dir))
+            mb.record_success(backup_dir)
+            # the next one is incremental, and it is not prepared
+            cmd = mb.get_backup_cmd(backup_dir)
+            self.assertEqual(cmd[cmd.index('--incremental-lsn') + 1], '100')
+            self.backup.dir_name = 'test2'
+            write_checkpoints(os.path.join(backup_dir, 'test2'), 'incremental', 100, 150)
+            self.assertEqual(mb.get_prepare_cmd(backup_dir), '')
+            mb.record_success(backup_dir)
+            # max depth reached
+            self.assertNotIn('--incremental-lsn', mb.get_backup_cmd(backup_dir))
+            # an incremental not continuing the chain fails
+            self.backup.dir_name = 'test3'
+            write_checkpoints(os.path.join(backup_dir, 'test3'), 'incremental', 120, 200)
+            self.assertRaises(XtrabackupError, mb.get_prepare_cmd, backup_dir)
+
+            cmds = mb.get_chain_prepare_cmds('full', ['inc1', 'inc2'])
+            self.assertEqual(cmds[0][:6], ['xtrabackup', '--prepare', '--target-dir', 'full',
+                                           '--incremental-dir', 'inc1'])
+            self.assertEqual(cmds[0][-1], '--apply-log-only')
+            self.assertNotIn('--apply-log-only', cmds[1])
+            # a chain with only the full snapshot only needs the rollback
+            cmds = mb.get_chain_prepare_cmds('full', [])
+            self.assertEqual(cmds[0][:4], ['xtrabackup', '--prepare', '--target-dir', 'full'])
+            self.assertEqual(len(cmds), 1)
+            self.assertNotIn('--apply-log-only', cmds[0])
+
+    def test_archive_databases(self):
+        """test each database dir is archived, system files are left loose and can be restored"""
+        self.backup.config['archive_method'] = 'python'
+        mb = self.maria_backup
+        with tempfile.TemporaryDirectory() as source:
+            for path in ['ibdata1', 'xtrabackup_checkpoints', 'mysql/user.MAI', 'aawiki/db.opt',
+                         'enwiki/page.ibd', 'enwiki/page.frm', '#innodb_temp/temp_1.ibt']:
+                os.makedirs(os.path.dirname(os.path.join(source, path)), exist_ok=True)
+                with open(os.path.join(source, path), 'wb') as f:
+                    f.write(b'a' * 100)
+            self.assertEqual(mb.group_database_files(source),
+                             [('aawiki.tar', ['aawiki'], 100), ('enwiki.tar', ['enwiki'], 200)])
+            self.assertEqual(mb.archive_databases(source, 2), 0)
+            self.assertEqual(sorted(os.listdir(source)),
+                             ['#innodb_temp', 'aawiki.tar', 'enwiki.tar', 'ibdata1', 'mysql',
+                              'xtrabackup_checkpoints'])
+            self.assertEqual(mb.archive_databases(source, 2), 0)  # nothing left to archive
+
+            self.assertEqual(mb.unarchive_databases(source, 2, databases=['enwiki']), 0)
+            self.assertEqual(sorted(os.listdir(os.path.join(source, 'enwiki'))),
+                             ['page.frm', 'page.ibd'])
+            self.assertIn('aawiki.tar', os.listdir(source))
+            self.assertEqual(mb.unarchive_databases(source, 2), 0)
+            self.assertEqual(os.listdir(os.path.join(source, 'aawiki')), ['db.opt'])
+            self.assertNotIn('aawiki.tar', os.listdir(source))
+
 
 if __name__ == "__main__":
     unittest.main()
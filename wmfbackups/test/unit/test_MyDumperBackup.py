@@ -0,0 +1,124 @@
+"""
+Testing of the MyDumperBackup class
+"""
+
+import os
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from wmfbackups.MyDumperBackup import MyDumperBackup
+
+
+class TestMyDumperBackup(unittest.TestCase):
+    """test mydumper-specific backup handling"""
+
+    def setUp(self):
+        """Create a dump dir with a small and a big database"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = self.tmp.name
+        for name, size in [('aawiki-schema-create.sql.gz', 10),
+                           ('aawiki.page-schema.sql.gz', 10),
+                           ('aawiki.page.00000.sql.gz', 100),
+                           ('enwiki-schema-create.sql.gz', 10),
+                           ('enwiki.page.00000.sql.gz', 1000),
+                           ('enwiki.page.00001.sql.gz', 1000),
+                           ('metadata', 50)]:
+            with open(os.path.join(self.source, name), 'wb') as f:
+                f.write(b'a' * size)
+        self.backup = MagicMock()
+        self.mydumper = MyDumperBackup({}, self.backup)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_group_database_files(self):
+        """test files are grouped and sized per database, metadata excluded"""
+        self.assertEqual(self.mydumper.group_database_files(self.source),
+                         [('aawiki.gz.tar', ['aawiki-schema-create.sql.gz',
+                                             'aawiki.page-schema.sql.gz',
+                                             'aawiki.page.00000.sql.gz'], 120),
+                          ('enwiki.gz.tar', ['enwiki-schema-create.sql.gz',
+                                             'enwiki.page.00000.sql.gz',
+                                             'enwiki.page.00001.sql.gz'], 2010)])
+
+    def fake_tar_and_remove(self, source, name, files):
+        """creates the tar file (empty) and removes the files, like WMFBackup.tar_and_remove"""
+        open(os.path.join(source, name), 'w').close()
+        for file_name in files:
+            os.remove(os.path.join(source, file_name))
+        return 0
+
+    def test_archive_databases(self):
+        """test the largest database is archived first, and renamed once complete"""
+        self.backup.tar_and_remove.side_effect = self.fake_tar_and_remove
+        self.assertEqual(self.mydumper.archive_databases(self.source, 1), 0)
+        self.assertEqual([c[0][1] for c in self.backup.tar_and_remove.call_args_list],
+                         ['enwiki.gz.tar.partial', 'aawiki.gz.tar.partial'])
+        self.assertEqual(sorted(os.listdir(self.source)),
+                         ['aawiki.gz.tar', 'enwiki.gz.tar', 'metadata'])
+
+        # a second run does nothing
+        self.backup.tar_and_remove.reset_mock()
+        self.assertEqual(self.mydumper.archive_databases(self.source, 1), 0)
+        self.backup.tar_and_remove.assert_not_called()
+
+    def test_archive_databases_failure(self):
+        """test failures are reported, and only the missing databases archived on retry"""
+        def fail_enwiki(source, name, files):
+            if name.startswith('enwiki'):
+                return 2
+            return self.fake_tar_and_remove(source, name, files)
+        self.backup.tar_and_remove.side_effect = fail_enwiki
+        self.assertEqual(self.mydumper.archive_databases(self.source, 2), 1)
+        self.assertNotIn('enwiki.gz.tar', os.listdir(self.source))
+
+        self.backup.tar_and_remove.reset_mock()
+        self.backup.tar_and_remove.side_effect = self.fake_tar_and_remove
+        self.assertEqual(self.mydumper.archive_databases(self.source, 2), 0)
+        self.assertEqual([c[0][1] for c in self.backup.tar_and_remove.call_args_list],
+                         ['enwiki.gz.tar.partial'])
+
+    def test_recover_partial_archives(self):
+        """test files of an interrupted archive are restored before archiving it again"""
+        with tarfile.open(os.path.join(self.source, 'enwiki.gz.tar.partial'), 'w') as tar:
+            tar.add(os.path.join(self.source, 'enwiki-schema-create.sql.gz'),
+                    arcname='enwiki-schema-create.sql.gz')
+        os.remove(os.path.join(self.source, 'enwiki-schema-create.sql.gz'))
+        self.assertEqual(self.mydumper.recover_partial_archives(self.source), 0)
+        self.assertIn('enwiki-schema-create.sql.gz', os.listdir(self.source))
+        self.assertNotIn('enwiki.gz.tar.partial', os.listdir(self.source))
+        self.assertEqual(len(self.mydumper.group_database_files(self.source)), 2)
+
+    def test_recover_truncated_archive(self):
+        """test an archive interrupted while adding its last member is recovered"""
+        path = os.path.join(self.source, 'enwiki.gz.tar.partial')
+        with tarfile.open(path, 'w') as tar:
+            for name in ['enwiki-schema-create.sql.gz', 'enwiki.page.00000.sql.gz']:
+                tar.add(os.path.join(self.source, name), arcname=name)
+        os.remove(os.path.join(self.source, 'enwiki-schema-create.sql.gz'))
+        os.truncate(path, 2048)  # in the middle of the data of the last member
+        self.assertEqual(self.mydumper.recover_partial_archives(self.source), 0)
+        self.assertEqual(os.path.getsize(os.path.join(self.source, 'enwiki-schema-create.sql.gz')), 10)
+        self.assertEqual(os.path.getsize(os.path.join(self.source, 'enwiki.page.00000.sql.gz')), 1000)
+        self.assertNotIn('enwiki.gz.tar.partial', os.listdir(self.source))
+
+    def test_recover_partial_archives_failed(self):
+        """test a partial archive whose files could not be extracted is kept"""
+        path = os.path.join(self.source, 'enwiki.gz.tar.partial')
+        with tarfile.open(path, 'w') as tar:
+            tar.add(os.path.join(self.source, 'enwiki-schema-create.sql.gz'),
+                    arcname='enwiki-schema-create.sql.gz')
+        os.remove(os.path.join(self.source, 'enwiki-schema-create.sql.gz'))
+        # e.g. the disk is full
+        with patch('wmfbackups.NullBackup.subprocess.Popen') as mock_popen:
+            mock_popen.return_value.wait.return_value = 2
+            self.assertEqual(self.mydumper.recover_partial_archives(self.source), 2)
+            self.assertNotEqual(self.mydumper.archive_databases(self.source, 2), 0)
+        self.assertIn('enwiki.gz.tar.partial', os.listdir(self.source))
+        self.backup.tar_and_remove.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
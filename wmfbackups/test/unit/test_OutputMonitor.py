@@ -0,0 +1,43 @@
+"""
+Testing of the incremental process output consumption
+"""
+
+import logging
+import unittest
+from unittest.mock import MagicMock
+
+from wmfbackups.OutputMonitor import OutputMonitor
+
+
+class TestOutputMonitor(unittest.TestCase):
+    """test output is matched line by line and only its tail is kept"""
+
+    def test_run(self):
+        """test a real process output is consumed and forwarded to the log"""
+        logger = MagicMock()
+        output = OutputMonitor('backup', logger, success_marker='completed OK!', tail_lines=3)
+        cmd = ['/bin/sh', '-c', 'for i in 1 2 3 4 5; do echo line $i; done; echo completed OK! >&2']
+        self.assertEqual(output.run(cmd), 0)
+        # stdout and stderr are read concurrently, so only the size of the tail is deterministic
+        self.assertEqual(len(output.tail), 3)
+        self.assertEqual(logger.debug.call_count, 6)
+        self.assertFalse(output.has_errors())
+
+    def test_markers(self):
+        """test error and success markers are only searched on stderr"""
+        output = OutputMonitor('backup', logging.getLogger('backup'), error_markers=(' CRITICAL ', ))
+        output.feed('** (mydumper): CRITICAL : no tables', stderr=False)
+        self.assertFalse(output.has_errors())
+        output.feed('** (mydumper): CRITICAL : no tables')
+        output.feed('finished')
+        self.assertTrue(output.has_errors())
+
+        output = OutputMonitor('prepare', logging.getLogger('backup'), success_marker='completed OK!')
+        output.feed('[00] completed OK!', stderr=False)
+        self.assertTrue(output.has_errors())
+        output.feed('[00] completed OK!')
+        self.assertFalse(output.has_errors())
+
+
+if __name__ == "__main__":
+    unittest.main()
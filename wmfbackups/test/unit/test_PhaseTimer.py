@@ -0,0 +1,49 @@
+"""
+Testing of the backup phase instrumentation
+"""
+
+import logging
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from wmfbackups.PhaseTimer import PhaseTimer
+
+
+class TestPhaseTimer(unittest.TestCase):
+    """test phases are timed, measured and recorded"""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.backup_dir = os.path.join(self.tmp.name, 'dump.s1')
+        os.mkdir(self.backup_dir)
+        self.stats = MagicMock()
+        self.timer = PhaseTimer([self.backup_dir, self.backup_dir + '.tar.gz'],
+                                logging.getLogger('backup'), self.stats)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_phase(self):
+        """test size changes are measured, and phases recorded even on early exit"""
+        timer = self.timer
+        with timer.phase('backup'):
+            with open(os.path.join(self.backup_dir, 'metadata'), 'w') as f:
+                f.write('abc')
+        with self.assertRaises(ValueError):
+            with timer.phase('compress'):
+                os.rename(self.backup_dir, self.backup_dir + '.tar.gz')
+                raise ValueError
+        self.assertEqual([p.phase for p in timer.phases], ['backup', 'compress'])
+        self.assertEqual((timer.phases[0].bytes_before, timer.phases[0].bytes_after), (0, 3))
+        self.assertEqual((timer.phases[1].bytes_before, timer.phases[1].bytes_after), (3, 3))
+        self.assertGreaterEqual(timer.phases[0].wall_time, 0)
+        self.assertGreaterEqual(timer.phases[0].cpu_time, 0)
+        self.assertEqual(self.stats.record_phase.call_count, 2)
+        self.stats.record_phase.assert_called_with(timer.phases[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+Testing of the progress monitoring of running backups
+"""
+
+import json
+import logging
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from wmfbackups.ProgressMonitor import ProgressMonitor, STALL_WARNING
+
+
+class TestProgressMonitor(unittest.TestCase):
+    """test the progress is sampled, estimated and published"""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output_dir = os.path.join(self.tmp.name, 'dump.s1.2022-01-01--00-00-00')
+        os.mkdir(self.output_dir)
+        self.log_file = os.path.join(self.tmp.name, 'dump_log.s1')
+        self.status_file = os.path.join(self.tmp.name, 'dump_status.s1')
+        self.stats = MagicMock()
+        self.stats.get_previous_size.return_value = 1000
+        self.monitor = ProgressMonitor(self.output_dir, self.status_file,
+                                       logging.getLogger('backup'), self.stats, self.log_file)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, size):
+        with open(os.path.join(self.output_dir, name), 'wb') as f:
+            f.write(b'a' * size)
+
+    @patch('wmfbackups.ProgressMonitor.time.monotonic')
+    def test_sample(self, mock_time):
+        """test sizes, tables started, throughput and eta are computed"""
+        monitor = self.monitor
+        monitor.expected_size = 1000
+        mock_time.return_value = 100
+        monitor.start_time = 0
+        self.write('enwiki.page.00000.sql.gz', 200)
+        with open(self.log_file, 'w') as f:
+            f.write('** Message: Thread 1 dumping data for `enwiki`.`page`\n'
+                    '** Message: Thread 2 dumping data for `enwiki`.`page`\n'
+                    '** Message: Thread 3 dumping data for `enwiki`.`us')  # being written
+        progress = monitor.sample()
+        self.assertEqual((progress['bytes'], progress['files'], progress['tables_started']), (200, 1, 1))
+        self.assertEqual(progress['throughput'], 2.0)
+        self.assertAlmostEqual(progress['eta'] - progress['time'], 400)
+        self.assertEqual(progress['stalled'], 0)
+
+        # later, the half written line is completed
+        mock_time.return_value = 200
+        with open(self.log_file, 'a') as f:
+            f.write('er`\n')
+        progress = monitor.sample()
+        self.assertEqual((progress['bytes'], progress['tables_started']), (200, 2))
+        self.assertEqual(progress['current_throughput'], 0.0)
+        self.assertEqual(progress['stalled'], 100)
+
+        # no previous size, no estimation
+        monitor.expected_size = None
+        self.assertIsNone(monitor.sample()['eta'])
+
+    def test_stall_warning(self):
+        """test a warning is logged once when the backup stops growing"""
+        monitor = self.monitor
+        monitor.logger = MagicMock()
+        for stalled in [10, STALL_WARNING, STALL_WARNING + 60, 0]:
+            monitor.check_stall({'stalled': stalled})
+        monitor.logger.warning.assert_called_once()
+
+    def test_start_stop(self):
+        """test the final progress is published on the status file and the stats"""
+        monitor = self.monitor
+        self.write('metadata', 10)
+        monitor.start()
+        monitor.stop()
+        with open(self.status_file) as f:
+            status = json.load(f)
+        self.assertEqual((status['bytes'], status['running']), (10, False))
+        self.assertEqual(status['expected_size'], 1000)
+        self.assertEqual(self.stats.heartbeat.call_args[0][0]['files'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+Testing of the background deletion of purged backups
+"""
+
+import logging
+import os
+import tempfile
+import time
+import unittest
+
+from wmfbackups.Reaper import Reaper, TRASH_DIR
+
+
+class TestReaper(unittest.TestCase):
+    """test discarded backups are hidden immediately and deleted on the background"""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.backup = os.path.join(self.tmp.name, 'dump.s1.2022-01-01--00-00-00')
+        os.makedirs(os.path.join(self.backup, 'enwiki'))
+        for name in ['metadata', 'enwiki/page.sql.gz', 'enwiki/user.sql.gz']:
+            with open(os.path.join(self.backup, name), 'wb') as f:
+                f.write(b'a' * 100)
+        self.reaper = Reaper('s1', logging.getLogger('backup'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_discard(self):
+        """test a discarded dir is moved to the trash, deleted and its timing measured"""
+        reaper = self.reaper
+        reaper.discard(self.backup)
+        self.assertFalse(os.path.exists(self.backup))
+        self.assertEqual(reaper.wait(), 0)
+        self.assertEqual(os.listdir(os.path.join(self.tmp.name, TRASH_DIR)), [])
+        self.assertEqual((reaper.deleted_files, reaper.deleted_bytes), (3, 300))
+        timing = reaper.timing()
+        self.assertEqual((timing.phase, timing.bytes_before, timing.bytes_after), ('purge', 300, 0))
+
+    def test_collect(self):
+        """test leftovers of previous runs of the same section are deleted"""
+        trash_dir = os.path.join(self.tmp.name, TRASH_DIR)
+        os.makedirs(os.path.join(trash_dir, 's1.abc', 'dump.s1.2021-01-01--00-00-00'))
+        os.makedirs(os.path.join(trash_dir, 's10.abc'))
+        self.reaper.collect(self.tmp.name)
+        self.assertEqual(self.reaper.wait(), 0)
+        self.assertEqual(os.listdir(trash_dir), ['s10.abc'])
+
+    def test_nothing_to_delete(self):
+        """test there is no timing to record if nothing was discarded"""
+        self.reaper.collect(self.tmp.name)
+        self.assertEqual(self.reaper.wait(), 0)
+        self.assertIsNone(self.reaper.timing())
+
+    def test_rate_limit(self):
+        """test deletions are paced according to the rate limit"""
+        reaper = Reaper('s1', logging.getLogger('backup'), rate=1000)
+        start = time.monotonic()
+        reaper.discard(self.backup)
+        reaper.wait()
+        # the last 100 bytes can only be deleted after 0.2 seconds
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+
+if __name__ == "__main__":
+    unittest.main()
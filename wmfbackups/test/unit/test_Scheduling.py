@@ -0,0 +1,115 @@
+"""
+Testing of the job scheduling helpers
+"""
+
+import threading
+import time
+import unittest
+
+from wmfbackups.Scheduling import (MemoryBudget, ResourceScheduler, lpt_order, parse_size,
+                                   simulate_makespan, simulate_pipeline)
+
+
+class TestScheduling(unittest.TestCase):
+    """test largest-first ordering and makespan estimation"""
+
+    def test_lpt_order(self):
+        """test jobs are sorted by decreasing cost, ties by name"""
+        self.assertEqual(lpt_order({'a': 1, 'b': 5, 'c': 5, 'd': 3}), ['b', 'c', 'd', 'a'])
+        self.assertEqual(lpt_order({}), [])
+
+    def test_simulate_makespan(self):
+        """test the greedy pool simulation"""
+        costs = {'a': 1, 'b': 2, 'c': 3}
+        self.assertEqual(simulate_makespan(costs, ['a', 'b', 'c'], 1), 6)
+        self.assertEqual(simulate_makespan(costs, ['a', 'b', 'c'], 2), 4)
+        self.assertEqual(simulate_makespan(costs, ['c', 'b', 'a'], 2), 3)
+        self.assertEqual(simulate_makespan(costs, ['a', 'b', 'c'], 0), 6)
+        self.assertEqual(simulate_makespan({}, [], 4), 0)
+
+    def test_simulate_pipeline(self):
+        """test transfers overlap the prepares of the previous jobs up to the given depth"""
+        stages = [(10, 20), (10, 20), (10, 5)]
+        self.assertEqual(simulate_pipeline(stages, 0), 75)
+        # the second transfer overlaps the first prepare, the third one waits for it
+        self.assertEqual(simulate_pipeline(stages, 1), 45)
+        self.assertEqual(simulate_pipeline(stages, 2), 40)
+        # jobs without prepare (e.g. dumps) do not wait for the pending ones
+        self.assertEqual(simulate_pipeline([(10, 20), (10, 20), (5, None)], 0), 60)
+        self.assertEqual(simulate_pipeline([(10, 20), (10, 20), (5, None)], 1), 40)
+        self.assertEqual(simulate_pipeline([], 1), 0)
+
+    def test_skewed_sections(self):
+        """test a dominant database sorted last alphabetically (e.g. s1: enwiki) is not started last"""
+        costs = {'db{:02d}'.format(i): 10 for i in range(16)}
+        costs['zzwiki'] = 100
+        alphabetical = simulate_makespan(costs, sorted(costs), 4)
+        self.assertEqual(alphabetical, 140)
+        self.assertEqual(simulate_makespan(costs, lpt_order(costs), 4), 100)
+
+    def test_parse_size(self):
+        """test sizes with and without unit suffixes"""
+        self.assertEqual(parse_size(1024), 1024)
+        self.assertEqual(parse_size('40G'), 40 * 1024 ** 3)
+        self.assertEqual(parse_size('512m'), 512 * 1024 ** 2)
+        self.assertEqual(parse_size('131891212K'), 131891212 * 1024)
+        self.assertRaises(ValueError, parse_size, '40 gigabytes')
+        self.assertRaises(ValueError, parse_size, '-1G')
+
+    def test_memory_budget(self):
+        """test jobs wait for memory, and one larger than the budget runs alone"""
+        budget = MemoryBudget(10)
+        budget.acquire(6)
+        budget.acquire(4)
+        acquired = threading.Event()
+        waiter = threading.Thread(target=lambda: (budget.acquire(20), acquired.set()))
+        waiter.start()
+        self.assertFalse(acquired.wait(0.1))
+        budget.release(6)
+        self.assertFalse(acquired.wait(0.1))
+        budget.release(4)
+        self.assertTrue(acquired.wait(5))
+        waiter.join()
+        self.assertEqual(budget.used, 20)
+
+    def test_resource_scheduler(self):
+        """test jobs never exceed the limits of their resources, and the largest start first"""
+        lock = threading.Lock()
+        running = {'db1': 0, 'db2': 0, 'prov1': 0, 'prov2': 0}
+        peaks = dict(running)
+        started = list()
+
+        def job(name, hosts):
+            with lock:
+                started.append(name)
+                for host in hosts:
+                    running[host] += 1
+                    peaks[host] = max(peaks[host], running[host])
+            time.sleep(0.05)
+            with lock:
+                for host in hosts:
+                    running[host] -= 1
+            return 0
+
+        scheduler = ResourceScheduler({'prov1': 2})
+        for name, hosts, cost in [('s1', ['db1', 'prov1'], 10), ('s2', ['db1', 'prov2'], 30),
+                                  ('s3', ['db2', 'prov1'], 20), ('s4', ['db2', 'prov1'], None)]:
+            scheduler.add(name, job, (name, hosts), hosts, cost)
+        self.assertEqual(scheduler.get_order(), ['s4', 's2', 's3', 's1'])
+        self.assertEqual(scheduler.run(), {'s1': 0, 's2': 0, 's3': 0, 's4': 0})
+        self.assertEqual(peaks, {'db1': 1, 'db2': 1, 'prov1': 2, 'prov2': 1})
+        # s3 waits for s4 (same source), but s2 does not
+        self.assertEqual(sorted(started[:2]), ['s2', 's4'])
+
+    def test_resource_scheduler_error(self):
+        """test an exception is raised once the running jobs finish"""
+        def fail():
+            raise OSError('failed')
+        scheduler = ResourceScheduler()
+        scheduler.add('a', fail, resources=['host'])
+        scheduler.add('b', lambda: 0, resources=['host'])
+        self.assertRaises(OSError, scheduler.run)
+
+
+if __name__ == "__main__":
+    unittest.main()
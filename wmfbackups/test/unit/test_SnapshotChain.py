@@ -0,0 +1,106 @@
+"""
+Testing of the chains of incremental snapshots
+"""
+
+import os
+import tempfile
+import unittest
+
+from wmfbackups.SnapshotChain import SnapshotChain, read_checkpoints, is_incremental
+
+
+def write_checkpoints(directory, backup_type, from_lsn, to_lsn):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'xtrabackup_checkpoints'), 'w') as f:
+        f.write('backup_type = {}\nfrom_lsn = {}\nto_lsn = {}\n'
+                'last_lsn = {}\n'.format(backup_type, from_lsn, to_lsn, to_lsn))
+
+
+class TestSnapshotChain(unittest.TestCase):
+    """test the incremental snapshots chain is recorded and limited to its max depth"""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, '.snapshot_chain.s1')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_read_checkpoints(self):
+        """test the checkpoints file is parsed, with integer lsns"""
+        directory = os.path.join(self.tmp.name, 'snapshot')
+        write_checkpoints(directory, 'incremental', 100, 200)
+        checkpoints = read_checkpoints(directory)
+        self.assertEqual(checkpoints['from_lsn'], 100)
+        self.assertEqual(checkpoints['to_lsn'], 200)
+        self.assertTrue(is_incremental(checkpoints))
+        write_checkpoints(directory, 'full-backuped', 0, 200)
+        self.assertFalse(is_incremental(read_checkpoints(directory)))
+        with open(os.path.join(directory, 'xtrabackup_checkpoints'), 'w') as f:
+            f.write('backup_type = full-backuped\n')
+        self.assertRaises(ValueError, read_checkpoints, directory)
+        self.assertRaises(OSError, read_checkpoints, self.tmp.name)
+
+    def test_chain(self):
+        """test incrementals are taken until the max depth, and a full one resets the chain"""
+        chain = SnapshotChain(self.path, max_depth=2)
+        self.assertFalse(chain.load())
+        self.assertIsNone(chain.get_incremental_lsn())
+        self.assertTrue(chain.add('full', {'backup_type': 'full-backuped', 'from_lsn': 0,
+                                           'to_lsn': 100}))
+        self.assertEqual(chain.get_incremental_lsn(), 100)
+        incremental = {'backup_type': 'incremental', 'from_lsn': 100, 'to_lsn': 150}
+        self.assertTrue(chain.add('inc1', incremental))
+        self.assertTrue(chain.add('inc1', incremental))  # recorded only once
+        # a gap on the lsns is not a valid chain
+        self.assertFalse(chain.add('inc2', {'backup_type': 'incremental', 'from_lsn': 120,
+                                            'to_lsn': 200}))
+        self.assertEqual(chain.depth, 1)
+        self.assertTrue(chain.add('inc2', {'backup_type': 'incremental', 'from_lsn': 150,
+                                           'to_lsn': 200}))
+        self.assertIsNone(chain.get_incremental_lsn())  # max depth reached
+        self.assertTrue(chain.save())
+
+        loaded = SnapshotChain(self.path, max_depth=2)
+        self.assertTrue(loaded.load())
+        self.assertEqual([member['name'] for member in loaded.members], ['full', 'inc1', 'inc2'])
+        loaded.add('full2', {'backup_type': 'full-backuped', 'from_lsn': 0, 'to_lsn': 300})
+        self.assertEqual(loaded.depth, 0)
+        self.assertEqual(loaded.get_incremental_lsn(), 300)
+
+        # disabled chains always take full snapshots
+        disabled = SnapshotChain(self.path)
+        disabled.load()
+        self.assertIsNone(disabled.get_incremental_lsn())
+
+    def test_dependencies(self):
+        """test the members needed to recover each snapshot, and the ones depending on it"""
+        chain = SnapshotChain(self.path, max_depth=2)
+        chain.add('full', {'backup_type': 'full-backuped', 'from_lsn': 0, 'to_lsn': 100})
+        chain.add('inc1', {'backup_type': 'incremental', 'from_lsn': 100, 'to_lsn': 150})
+        chain.add('full2', {'backup_type': 'full-backuped', 'from_lsn': 0, 'to_lsn': 200})
+        chain.add('inc2', {'backup_type': 'incremental', 'from_lsn': 200, 'to_lsn': 250})
+        self.assertEqual([member['name'] for member in chain.get_chain()], ['full2', 'inc2'])
+        self.assertEqual([member['name'] for member in chain.get_chain('inc1')], ['full', 'inc1'])
+        self.assertEqual(chain.get_chain('missing'), [])
+        self.assertEqual(chain.get_dependents('full'), ['inc1'])
+        self.assertEqual(chain.get_dependents('inc1'), [])
+        self.assertEqual(chain.get_dependents('full2'), ['inc2'])
+        chain.remove(['full', 'inc1'])
+        self.assertEqual([member['name'] for member in chain.members], ['full2', 'inc2'])
+        self.assertEqual(chain.get_incremental_lsn(), 250)
+        # a chain whose full snapshot is not recorded cannot be continued
+        chain.remove(['full2'])
+        self.assertEqual(chain.get_chain(), [])
+        self.assertIsNone(chain.get_incremental_lsn())
+        self.assertFalse(chain.add('inc3', {'backup_type': 'incremental', 'from_lsn': 250,
+                                            'to_lsn': 300}))
+
+    def test_load_corrupted(self):
+        """test an unreadable chain is considered empty"""
+        with open(self.path, 'w') as f:
+            f.write('{not json')
+        chain = SnapshotChain(self.path, max_depth=2)
+        self.assertFalse(chain.load())
+        self.assertEqual(chain.members, [])
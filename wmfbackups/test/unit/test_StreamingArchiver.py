@@ -0,0 +1,75 @@
+"""
+Testing of the StreamingArchiver class
+"""
+
+import logging
+import os
+import tarfile
+import tempfile
+import time
+import unittest
+
+from wmfbackups.StreamingArchiver import StreamingArchiver
+
+
+class TestStreamingArchiver(unittest.TestCase):
+    """test the compression of a backup while it is being generated"""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.backup_dir = self.tmp.name
+        self.output_dir = os.path.join(self.backup_dir, 'dump.s1')
+        os.mkdir(self.output_dir)
+        self.archiver = StreamingArchiver(self.backup_dir, 'dump.s1', 'dump.s1.tar.gz',
+                                          ['gzip', '-c'], logging.getLogger('backup'),
+                                          quiet_period=1000, poll_interval=1000)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, content):
+        """create a file inside the backup dir"""
+        path = os.path.join(self.output_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_finish(self):
+        """test old files are added while running, and the rest at the end"""
+        old = self.write('enwiki.page.00000.sql.gz', 'abc')
+        os.utime(old, (time.time() - 2000, time.time() - 2000))
+        self.write('metadata', 'Finished dump')
+        archiver = self.archiver
+        archiver.start()
+        archiver.add_entries()
+        self.assertEqual(list(archiver.added), ['dump.s1', 'enwiki.page.00000.sql.gz'])
+        self.assertEqual(archiver.finish(), 0)
+        self.assertFalse(os.path.exists(self.output_dir))
+        with tarfile.open(os.path.join(self.backup_dir, 'dump.s1.tar.gz')) as tar:
+            self.assertEqual(tar.getnames(), ['dump.s1', 'dump.s1/enwiki.page.00000.sql.gz',
+                                              'dump.s1/metadata'])
+
+    def test_changed_file(self):
+        """test the tarball is discarded if a file changes after being added"""
+        old = self.write('enwiki.page.00000.sql.gz', 'abc')
+        os.utime(old, (time.time() - 2000, time.time() - 2000))
+        archiver = self.archiver
+        archiver.start()
+        archiver.add_entries()
+        self.write('enwiki.page.00000.sql.gz', 'abcdef')
+        self.assertNotEqual(archiver.finish(), 0)
+        self.assertTrue(os.path.exists(old))
+        self.assertFalse(os.path.exists(os.path.join(self.backup_dir, 'dump.s1.tar.gz')))
+
+    def test_abort(self):
+        """test aborting removes the partial tarball and keeps the files"""
+        self.write('metadata', '')
+        self.archiver.start()
+        self.archiver.abort()
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'metadata')))
+        self.assertFalse(os.path.exists(os.path.join(self.backup_dir, 'dump.s1.tar.gz')))
+
+
+if __name__ == "__main__":
+    unittest.main()
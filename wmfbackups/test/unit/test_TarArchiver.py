@@ -0,0 +1,81 @@
+"""
+Testing of the in-process tar archiver
+"""
+
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import unittest
+
+from wmfbackups.TarArchiver import tar_and_remove, untar_and_remove
+
+FILES = {'enwiki-schema-create.sql.gz': b'x' * 10,
+         'enwiki.page.00000.sql.gz': os.urandom(100000),
+         'enwiki.page-schema.sql.gz': b''}
+
+
+class TestTarArchiver(unittest.TestCase):
+    """test archives are generated and extracted like GNU tar does"""
+
+    def setUp(self):
+        """Set up the tests."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = self.tmp.name
+        for name, content in FILES.items():
+            with open(os.path.join(self.source, name), 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def check_files(self, directory):
+        """checks the original files are at directory"""
+        for name, content in FILES.items():
+            with open(os.path.join(directory, name), 'rb') as f:
+                self.assertEqual(f.read(), content)
+
+    def test_tar_and_remove(self):
+        """test files are archived and removed, and the result read back"""
+        self.assertEqual(tar_and_remove(self.source, 'enwiki.gz.tar', sorted(FILES)), 0)
+        self.assertEqual(os.listdir(self.source), ['enwiki.gz.tar'])
+        with tarfile.open(os.path.join(self.source, 'enwiki.gz.tar')) as tar:
+            self.assertEqual(tar.getnames(), sorted(FILES))
+        self.assertEqual(untar_and_remove('enwiki.gz.tar', self.source), 0)
+        self.assertEqual(sorted(os.listdir(self.source)), sorted(FILES))
+        self.check_files(self.source)
+
+    def test_directories(self):
+        """test directories are archived recursively"""
+        os.mkdir(os.path.join(self.source, 'dump'))
+        for name in FILES:
+            os.rename(os.path.join(self.source, name), os.path.join(self.source, 'dump', name))
+        self.assertEqual(tar_and_remove(self.source, 'dump.tar', ['dump']), 0)
+        self.assertEqual(os.listdir(self.source), ['dump.tar'])
+        self.assertEqual(untar_and_remove('dump.tar', self.source), 0)
+        self.check_files(os.path.join(self.source, 'dump'))
+
+    def test_errors(self):
+        """test missing files and corrupted archives are reported"""
+        self.assertNotEqual(tar_and_remove(self.source, 'a.tar', ['missing']), 0)
+        with open(os.path.join(self.source, 'corrupted.tar'), 'wb') as f:
+            f.write(b'not a tar')
+        self.assertNotEqual(untar_and_remove('corrupted.tar', self.source), 0)
+        self.assertTrue(os.path.exists(os.path.join(self.source, 'corrupted.tar')))
+
+    @unittest.skipIf(shutil.which('tar') is None, 'GNU tar is not available')
+    def test_gnu_tar_compatibility(self):
+        """test GNU tar extracts the generated archives"""
+        self.assertEqual(tar_and_remove(self.source, 'enwiki.gz.tar', sorted(FILES)), 0)
+        subprocess.run(['tar', '--extract', '--file', 'enwiki.gz.tar'], cwd=self.source, check=True)
+        self.check_files(self.source)
+        os.remove(os.path.join(self.source, 'enwiki.gz.tar'))
+        subprocess.run(['tar', '--create', '--remove-files', '--file', 'enwiki.gz.tar'] + sorted(FILES),
+                       cwd=self.source, check=True)
+        self.assertEqual(untar_and_remove('enwiki.gz.tar', self.source), 0)
+        self.check_files(self.source)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+Testing of the concurrent execution of dependent tasks
+"""
+
+import threading
+import time
+import unittest
+
+from wmfbackups.TaskGraph import TaskGraph
+
+
+class TestTaskGraph(unittest.TestCase):
+    """test tasks run concurrently, but only after their dependencies succeeded"""
+
+    def test_run(self):
+        """test independent tasks overlap and dependent ones wait"""
+        finished = list()
+        barrier = threading.Barrier(2, timeout=5)
+
+        def task(name, wait_for_other=False):
+            if wait_for_other:
+                barrier.wait()  # only returns if both tasks run at the same time
+            finished.append(name)
+            return 0
+
+        graph = TaskGraph()
+        graph.add('metrics', task, ('metrics', True))
+        graph.add('archive', task, ('archive', True))
+        graph.add('compress', task, ('compress', ), dependencies=['archive', 'missing'])
+        self.assertEqual(graph.run(), {'metrics': 0, 'archive': 0, 'compress': 0})
+        self.assertLess(finished.index('archive'), finished.index('compress'))
+
+    def test_failure(self):
+        """test tasks depending on a failed or skipped one are not run"""
+        graph = TaskGraph()
+        graph.add('archive', lambda: 14)
+        graph.add('compress', lambda: 0, dependencies=['archive'])
+        graph.add('upload', lambda: 0, dependencies=['compress'])
+        graph.add('metrics', lambda: 0)
+        self.assertEqual(graph.run(), {'archive': 14, 'compress': None, 'upload': None,
+                                       'metrics': 0})
+
+    def test_exception(self):
+        """test exceptions are raised once the running tasks finish"""
+        finished = list()
+
+        def fail():
+            raise OSError('disk full')
+
+        def slow():
+            time.sleep(0.1)
+            finished.append('slow')
+            return 0
+
+        graph = TaskGraph()
+        graph.add('archive', fail)
+        graph.add('metrics', slow)
+        self.assertRaises(OSError, graph.run)
+        self.assertEqual(finished, ['slow'])
+
+        graph = TaskGraph()
+        graph.add('a', lambda: 0, dependencies=['b'])
+        graph.add('b', lambda: 0, dependencies=['a'])
+        self.assertRaises(ValueError, graph.run)
+
+
+if __name__ == "__main__":
+    unittest.main()
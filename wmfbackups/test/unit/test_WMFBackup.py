@@ -1,8 +1,17 @@
+import os
+import shutil
+import tarfile
+import tempfile
+import time
 import unittest
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 from freezegun import freeze_time
 
+from wmfbackups.Checkpoint import Checkpoint
+from wmfbackups.MariaBackup import MariaBackup
+from wmfbackups.SnapshotChain import SnapshotChain
+import wmfbackups.TarArchiver as TarArchiver
 from wmfbackups.WMFBackup import WMFBackup
 
 
@@ -35,6 +44,11 @@ class TestWMFBackup(unittest.TestCase):
         b2.generate_file_name('/srv/backups/nulls/ongoing')
         self.assertEqual(b2.file_name, 'null.test.2022-01-03--00-00-00.tar.gz')
 
+        # compressed with zstd
+        b3 = WMFBackup('test', {'type': 'null', 'compress': True, 'compressor': 'zstd'})
+        b3.generate_file_name('/srv/backups/nulls/ongoing')
+        self.assertEqual(b3.file_name, 'null.test.2022-01-03--00-00-00.tar.zst')
+
     @patch('os.path.isdir')
     def test_parse_backup_file(self, mock):
         """Test the parser for absolute paths """
@@ -68,48 +82,295 @@ class TestWMFBackup(unittest.TestCase):
         mock.return_value = True
         self.assertEqual(b.parse_backup_file(), None)
 
-    @patch('os.listdir')
-    def test_find_backup_file(self, mock):
+    def create_files(self, directory, names):
+        """Replaces the contents of directory with empty dirs with the given names"""
+        for name in os.listdir(directory):
+            os.rmdir(os.path.join(directory, name))
+        for name in names:
+            os.mkdir(os.path.join(directory, name))
+
+    def test_find_backup_file(self):
         """test with default paths"""
         b = self.backup
+        with tempfile.TemporaryDirectory() as directory:
+            # basic run
+            self.create_files(directory, [
+                'dump.test.2022-01-01--00-00-00',
+                'null.another_section.2022-01-02--00-00-00',
+                'null.test.2022-01-02--00-00-00',
+                'garbage',
+                'null_log.test',
+                '.dotfile'
+            ])
+            self.assertEqual(b.find_backup_file(directory), 0)
+            self.assertEqual(b.dir_name, 'null.test.2022-01-02--00-00-00')
+            self.assertEqual(b.file_name, 'null.test.2022-01-02--00-00-00')
+            self.assertEqual(b.log_file, os.path.join(directory, 'null_log.test'))
 
-        # basic run
-        mock.return_value = [
-            'dump.test.2022-01-01--00-00-00',
-            'null.another_section.2022-01-02--00-00-00',
-            'null.test.2022-01-02--00-00-00',
-            'garbage',
-            'null_log.test',
-            '.dotfile'
-            ]
-        self.assertEqual(b.find_backup_file('/a/dir'), 0)
-        self.assertEqual(b.dir_name, 'null.test.2022-01-02--00-00-00')
-        self.assertEqual(b.file_name, 'null.test.2022-01-02--00-00-00')
-        self.assertEqual(b.log_file, '/a/dir/null_log.test')
+            # no good backup candidates
+            self.create_files(directory, [
+                'dump.test.2022-01-01--00-00-00',
+                'null.another_section.2022-01-02--00-00-00',
+                'garbage',
+                'null_log.test',
+                '.dotfile'
+            ])
+            self.assertEqual(b.find_backup_file(directory), None)
+
+            # already compressed, whatever the configured compressor
+            self.create_files(directory, [
+                'null.test.2022-01-02--00-00-00.tar.zst',
+                'garbage'
+            ])
+            self.assertEqual(b.find_backup_file(directory), 0)
+            self.assertEqual(b.dir_name, 'null.test.2022-01-02--00-00-00')
+            self.assertEqual(b.file_name, 'null.test.2022-01-02--00-00-00.tar.zst')
 
-        # no good backup candidates
-        mock.return_value = [
-            'dump.test.2022-01-01--00-00-00',
-            'null.another_section.2022-01-02--00-00-00',
-            'garbage',
-            'null_log.test',
-            '.dotfile'
-        ]
-        self.assertEqual(b.find_backup_file('/a/dir'), None)
-
-        # too many backup candidates
-        mock.return_value = [
-            'null.test.2022-01-01--00-00-00',
-            'null.test.2022-01-02--00-00-00',
-            'garbage'
-        ]
-        self.assertEqual(b.find_backup_file('/a/dir'), None)
+            # too many backup candidates
+            self.create_files(directory, [
+                'null.test.2022-01-01--00-00-00',
+                'null.test.2022-01-02--00-00-00',
+                'garbage'
+            ])
+            self.assertEqual(b.find_backup_file(directory), None)
+
+        # missing dir
+        self.assertEqual(b.find_backup_file('/a/missing/dir'), None)
 
     def test_run(self):
         """Test run"""
         b = self.backup
         self.assertEqual(b.run(), 0)
 
+    @patch('wmfbackups.BackupStatistics.DisabledBackupStatistics.record_phase')
+    def test_run_transfer_phase(self, mock_record):
+        """Test the transfer of a remote backup is recorded as its first phase"""
+        with tempfile.TemporaryDirectory() as backup_dir:
+            b = WMFBackup('test', {'type': 'null', 'backup_dir': backup_dir,
+                                   'transfer_start': 1640995200.0, 'transfer_time': 600.0})
+            self.assertEqual(b.run(), 0)
+            timing = mock_record.call_args_list[0][0][0]
+            self.assertEqual((timing.phase, timing.start, timing.wall_time),
+                             ('transfer', 1640995200.0, 600.0))
+
+    @patch('wmfbackups.NullBackup.NullBackup.errors_on_log')
+    def test_run_resume(self, mock):
+        """Test resuming skips the completed phases and removes the checkpoint"""
+        with tempfile.TemporaryDirectory() as backup_dir:
+            os.mkdir(os.path.join(backup_dir, 'null.test.2022-01-02--00-00-00'))
+            checkpoint = Checkpoint(backup_dir, 'null.test.2022-01-02--00-00-00')
+            checkpoint.mark_done('check_log')
+            b = WMFBackup('test', {'type': 'null', 'backup_dir': backup_dir, 'resume': True})
+            self.assertEqual(b.run(), 0)
+            mock.assert_not_called()
+            self.assertFalse(checkpoint.exists())
+
+    @patch('wmfbackups.WMFBackup.WMFBackup.tar_and_remove', return_value=0)
+    def test_run_resume_failed_compression(self, mock_compress):
+        """Test resuming a failed compression discards its partial tarball and compresses again"""
+        with tempfile.TemporaryDirectory() as backup_dir:
+            dir_name = 'null.test.2022-01-02--00-00-00'
+            os.mkdir(os.path.join(backup_dir, dir_name))
+            with open(os.path.join(backup_dir, dir_name + '.tar.gz'), 'w') as f:
+                f.write('partial')
+            checkpoint = Checkpoint(backup_dir, dir_name)
+            for phase in ['backup', 'check_log', 'check_metadata', 'prepare', 'metrics']:
+                checkpoint.mark_done(phase)
+            b = WMFBackup('test', {'type': 'null', 'backup_dir': backup_dir, 'resume': True,
+                                   'compress': True})
+            self.assertEqual(b.run(), 0)
+            mock_compress.assert_called_once()
+            self.assertEqual(mock_compress.call_args[0][1:3], (dir_name + '.tar.gz', [dir_name]))
+            self.assertFalse(os.path.exists(os.path.join(backup_dir, dir_name + '.tar.gz')))
+
+    @patch('wmfbackups.WMFBackup.WMFBackup.tar_and_remove')
+    def test_run_failed_compression(self, mock_compress):
+        """Test a failed compression deletes its partial tarball and keeps the checkpoint"""
+        with tempfile.TemporaryDirectory() as backup_dir:
+            def compress(source, name, files, compression=None):
+                with open(os.path.join(source, name), 'w') as f:
+                    f.write('partial')
+                return 2
+
+            mock_compress.side_effect = compress
+            b = WMFBackup('test', {'type': 'null', 'backup_dir': backup_dir, 'compress': True})
+            self.assertEqual(b.run(), 11)
+            self.assertFalse(os.path.exists(os.path.join(backup_dir, b.file_name)))
+            self.assertTrue(Checkpoint(backup_dir, b.dir_name).load())
+
+    @patch('wmfbackups.WMFBackup.WMFBackup.tar_and_remove', return_value=2)
+    @patch('wmfbackups.BackupStatistics.DisabledBackupStatistics.gather_metrics', return_value=False)
+    def test_run_failed_metrics(self, mock_metrics, mock_compress):
+        """Test metrics that could not be stored are not marked as completed, so resume retries them"""
+        with tempfile.TemporaryDirectory() as backup_dir:
+            b = WMFBackup('test', {'type': 'null', 'backup_dir': backup_dir, 'compress': True})
+            self.assertEqual(b.run(), 11)
+            checkpoint = Checkpoint(backup_dir, b.dir_name)
+            self.assertTrue(checkpoint.load())
+            self.assertTrue(checkpoint.is_done('prepare'))
+            self.assertFalse(checkpoint.is_done('metrics'))
+
+    @patch('wmfbackups.WMFBackup.WMFBackup.tar_and_remove', side_effect=lambda *args, **kwargs: time.sleep(0.5) or 0)
+    @patch('wmfbackups.BackupStatistics.DisabledBackupStatistics.gather_metrics', side_effect=lambda: time.sleep(0.5))
+    def test_run_metrics_concurrently(self, mock_metrics, mock_compress):
+        """Test metrics are gathered at the same time than the backup is compressed"""
+        with tempfile.TemporaryDirectory() as backup_dir:
+            b = WMFBackup('test', {'type': 'null', 'backup_dir': backup_dir, 'compress': True})
+            start = time.monotonic()
+            self.assertEqual(b.run(), 0)
+            self.assertLess(time.monotonic() - start, 0.9)
+            mock_metrics.assert_called_once()
+            mock_compress.assert_called_once()
+
+    def test_os_rename(self):
+        """Test moves on the same filesystem are renames, other ones a copy and delete"""
+        b = self.backup
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'source')
+            os.makedirs(os.path.join(source, 'db1'))
+            for name, size in [('db1/t1.sql', 10), ('db1/t2.sql', 1000), ('metadata', 1)]:
+                with open(os.path.join(source, name), 'wb') as f:
+                    f.write(b'a' * size)
+            with patch('wmfbackups.WMFBackup.WMFBackup.copy_and_remove') as mock:
+                self.assertEqual(b.os_rename(source, os.path.join(directory, 'renamed')), 0)
+                mock.assert_not_called()
+            with patch('wmfbackups.WMFBackup.WMFBackup.same_filesystem', return_value=False):
+                self.assertEqual(b.os_rename(os.path.join(directory, 'renamed'),
+                                             os.path.join(directory, 'copied')), 0)
+            self.assertEqual(sorted(os.listdir(directory)), ['copied'])
+            with open(os.path.join(directory, 'copied', 'db1', 't2.sql'), 'rb') as f:
+                self.assertEqual(f.read(), b'a' * 1000)
+            self.assertNotEqual(b.os_rename(source, os.path.join(directory, 'other')), 0)
+
+    @freeze_time('2022-01-30')
+    def test_purge_backups(self):
+        """Test only expired backups of the same section are purged, on the background"""
+        b = self.backup
+        b.stats = MagicMock()
+        with tempfile.TemporaryDirectory() as directory:
+            names = ['null.test.2022-01-01--00-00-00', 'null.test.2022-01-29--00-00-00.tar.gz',
+                     'null.other.2022-01-01--00-00-00']
+            for name in names:
+                os.mkdir(os.path.join(directory, name))
+            self.assertEqual(b.purge_backups(source=directory), 0)
+            self.assertEqual(b.wait_for_purge(), 0)
+            self.assertEqual(sorted(os.listdir(directory)), ['.trash'] + sorted(names[1:]))
+            self.assertEqual(b.stats.record_phase.call_args[0][0].phase, 'purge')
+            b.stats.close.assert_called_once()
+
+    @freeze_time('2022-01-30')
+    def test_purge_backups_chain(self):
+        """Test expired snapshots are kept while more recent ones of their chain are kept"""
+        b = WMFBackup('test', {'type': 'snapshot'})
+        with tempfile.TemporaryDirectory() as directory:
+            names = ['snapshot.test.2022-01-01--00-00-00', 'snapshot.test.2022-01-02--00-00-00',
+                     'snapshot.test.2022-01-03--00-00-00', 'snapshot.test.2022-01-29--00-00-00']
+            for name in names:
+                os.mkdir(os.path.join(directory, name))
+            chain = SnapshotChain(os.path.join(directory, '.snapshot_chain.test'))
+            chain.add(names[0], {'backup_type': 'full-backuped', 'to_lsn': 100})
+            chain.add(names[1], {'backup_type': 'incremental', 'from_lsn': 100, 'to_lsn': 200})
+            chain.add(names[2], {'backup_type': 'full-backuped', 'to_lsn': 300})
+            chain.add(names[3], {'backup_type': 'incremental', 'from_lsn': 300, 'to_lsn': 400})
+            self.assertEqual(b.purge_backups(source=directory, chain=chain), 0)
+            self.assertEqual(b.wait_for_purge(), 0)
+            self.assertEqual(sorted(os.listdir(directory)), ['.snapshot_chain.test', '.trash'] + names[2:])
+            self.assertEqual([member['name'] for member in chain.members], names[2:])
+
+    @patch('wmfbackups.WMFBackup.OutputMonitor')
+    def test_restore_chain(self, mock_output):
+        """Test a chain is copied, unarchived and applied, leaving the backups untouched"""
+        mock_output.return_value.has_errors.return_value = False
+        version = {'major': '10.4', 'minor': 22, 'vendor': 'Percona Server'}
+        with tempfile.TemporaryDirectory() as backup_dir, tempfile.TemporaryDirectory() as target_dir, \
+                patch.object(MariaBackup, '_get_xtrabackup_version', return_value=version):
+            b = WMFBackup('test', {'type': 'snapshot', 'backup_dir': backup_dir,
+                                   'archive_method': 'python'})
+            self.assertEqual(b.restore_chain(target_dir), 10)  # no chain yet
+            full = 'snapshot.test.2022-01-01--00-00-00'
+            incremental = 'snapshot.test.2022-01-02--00-00-00'
+            os.makedirs(os.path.join(backup_dir, full, 'enwiki'))
+            with open(os.path.join(backup_dir, full, 'enwiki', 'page.ibd'), 'w') as f:
+                f.write('page')
+            self.assertEqual(TarArchiver.tar_and_remove(os.path.join(backup_dir, full),
+                                                        'enwiki.tar', ['enwiki']), 0)
+            with tarfile.open(os.path.join(backup_dir, incremental + '.tar'), 'w') as tar:
+                directory = os.path.join(target_dir, incremental)
+                os.mkdir(directory)
+                tar.add(directory, incremental)
+                os.rmdir(directory)
+            chain = SnapshotChain(os.path.join(backup_dir, '.snapshot_chain.test'))
+            chain.add(full, {'backup_type': 'full-backuped', 'to_lsn': 100})
+            chain.add(incremental, {'backup_type': 'incremental', 'from_lsn': 100, 'to_lsn': 200})
+            chain.save()
+
+            self.assertEqual(b.restore_chain(target_dir), 0)
+            self.assertEqual(os.listdir(target_dir), [full])
+            self.assertTrue(os.path.isfile(os.path.join(target_dir, full, 'enwiki', 'page.ibd')))
+            cmd = mock_output.return_value.run.call_args[0][0]
+            self.assertEqual(cmd[cmd.index('--incremental-dir') + 1],
+                             os.path.join(target_dir, incremental))
+            self.assertEqual(sorted(os.listdir(backup_dir)),
+                             ['.snapshot_chain.test', full, incremental + '.tar'])
+            self.assertEqual(os.listdir(os.path.join(backup_dir, full)), ['enwiki.tar'])
+            # it is not overwritten
+            self.assertEqual(b.restore_chain(target_dir), 11)
+
+    def test_restore_backup(self):
+        """Test the latest full snapshot, without a chain, is copied and unarchived"""
+        with tempfile.TemporaryDirectory() as backup_dir, tempfile.TemporaryDirectory() as target_dir:
+            b = WMFBackup('test', {'type': 'snapshot', 'backup_dir': backup_dir,
+                                   'archive_method': 'python'})
+            self.assertEqual(b.restore_backup(target_dir), 10)  # no backup yet
+            name = 'snapshot.test.2022-01-02--00-00-00'
+            directory = os.path.join(backup_dir, name)
+            os.makedirs(os.path.join(directory, 'enwiki'))
+            with open(os.path.join(directory, 'enwiki', 'page.ibd'), 'w') as f:
+                f.write('page')
+            with open(os.path.join(directory, 'xtrabackup_checkpoints'), 'w') as f:
+                f.write('backup_type = full-prepared\n')
+            self.assertEqual(TarArchiver.tar_and_remove(directory, 'enwiki.tar', ['enwiki']), 0)
+            with tarfile.open(os.path.join(backup_dir, name + '.tar'), 'w') as tar:
+                tar.add(directory, name)
+            shutil.rmtree(directory)
+            os.mkdir(os.path.join(backup_dir, 'snapshot.test.2022-01-01--00-00-00'))  # older
+
+            self.assertEqual(b.restore_backup(target_dir), 0)
+            self.assertEqual(os.listdir(target_dir), [name])
+            self.assertEqual(sorted(os.listdir(os.path.join(target_dir, name))),
+                             ['enwiki', 'xtrabackup_checkpoints'])
+            with open(os.path.join(target_dir, name, 'enwiki', 'page.ibd')) as f:
+                self.assertEqual(f.read(), 'page')
+            self.assertEqual(sorted(os.listdir(backup_dir)),
+                             ['snapshot.test.2022-01-01--00-00-00', name + '.tar'])
+            # it is not overwritten
+            self.assertEqual(b.restore_backup(target_dir), 11)
+
+    def test_copy_and_remove_error(self):
+        """Test failed copies are reported, and both the source and destination left untouched"""
+        b = self.backup
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'source')
+            os.mkdir(source)
+            for name in ['t1.sql', 't2.sql']:
+                with open(os.path.join(source, name), 'w') as f:
+                    f.write(name)
+            with patch('shutil.copy2', side_effect=OSError(28, 'No space left on device')):
+                self.assertEqual(b.copy_and_remove(source, os.path.join(directory, 'copied')), 28)
+            self.assertEqual(sorted(os.listdir(directory)), ['source'])
+            self.assertEqual(sorted(os.listdir(source)), ['t1.sql', 't2.sql'])
+
+    def test_copy_and_remove_file_error(self):
+        """Test the partial copy of a failed file copy is deleted, and the source kept"""
+        b = self.backup
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'source.tar.gz')
+            with open(source, 'w') as f:
+                f.write('tarball')
+            with patch('os.rename', side_effect=OSError(28, 'No space left on device')):
+                self.assertEqual(b.copy_and_remove(source, os.path.join(directory, 'copied')), 28)
+            self.assertEqual(os.listdir(directory), ['source.tar.gz'])
+
 
 if __name__ == "__main__":
     unittest.main()